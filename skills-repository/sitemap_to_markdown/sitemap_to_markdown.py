@@ -11,6 +11,8 @@
 #     "python-dateutil",
 #     "pybloom-live",
 #     "readability-lxml",
+#     "lxml",
+#     "cssselect",
 #     "pypdf",
 #     "jinja2",
 #     "boto3",
@@ -31,26 +33,46 @@ import random
 import time
 import asyncio
 import subprocess # Added for Phase 6
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
 import xml.etree.ElementTree as ET
 from datetime import datetime, timezone
 import hashlib
-from urllib.parse import urlparse, unquote, urljoin
-from typing import Optional, Iterator, Tuple, Dict, Any, Set, List
+import math
+import mmap
+import shutil
+import functools
+import contextlib
+from abc import ABC, abstractmethod
+import zlib
+import struct
+import socket
+import ipaddress
+from array import array
+import gzip
+import heapq
+import posixpath
+import difflib
+import tempfile
+from urllib.parse import urlparse, unquote, urljoin, urldefrag
+from urllib.request import getproxies
+from typing import Optional, Iterator, Tuple, Dict, Any, Set, List, Callable, Literal, get_args
 from pathlib import Path
 
 import typer
 from pydantic import BaseModel, Field
 import httpx
+import httpcore
 import aiofiles
 import html2text
 from bs4 import BeautifulSoup
 from dateutil import parser as date_parser
 import mimetypes
-from io import BytesIO
+from io import BytesIO, TextIOWrapper
 import sqlite3
 import zipfile
 import tarfile
-from collections import deque
+from collections import Counter, deque
 
 # Phase 6 Imports
 try:
@@ -61,7 +83,8 @@ except ImportError:
 # Phase 5 Imports
 try:
     import boto3
-    from botocore.exceptions import NoCredentialsError
+    from botocore.config import Config as BotoConfig
+    from botocore.exceptions import ClientError, NoCredentialsError
 except ImportError:
     boto3 = None
 
@@ -79,6 +102,46 @@ try:
 except ImportError:
     Document = None
 
+# Parse-once HTML backends
+try:
+    from lxml import html as lxml_html
+    from lxml.cssselect import CSSSelector
+    from lxml.etree import ParserError as LxmlParserError
+except ImportError:
+    lxml_html = None
+
+try:
+    from selectolax.lexbor import LexborHTMLParser as SelectolaxParser
+except ImportError:
+    try:
+        from selectolax.parser import HTMLParser as SelectolaxParser
+    except ImportError:
+        SelectolaxParser = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import brotli
+except ImportError:
+    try:
+        import brotlicffi as brotli
+    except ImportError:
+        brotli = None
+
+try:
+    import h2
+except ImportError:
+    h2 = None
+
+try:
+    import pyarrow
+    import pyarrow.parquet as pq
+except ImportError:
+    pyarrow = None
+
 try:
     from pypdf import PdfReader
 except ImportError:
@@ -95,53 +158,130 @@ NS = '{http://www.sitemaps.org/schemas/sitemap/0.9}'
 USER_AGENT = "Mozilla/5.0 (compatible; SitemapToMarkdown/1.0; +https://github.com/LeonAI-DO/Agent-Skills)"
 DEFAULT_RATE_LIMIT = 1.0  # requests per second
 DEFAULT_BATCH_SIZE = 1000
+DEFAULT_FRONTIER_MEMORY_MB = 64
+FILTER_SAMPLE_SIZE = 10
+DEFAULT_CONCURRENCY = 5
+DEFAULT_MIN_CONCURRENCY = 1
+DEFAULT_MAX_CONCURRENCY = 50
 MAX_RETRIES = 3
+MAX_CONNECTIONS = 100
+DEFAULT_CONNECTIONS_PER_HOST = 32
+DNS_CACHE_TTL_SEC = 300.0
+TRANSPORT_STATS_HOSTS = 20
+DEFAULT_MAX_PAGE_MB = 50
+ASSET_CONCURRENCY = 16
+PAGE_CONTENT_TYPES = ('text/', 'application/xhtml', 'application/xml')
+DEFAULT_PAGE_RETRIES = 2
+RETRY_BASE_DELAY_SEC = 5.0
+RETRY_MAX_DELAY_SEC = 300.0
+DEFAULT_BREAKER_THRESHOLD = 5
+DEFAULT_BREAKER_COOLDOWN_SEC = 30.0
+BREAKER_MAX_COOLDOWN_SEC = 600.0
+BREAKER_MAX_TRIPS = 6
+ROBOTS_TTL_SEC = 86400.0
+ROBOTS_ERROR_TTL_SEC = 300.0
+ROBOTS_MAX_BYTES = 512 * 1024
 CHECKPOINT_INTERVAL = 100
+DEFAULT_CHECKPOINT_INTERVAL_SEC = 30.0
+JOURNAL_SEGMENT_RECORDS = 100_000
+JOURNAL_MAX_SEGMENTS = 8
+SQLITE_BATCH_ROWS = 200
+SQLITE_FLUSH_INTERVAL_SEC = 0.5
+DEFAULT_S3_CONCURRENCY = 8
+ARCHIVE_QUEUE_SIZE = 256
+DATASET_FORMATS = ('jsonl', 'parquet')
+DEFAULT_SHARD_SIZE_MB = 128
+DATASET_FLUSH_INTERVAL_SEC = 1.0
+DATASET_ROW_GROUP_ROWS = 1000
+MANIFEST_SORTED_FILENAME = "_manifest.sorted.jsonl.gz"
+MANIFEST_INLINE_PAGES = 100_000
+SORT_CHUNK_RECORDS = 200_000
+DIFF_FILENAME = "_diff.jsonl"
+DIFF_PATCH_FILENAME = "_diff.patch.gz"
+DIFF_BASELINE_DIRNAME = "_diff_baseline"  # old output of pages re-crawled in place, until the patch is written
+DIFF_SAMPLE_SIZE = 20
+DEFAULT_DEDUP_DISTANCE = 5
+DEDUP_MIN_WORDS = 30
+DEFAULT_SEEN_ERROR_RATE = 0.001
+SEEN_FILTER_MAX_INITIAL_CAPACITY = 10_000_000
+SeenFilterKind = Literal['bloom', 'set']
+SEEN_FILTER_KINDS = get_args(SeenFilterKind)
+SITEMAP_CHUNK_SIZE = 64 * 1024
+GZIP_MAGIC = b'\x1f\x8b'
+SITEMAP_SUFFIXES = ('.xml', '.xml.gz')
+DEFAULT_SITEMAP_CONCURRENCY = 8
+MAX_SITEMAP_DEPTH = 5
+ParserBackend = Literal['lxml', 'selectolax', 'bs4']
+PARSER_BACKENDS = get_args(ParserBackend)
 
 # --- 1. Define Input Schema ---
 class InputModel(BaseModel):
     url: str = Field(..., description="The base URL or direct sitemap URL to process")
-    rate_limit: float = Field(DEFAULT_RATE_LIMIT, description="Requests per second (default: 1.0)")
-    batch_size: int = Field(DEFAULT_BATCH_SIZE, description="URLs processed per batch (default: 1000)")
+    rate_limit: float = Field(DEFAULT_RATE_LIMIT, description="Requests per second per host, shared by all workers (default: 1.0)")
+    batch_size: int = Field(DEFAULT_BATCH_SIZE, description="URLs packed per in-memory frontier chunk (default: 1000)")
+    frontier_memory_mb: int = Field(DEFAULT_FRONTIER_MEMORY_MB, ge=1, description="Memory budget for queued URLs before they spill to disk (default: 64)")
+    checkpoint_interval: float = Field(DEFAULT_CHECKPOINT_INTERVAL_SEC, description="Seconds between checkpoints (default: 30)")
+    page_retries: int = Field(DEFAULT_PAGE_RETRIES, ge=0, description="Delayed retries of a failed page, with exponential backoff (default: 2)")
+    breaker_threshold: int = Field(DEFAULT_BREAKER_THRESHOLD, ge=1, description="Consecutive 5xx/connection failures that open a host's circuit (default: 5)")
+    breaker_cooldown: float = Field(DEFAULT_BREAKER_COOLDOWN_SEC, gt=0, description="Seconds a host is left alone once its circuit opens (default: 30)")
     update: bool = Field(False, description="Incremental update: only fetch new/changed pages")
     max_pages: int = Field(10000, description="Maximum number of pages to process (default: 10000)")
-    concurrency: int = Field(5, description="Number of concurrent requests (default: 5)")
+    seen_filter: SeenFilterKind = Field("bloom", description="Seen-URL tracking: bloom (scalable Bloom filter, bounded memory) or set (exact)")
+    concurrency: int = Field(DEFAULT_CONCURRENCY, description="Number of concurrent requests (default: 5)")
+    adaptive_concurrency: bool = Field(False, description="Adapt concurrency to observed latency and errors (--concurrency auto)")
+    min_concurrency: int = Field(DEFAULT_MIN_CONCURRENCY, description="Lower bound for adaptive concurrency")
+    max_concurrency: int = Field(DEFAULT_MAX_CONCURRENCY, description="Upper bound for adaptive concurrency")
+    sitemap_concurrency: int = Field(DEFAULT_SITEMAP_CONCURRENCY, description="Child sitemaps fetched concurrently when expanding a sitemap index (default: 8)")
     # Phase 1: Filtering
     include_pattern: Optional[str] = Field(None, description="Regex pattern to include")
     exclude_pattern: Optional[str] = Field(None, description="Regex pattern to exclude")
     include_paths: Optional[str] = Field(None, description="Comma-separated paths to include")
     exclude_paths: Optional[str] = Field(None, description="Comma-separated paths to exclude")
     priority_min: Optional[float] = Field(None, description="Minimum priority included")
-    changefreq: Optional[str] = Field(None, description="Change frequency to include")
+    changefreq: Optional[str] = Field(None, description="Change frequencies to include (comma-separated)")
+    filter_dry_run: bool = Field(False, description="Report how many sitemap URLs pass the filters, without fetching pages")
     
     # Phase 2: Content Processing
     extract_main: bool = Field(False, description="Extract main content using readability")
     download_images: bool = Field(False, description="Download images locally")
     pdf_support: bool = Field(False, description="Convert PDFs to Markdown")
+    max_page_mb: int = Field(DEFAULT_MAX_PAGE_MB, ge=0, description="Skip pages whose body is larger than this, 0 for no limit (default: 50)")
     content_selector: Optional[str] = Field(None, description="CSS selector for main content")
     strip_selector: Optional[str] = Field(None, description="CSS selectors to remove (comma-separated)")
     download_assets: bool = Field(False, description="Download CSS/JS assets")
+    parser_backend: ParserBackend = Field("lxml", description="HTML parser: lxml, selectolax (parse once) or bs4 (BeautifulSoup + html2text)")
+    convert_workers: Optional[int] = Field(None, description="Processes for HTML/Markdown conversion (default: CPU count, 0 = on the event loop)")
+    dedup: bool = Field(False, description="Record near-duplicate pages (SimHash) as aliases in the manifest instead of writing them")
+    dedup_distance: int = Field(DEFAULT_DEDUP_DISTANCE, ge=0, le=15, description="Max differing SimHash bits (of 64) for a near-duplicate (default: 5)")
     
     # Phase 3: Advanced Network
     proxy: Optional[str] = Field(None, description="Proxy URL (http/https/socks5)")
     headers: Optional[str] = Field(None, description="Custom headers as JSON string")
     respect_robots: bool = Field(False, description="Respect robots.txt rules")
     respect_robots: bool = Field(False, description="Respect robots.txt rules")
+    robots_ttl: float = Field(ROBOTS_TTL_SEC, gt=0, description="Seconds before a host's cached robots.txt is fetched again (default: 86400)")
     timeout: int = Field(30, description="Request timeout in seconds")
+    http2: bool = Field(False, description="Negotiate HTTP/2 (needs the h2 package) to multiplex requests per host")
+    max_connections_per_host: int = Field(DEFAULT_CONNECTIONS_PER_HOST, ge=0, description="Requests in flight per host, 0 for no cap (default: 32)")
 
     # Phase 4: Reporting & Monitoring
     progress_file: Optional[str] = Field("_progress.json", description="Real-time progress file")
     html_report: bool = Field(False, description="Generate HTML report")
-    diff_with: Optional[str] = Field(None, description="Manifest path to diff against")
+    diff_with: Optional[str] = Field(None, description="Manifest (_manifest.json or _manifest.sorted.jsonl.gz) to diff against; changes are written to _diff.jsonl")
+    diff_patch: bool = Field(False, description="Also write unified diffs of changed pages to _diff.patch.gz")
     notify_webhook: Optional[str] = Field(None, description="Webhook URL for notifications")
     metrics_file: Optional[str] = Field(None, description="Prometheus metrics file definition")
 
     # Phase 5: Storage
-    output_format: str = Field("markdown", description="Output format: markdown, json, html, text")
-    create_archive: Optional[str] = Field(None, description="Create archive: zip, tar.gz")
+    output_format: str = Field("markdown", description="Output format: markdown, json, html, text (one file per page) or jsonl, parquet (sharded dataset)")
+    shard_size_mb: int = Field(DEFAULT_SHARD_SIZE_MB, description="Uncompressed size at which jsonl/parquet shards are rotated (default: 128)")
+    create_archive: Optional[str] = Field(None, description="Create archive: zip, tar.gz, tar.zst (built during the crawl)")
     sqlite_db: Optional[str] = Field(None, description="SQLite database path")
+    sqlite_fts: bool = Field(False, description="Maintain an FTS5 full-text index in the SQLite database")
     s3_bucket: Optional[str] = Field(None, description="S3 bucket name")
     s3_prefix: Optional[str] = Field(None, description="S3 prefix path")
+    s3_endpoint_url: Optional[str] = Field(None, description="Endpoint of an S3-compatible object store")
+    s3_concurrency: int = Field(DEFAULT_S3_CONCURRENCY, description="Concurrent S3 uploads")
     single_file: bool = Field(False, description="Merge all pages into single markdown file")
     output_dir: Optional[str] = Field(None, description="Output directory")
     
@@ -163,7 +303,7 @@ class OutputModel(BaseModel):
 
 # --- 3. Checkpoint Model ---
 class Checkpoint(BaseModel):
-    version: int = 2
+    version: int = 3  # v3: per-URL status lives in the crawl journal, not in these lists
     started_at: str
     last_updated: str
     source_url: str
@@ -196,67 +336,242 @@ def sanitize_domain(domain: str) -> str:
     """Sanitize domain for safe filename usage"""
     return re.sub(r'[^a-zA-Z0-9.-]', '_', domain)
 
+class PathPrefixTrie:
+    """Character trie over path prefixes: one walk of the path answers 'starts with any of them'"""
+    __slots__ = ('root',)
+    _END = ''
+
+    def __init__(self, prefixes):
+        self.root: Dict[str, Any] = {}
+        for prefix in prefixes:
+            node = self.root
+            for char in prefix:
+                node = node.setdefault(char, {})
+            node[self._END] = True
+
+    def __bool__(self) -> bool:
+        return bool(self.root)
+
+    def matches(self, path: str) -> bool:
+        node = self.root
+        if self._END in node:
+            return True
+        for char in path:
+            node = node.get(char)
+            if node is None:
+                return False
+            if self._END in node:
+                return True
+        return False
+
+def _split_csv(value: Optional[str]) -> List[str]:
+    return [part.strip() for part in value.split(',') if part.strip()] if value else []
+
+class UrlMatcher:
+    """
+    Phase 1 filters compiled once: precompiled regexes, path-prefix tries and
+    priority/changefreq predicates. Applied while the sitemap streams, so filtered
+    URLs never reach the frontier and --max-pages counts eligible pages only.
+    check() names the first rule that rejects a URL, for --filter-dry-run.
+    """
+    RULES = ('include_pattern', 'exclude_pattern', 'include_paths', 'exclude_paths', 'priority_min', 'changefreq')
+
+    def __init__(self, include_pattern: Optional[str] = None, exclude_pattern: Optional[str] = None,
+                 include_paths: Optional[str] = None, exclude_paths: Optional[str] = None,
+                 priority_min: Optional[float] = None, changefreq: Optional[str] = None):
+        self.include_re = re.compile(include_pattern) if include_pattern else None
+        self.exclude_re = re.compile(exclude_pattern) if exclude_pattern else None
+        self.include_paths = PathPrefixTrie(_split_csv(include_paths))
+        self.exclude_paths = PathPrefixTrie(_split_csv(exclude_paths))
+        self.priority_min = priority_min
+        self.changefreqs = frozenset(value.lower() for value in _split_csv(changefreq))
+        self.active = bool(self.include_re or self.exclude_re or self.include_paths or self.exclude_paths
+                           or priority_min is not None or self.changefreqs)
+
+    @classmethod
+    def from_inputs(cls, inputs: InputModel) -> "UrlMatcher":
+        return _url_matcher(*(getattr(inputs, rule) for rule in cls.RULES))
+
+    def check(self, url: str, meta: Dict[str, Any]) -> Optional[str]:
+        """None if the URL passes, otherwise the rule that rejected it"""
+        if self.include_re and not self.include_re.search(url):
+            return 'include_pattern'
+        if self.exclude_re and self.exclude_re.search(url):
+            return 'exclude_pattern'
+        if self.include_paths or self.exclude_paths:
+            path = urlparse(url).path
+            if self.include_paths and not self.include_paths.matches(path):
+                return 'include_paths'
+            if self.exclude_paths and self.exclude_paths.matches(path):
+                return 'exclude_paths'
+        if self.priority_min is not None:
+            try:
+                if float(meta.get('priority', '0.5')) < self.priority_min:
+                    return 'priority_min'
+            except ValueError:
+                pass
+        if self.changefreqs and meta.get('changefreq', '').lower() not in self.changefreqs:
+            return 'changefreq'
+        return None
+
+    def __call__(self, url: str, meta: Dict[str, Any]) -> bool:
+        return not self.active or self.check(url, meta) is None
+
+@functools.lru_cache(maxsize=16)
+def _url_matcher(*rules) -> UrlMatcher:
+    return UrlMatcher(*rules)
+
 def should_process_url(url: str, meta: Dict[str, Any], inputs: InputModel) -> bool:
     """Apply Phase 1 filtering rules"""
-    # 1.1 Regex
-    if inputs.include_pattern and not re.search(inputs.include_pattern, url):
-        return False
-    if inputs.exclude_pattern and re.search(inputs.exclude_pattern, url):
-        return False
-        
-    # 1.2 Paths
-    parsed = urlparse(url)
-    if inputs.include_paths:
-        paths = [p.strip() for p in inputs.include_paths.split(',') if p.strip()]
-        if not any(parsed.path.startswith(p) for p in paths):
-            return False
-            
-    if inputs.exclude_paths:
-        paths = [p.strip() for p in inputs.exclude_paths.split(',') if p.strip()]
-        if any(parsed.path.startswith(p) for p in paths):
-            return False
-            
-    # 1.3 Priority
-    if inputs.priority_min is not None:
-        p_str = meta.get('priority', '0.5')
+    return UrlMatcher.from_inputs(inputs)(url, meta)
+
+class RobotsCache:
+    """
+    robots.txt rules per scheme://host for --respect-robots, fetched when a host's
+    first URL comes up, so subdomains and CDN hosts in a sitemap get their own rules.
+    Concurrent lookups for a host share one fetch; entries are fetched again after
+    `ttl` seconds and `_robots_cache.json` keeps them across runs, so a re-crawl only
+    refetches expired hosts. Parsing a host's rules applies its Crawl-delay /
+    Request-rate to the rate limiter. Following RFC 9309 a 4xx means no restrictions,
+    while a 5xx or network error disallows the whole host until robots.txt is fetched
+    again after ROBOTS_ERROR_TTL_SEC. Bodies are read up to ROBOTS_MAX_BYTES only.
+    """
+    FILENAME = "_robots_cache.json"
+
+    def __init__(self, path: Optional[Path] = None, ttl: float = ROBOTS_TTL_SEC, user_agent: str = USER_AGENT):
+        self.path = path
+        self.ttl = ttl
+        self.user_agent = user_agent
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self.dirty = False
+        self.fetched = 0
+        self._parsers: Dict[str, Optional[RobotFileParser]] = {}
+        self._pending: Dict[str, asyncio.Task] = {}
+
+    @classmethod
+    def load(cls, path: Path, ttl: float = ROBOTS_TTL_SEC) -> "RobotsCache":
+        cache = cls(path, ttl)
+        if path.exists():
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    cache.entries = json.load(f)
+            except Exception as e:
+                log(f"Failed to load robots.txt cache: {e}")
+        return cache
+
+    def save(self):
+        if not (self.path and self.dirty):
+            return
         try:
-            priority = float(p_str)
-            if priority < inputs.priority_min:
-                return False
-        except ValueError:
-            pass
-            
-    # 1.4 Changefreq
-    if inputs.changefreq:
-        cf = meta.get('changefreq', '').lower()
-        if cf != inputs.changefreq.lower():
-            return False
-            
-            
-    return True
+            tmp_path = self.path.with_suffix('.tmp')
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.entries, f)
+            os.replace(tmp_path, self.path)
+            self.dirty = False
+        except Exception as e:
+            log(f"Failed to save robots.txt cache: {e}")
+
+    @staticmethod
+    def key(url: str) -> str:
+        parsed = urlparse(url)
+        return f"{parsed.scheme.lower()}://{parsed.netloc.lower()}"
+
+    @staticmethod
+    def _unreachable(entry: Dict[str, Any]) -> bool:
+        status = entry.get('status')
+        return status is None or status >= 500
+
+    def _ttl(self, entry: Dict[str, Any]) -> float:
+        return min(self.ttl, ROBOTS_ERROR_TTL_SEC) if self._unreachable(entry) else self.ttl
+
+    def _fresh(self, entry: Dict[str, Any]) -> bool:
+        return time.time() - entry.get('fetched_at', 0) < self._ttl(entry)
+
+    def retry_after(self, url: str) -> Optional[float]:
+        """Seconds until the host's unreachable robots.txt is fetched again; None once its rules are known"""
+        entry = self.entries.get(self.key(url))
+        if entry is None or not self._unreachable(entry):
+            return None
+        return max(0.0, entry.get('fetched_at', 0) + self._ttl(entry) - time.time())
+
+    async def rules(self, client: httpx.AsyncClient, url: str,
+                    ctx: Optional["CrawlContext"] = None) -> Optional[RobotFileParser]:
+        """Parsed rules for the URL's host, or None if its robots.txt sets no restrictions"""
+        key = self.key(url)
+        entry = self.entries.get(key)
+        if entry is None or not self._fresh(entry):
+            task = self._pending.get(key)
+            if task is None:
+                task = self._pending[key] = asyncio.create_task(self._fetch(client, key, ctx))
+                task.add_done_callback(lambda _: self._pending.pop(key, None))
+            # Shielded: a cancelled worker must not cancel the fetch other workers wait for
+            await asyncio.shield(task)
+        if key in self._parsers:
+            return self._parsers[key]
+        return self._parse(key, ctx)
+
+    async def allowed(self, client: httpx.AsyncClient, url: str, ctx: Optional["CrawlContext"] = None) -> bool:
+        parser = await self.rules(client, url, ctx)
+        return parser is None or parser.can_fetch(self.user_agent, url)
+
+    def crawl_delay(self, url: str) -> Optional[float]:
+        """Seconds between requests asked for by Crawl-delay / Request-rate, once the host's rules are loaded"""
+        parser = self._parsers.get(self.key(url))
+        if parser is None:
+            return None
+        delay = parser.crawl_delay(self.user_agent)
+        request_rate = parser.request_rate(self.user_agent)
+        if request_rate and request_rate.requests:
+            delay = max(float(delay or 0), request_rate.seconds / request_rate.requests)
+        return float(delay) if delay else None
+
+    async def _fetch(self, client: httpx.AsyncClient, key: str, ctx: Optional["CrawlContext"]):
+        status, text = None, None
+        try:
+            if ctx and ctx.limiter:
+                await ctx.limiter.acquire(key)
+            async with client.stream("GET", f"{key}/robots.txt", timeout=10.0, follow_redirects=True) as response:
+                if response.status_code == 200:
+                    # RFC 9309 lets crawlers ignore what follows the first 500 KiB
+                    body = bytearray()
+                    async for chunk in response.aiter_bytes():
+                        body += chunk
+                        if len(body) >= ROBOTS_MAX_BYTES:
+                            break
+                    text = bytes(body[:ROBOTS_MAX_BYTES]).decode('utf-8', errors='replace')
+                status = response.status_code
+        except Exception as e:
+            log(f"Failed to fetch robots.txt for {key}: {e}")
+        self.entries[key] = {'status': status, 'fetched_at': time.time(), 'text': text}
+        self._parsers.pop(key, None)
+        self.dirty = True
+        self.fetched += 1
+
+    def _parse(self, key: str, ctx: Optional["CrawlContext"]) -> Optional[RobotFileParser]:
+        entry = self.entries[key]
+        text = entry.get('text')
+        parser = None
+        if text is not None:
+            parser = RobotFileParser()
+            parser.parse(text.splitlines())
+        elif self._unreachable(entry):
+            parser = RobotFileParser()
+            parser.disallow_all = True
+        self._parsers[key] = parser
+        if parser and ctx and ctx.limiter:
+            ctx.limiter.set_crawl_delay(urlparse(key).netloc, self.crawl_delay(key))
+        return parser
 
 async def check_robots(client: httpx.AsyncClient, base_url: str, user_agent: str, target_url: str) -> bool:
-    """Check if URL is allowed by robots.txt"""
-    # Note: Optimization - cache the parser per domain if possible.
-    # For now, we fetch robots.txt every time? No, that's bad.
-    # We should cache it. Since we are processing one domain mostly:
-    # We can pass a cached parser or dict.
-    # But for a simple stateless function:
-    robots_url = f"{base_url.rstrip('/')}/robots.txt"
-    try:
-        # We need to fetch it to parse it. 
-        # Since we don't have a shared state easily available in this function signature...
-        # We'll rely on the main function to do this check or cache it on the client/inputs?
-        # Let's assume the main loop handles the fetching once and passes the parser or we do it efficiently.
-        # Actually, standard library RobotFileParser is synchronous and needs to read data.
-        pass
-    except Exception:
-        pass
-    return True
+    """One-off check of `target_url` against its host's robots.txt; crawls share a RobotsCache instead"""
+    return await RobotsCache(user_agent=user_agent).allowed(client, target_url)
 
-async def download_asset(client: httpx.AsyncClient, url: str, output_dir: Path, subfolder: str) -> Optional[str]:
+async def download_asset(client: httpx.AsyncClient, url: str, output_dir: Path, subfolder: str,
+                         ctx: Optional["CrawlContext"] = None) -> Optional[str]:
     """Download asset and return relative path"""
     try:
+        if ctx and ctx.limiter:
+            await ctx.limiter.acquire(url)
         # Simple fetch, maybe less retries needed for assets? using same for robustness
         response = await client.get(url, timeout=15.0, follow_redirects=True)
         if response.status_code != 200:
@@ -293,6 +608,203 @@ async def download_asset(client: httpx.AsyncClient, url: str, output_dir: Path,
         log(f"Failed to download asset {url}: {e}")
         return None
 
+# Tags whose URLs --download-images / --download-assets fetch
+IMAGE_SELECTORS = (('img[src]', 'src'),)
+STYLE_SCRIPT_SELECTORS = (('link[rel~=stylesheet][href]', 'href'), ('script[src]', 'src'))
+
+def asset_references(page, url: str, selectors) -> List[Tuple[str, str]]:
+    """(attribute value, absolute URL) for each http(s) asset in a BeautifulSoup or HtmlTree page"""
+    references = []
+    seen = set()
+    for selector, name in selectors:
+        if isinstance(page, HtmlTree):
+            values = [page.attr(node, name) for node in page.select(selector)]
+        else:
+            values = [tag.get(name) for tag in page.select(selector)]
+        for value in values:
+            value = (value or '').strip()
+            if not value or value in seen:
+                continue
+            absolute = urldefrag(urljoin(url, value))[0]
+            if urlparse(absolute).scheme in ('http', 'https'):
+                seen.add(value)
+                references.append((value, absolute))
+    return references
+
+_MARKDOWN_TARGET = re.compile(r'(\]\()([^)\s]+)(\))')
+_HTML_TARGET = re.compile(r'((?:src|href)=")([^"]*)(")')
+
+def rewrite_asset_links(text: str, targets: Dict[str, str], html: bool = False) -> str:
+    """Replace Markdown link targets (and src/href attributes with `html`) found in `targets`"""
+    def replace(match):
+        value = match.group(2)
+        if html:
+            value = value.replace('&amp;', '&')
+        return f"{match.group(1)}{targets.get(value, match.group(2))}{match.group(3)}"
+    return (_HTML_TARGET if html else _MARKDOWN_TARGET).sub(replace, text)
+
+class AssetStore:
+    """
+    Content-addressed asset downloads for --download-images / --download-assets.
+    Each file is stored once as `_assets/<sha256[:2]>/<sha256><ext>`, however many
+    URLs or pages reference it. `_asset_cache.json` maps asset URLs to their files,
+    so a re-run reuses assets already on disk without fetching them again; the
+    files are checked once, at load(). Concurrent requests for one URL share a
+    single download, which goes through the crawl's client, rate limiter and
+    circuit breaker. A finished download is looked up in `entries` from then on;
+    a failed one is forgotten, so a later page referencing the URL tries again.
+    """
+    DIRNAME = "_assets"
+    FILENAME = "_asset_cache.json"
+
+    def __init__(self, output_dir: Path, max_bytes: Optional[int] = None, concurrency: int = ASSET_CONCURRENCY):
+        self.output_dir = output_dir
+        self.path = output_dir / self.FILENAME
+        self.max_bytes = max_bytes
+        self.entries: Dict[str, str] = {}
+        self.dirty = False
+        self.downloaded = 0
+        self.cached = 0
+        self.shared = 0
+        self.failed = 0
+        self._tasks: Dict[str, asyncio.Task] = {}  # downloads in flight
+        self._unused: Set[str] = set()  # URLs cached by earlier runs, not yet referenced by this one
+        self._published: Set[str] = set()
+        self._semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    @classmethod
+    def load(cls, output_dir: Path, max_bytes: Optional[int] = None) -> "AssetStore":
+        store = cls(output_dir, max_bytes)
+        if store.path.exists():
+            try:
+                with open(store.path, 'r', encoding='utf-8') as f:
+                    entries = json.load(f)
+            except Exception as e:
+                log(f"Failed to load asset cache: {e}")
+            else:
+                present = {relative for relative in set(entries.values()) if (output_dir / relative).exists()}
+                store.entries = {url: relative for url, relative in entries.items() if relative in present}
+                store.dirty = len(store.entries) != len(entries)
+                store._unused = set(store.entries)
+        return store
+
+    def save(self):
+        if not self.dirty:
+            return
+        try:
+            tmp_path = self.path.with_suffix('.tmp')
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.entries, f)
+            os.replace(tmp_path, self.path)
+            self.dirty = False
+        except Exception as e:
+            log(f"Failed to save asset cache: {e}")
+
+    def stats(self) -> Dict[str, int]:
+        return {'downloaded': self.downloaded, 'cached': self.cached, 'shared': self.shared,
+                'failed': self.failed, 'files': len(set(self.entries.values()))}
+
+    @staticmethod
+    def _extension(url: str, content_type: str) -> str:
+        suffix = Path(urlparse(url).path).suffix.lower()
+        if not re.fullmatch(r'\.[a-z0-9]{1,8}', suffix):
+            suffix = mimetypes.guess_extension(content_type.split(';')[0].strip()) or ''
+        return suffix
+
+    def _store(self, data: bytes, suffix: str) -> Tuple[str, bool]:
+        """Runs in a thread. Returns the relative path and whether the content was new."""
+        digest = hashlib.sha256(data).hexdigest()
+        relative = f"{self.DIRNAME}/{digest[:2]}/{digest}{suffix}"
+        path = self.output_dir / relative
+        if path.exists():
+            return relative, False
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(path.name + '.tmp')
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)
+        return relative, True
+
+    async def fetch(self, client: httpx.AsyncClient, url: str, ctx: Optional["CrawlContext"] = None) -> Optional[str]:
+        """Path of the asset relative to the output directory, or None if it could not be downloaded"""
+        task = self._tasks.get(url)
+        if task is None:
+            task = self._tasks[url] = asyncio.create_task(self._resolve(client, url, ctx))
+            task.add_done_callback(lambda _: self._tasks.pop(url, None))
+        # Shielded: a cancelled page must not cancel a download other pages wait for
+        return await asyncio.shield(task)
+
+    async def fetch_all(self, client: httpx.AsyncClient, urls: List[str],
+                        ctx: Optional["CrawlContext"] = None) -> Dict[str, Optional[str]]:
+        paths = await asyncio.gather(*(self.fetch(client, url, ctx) for url in urls))
+        return dict(zip(urls, paths))
+
+    async def _resolve(self, client: httpx.AsyncClient, url: str, ctx: Optional["CrawlContext"]) -> Optional[str]:
+        relative = self.entries.get(url)
+        if relative:
+            if url in self._unused:
+                self._unused.discard(url)
+                self.cached += 1
+        else:
+            relative = await self._download(client, url, ctx)
+            if relative is None:
+                return None
+            self.entries[url] = relative
+            self.dirty = True
+        await self._publish(relative, ctx)
+        return relative
+
+    async def _download(self, client: httpx.AsyncClient, url: str, ctx: Optional["CrawlContext"]) -> Optional[str]:
+        async with self._semaphore:
+            try:
+                response = await fetch_with_retry(client, url, 0, timeout_sec=15, ctx=ctx, max_bytes=self.max_bytes)
+            except FetchRejected as e:
+                log(f"Asset skipped ({e}): {url}")
+                response = None
+            if not response or response.status_code != 200:
+                self.failed += 1
+                return None
+            data = response.content
+            suffix = self._extension(str(response.url), response.headers.get('Content-Type', ''))
+        try:
+            relative, new = await asyncio.to_thread(self._store, data, suffix)
+        except OSError as e:
+            log(f"Failed to store asset {url}: {e}")
+            self.failed += 1
+            return None
+        if new:
+            self.downloaded += 1
+        else:
+            self.shared += 1
+        return relative
+
+    async def _publish(self, relative: str, ctx: Optional["CrawlContext"]):
+        """Archive and upload each stored file once per run, including ones kept from earlier runs"""
+        if relative in self._published or not ctx:
+            return
+        self._published.add(relative)
+        path = self.output_dir / relative
+        if ctx.archive:
+            await ctx.archive.add_file(path, Path(relative))
+        if ctx.uploader:
+            await ctx.uploader.submit(path, Path(relative), Path(relative).stem)
+
+    async def localize(self, client: httpx.AsyncClient, result: Dict[str, Any], rel_path: Path,
+                       output_format: str, ctx: Optional["CrawlContext"] = None):
+        """Download the assets in `result` and point its Markdown/HTML at the local copies of `rel_path`'s page"""
+        references = result.get('assets')
+        if not references:
+            return
+        paths = await self.fetch_all(client, list({absolute for _, absolute in references}), ctx)
+        start = rel_path.parent.as_posix()
+        # Assets that could not be fetched keep a working absolute URL
+        targets = {value: posixpath.relpath(paths[absolute], start) if paths[absolute] else absolute
+                   for value, absolute in references}
+        result['markdown'] = rewrite_asset_links(result['markdown'], targets)
+        if output_format == 'html':
+            result['content'] = rewrite_asset_links(result['content'], targets, html=True)
+        elif result['suffix'] == '.md':
+            result['content'] = rewrite_asset_links(result['content'], targets)
+
 def resolve_collision(base_path: Path, relative_path: Path) -> Path:
     """
     Resolve file system collisions.
@@ -368,6 +880,134 @@ def sanitize_filename(url: str) -> Path:
         
     return p
 
+class PathRegistry:
+    """
+    Crawl-scoped trie of the files and directories claimed under the output
+    directory. Collisions (a file where a directory is needed or the other way
+    round, or two URLs mapping to one file) are resolved in memory with
+    deterministic renames instead of stat() calls on every save, and each
+    directory is created once. Sitemap URLs are reserved as they enter the
+    frontier, so among known URLs the winner does not depend on which page is
+    written first: a directory wins over a file, and a contested file name goes
+    to the URL whose own path it is (`/a.md` for `a.md`), else to the smallest
+    URL. The others get a suffix derived from their own URL alone. A name
+    already written keeps its owner: the registry is rebuilt from the manifest
+    when a crawl reuses the output directory.
+    """
+    _FILE = None  # leaf marker; directories are nested dicts
+
+    def __init__(self, root: Path):
+        self.root = root
+        self._tree: Dict[str, Any] = {}
+        self._owners: Dict[str, str] = {}  # claimed relative path -> URL
+        self._paths: Dict[str, Path] = {}  # URL -> claimed relative path
+        self._wanted: Dict[str, str] = {}  # path without suffix -> best known URL, until it is claimed
+        self._wanted_dirs: Set[str] = set()  # directories known URLs need
+        self._made: Set[str] = set()
+        self.collisions = 0
+
+    def __len__(self) -> int:
+        return len(self._paths)
+
+    def lookup(self, url: str) -> Optional[Path]:
+        return self._paths.get(url)
+
+    @staticmethod
+    def _rank(url: str, slot: str) -> Tuple[bool, str]:
+        """Sort key of the URLs wanting `slot`: the URL whose own path is the Markdown file's, then the smallest"""
+        return unquote(urlparse(url).path).strip('/') != f"{slot}.md", url
+
+    def reserve(self, url: str, relative_path: Path):
+        """Register a URL that will be claimed later, before any page is written"""
+        slot = posixpath.splitext(relative_path.as_posix())[0]
+        best = self._wanted.get(slot)
+        if best is None or self._rank(url, slot) < self._rank(best, slot):
+            self._wanted[slot] = url
+        for parent in relative_path.parents:
+            if parent.parts:
+                self._wanted_dirs.add(parent.as_posix())
+
+    def _conflict(self, parts: Tuple[str, ...], url: str) -> Optional[str]:
+        """
+        'parent' if a parent is a claimed file, 'dir' if the path is (or a known
+        URL needs it as) a directory, 'taken' if another URL owns it or ranks first
+        """
+        node = self._tree
+        for part in parts[:-1]:
+            node = node.get(part, {})
+            if node is self._FILE:
+                return 'parent'
+        key = '/'.join(parts)
+        leaf = node.get(parts[-1], 0)
+        if isinstance(leaf, dict):
+            return 'dir'
+        if leaf is self._FILE:
+            return None if self._owners.get(key) == url else 'taken'
+        if key in self._wanted_dirs:
+            return 'dir'
+        if self._wanted.get(posixpath.splitext(key)[0], url) != url:
+            return 'taken'
+        return None
+
+    def _insert(self, parts: Tuple[str, ...], url: str):
+        node = self._tree
+        for part in parts[:-1]:
+            node = node.setdefault(part, {})
+        node[parts[-1]] = self._FILE
+        key = '/'.join(parts)
+        previous = self._paths.get(url)
+        if previous is not None and previous.as_posix() != key:
+            self._owners.pop(previous.as_posix(), None)
+        self._owners[key] = url
+        self._paths[url] = Path(key)
+
+    def claim(self, url: str, relative_path: Path) -> Path:
+        """The path this URL is written to: its own earlier path, the wanted one, or a renamed one"""
+        self.reserve(url, relative_path)
+        parts = relative_path.parts
+        candidate = relative_path
+        digest = hashlib.md5(url.encode()).hexdigest()
+        conflict = self._conflict(parts, url)
+        for length in (8, 16, 32):
+            if conflict is None:
+                break
+            suffix = digest[:length]
+            if conflict == 'parent':
+                # the tree above is taken by a file: move out of it, as resolve_collision does
+                candidate = Path(f"{relative_path.stem}_{suffix}{relative_path.suffix}")
+            elif conflict == 'dir':
+                candidate = relative_path.with_name(f"{relative_path.stem}_alt_{suffix}{relative_path.suffix}")
+            else:
+                candidate = relative_path.with_name(f"{relative_path.stem}_{suffix}{relative_path.suffix}")
+            conflict = self._conflict(candidate.parts, url)
+        if conflict is not None:
+            raise RuntimeError(f"No free output path for {url} ({relative_path})")
+        slot = posixpath.splitext(relative_path.as_posix())[0]
+        if self._wanted.get(slot) == url:
+            del self._wanted[slot]  # the trie holds the outcome from here on
+        if candidate.parts != parts:
+            self.collisions += 1
+            log(f"Path collision for {url}: {relative_path} -> {candidate}")
+        self._insert(candidate.parts, url)
+        return candidate
+
+    def add(self, url: str, relative_path: str):
+        """Register a path written by an earlier run"""
+        parts = Path(relative_path).parts
+        if parts and self._conflict(parts, url) in (None, 'taken'):
+            self._insert(parts, url)
+
+    def ensure_dir(self, relative_dir: Path):
+        key = relative_dir.as_posix()
+        if key in self._made:
+            return
+        (self.root / relative_dir).mkdir(parents=True, exist_ok=True)
+        while key not in self._made:
+            self._made.add(key)
+            if key == '.':
+                break
+            key = posixpath.dirname(key) or '.'
+
 def exponential_backoff(retry_count: int, base_delay: float = 1.0, max_delay: float = 60.0) -> float:
     """Calculate delay with exponential backoff + jitter"""
     delay = min(base_delay * (2 ** retry_count), max_delay)
@@ -381,252 +1021,2269 @@ async def rate_limit_sleep(rate_limit: float):
     delay = 1.0 / rate_limit
     await asyncio.sleep(delay)
 
-async def fetch_with_retry(client: httpx.AsyncClient, url: str, rate_limit: float, timeout_sec: int = 30) -> Optional[httpx.Response]:
-    """Fetch URL with exponential backoff and retry logic using httpx"""
-    for retry in range(MAX_RETRIES):
-        try:
-            # We assume external pacing, but here we handle 429 delays
-            response = await client.get(url, timeout=timeout_sec, follow_redirects=True)
-            
-            if response.status_code == 429:
-                retry_after = response.headers.get('Retry-After')
-                if retry_after:
-                    try:
-                        delay = float(retry_after)
-                        log(f"Rate limit hit, Retry-After: {delay}s")
-                    except ValueError:
-                        delay = exponential_backoff(retry)
-                else:
-                    delay = exponential_backoff(retry)
-                    log(f"Rate limit hit, backing off for {delay:.1f}s")
-                await asyncio.sleep(delay)
-                continue
-            
-            response.raise_for_status()
-            return response
-        except httpx.HTTPError as e:
-            if retry < max_retries - 1:
-                delay = exponential_backoff(retry)
-                # log(f"Request failed (attempt {retry+1}/{max_retries}): {e}. Retrying in {delay:.1f}s")
-                await asyncio.sleep(delay)
-            else:
-                log(f"Request failed after {max_retries} attempts: {e} URL: {url}")
-                return None
-    return None
-
-async def validate_sitemap(client: httpx.AsyncClient, url: str) -> bool:
-    """Validate that URL points to a valid XML sitemap"""
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Parse a Retry-After header (delta-seconds or HTTP-date) into seconds"""
+    if not value:
+        return None
     try:
-        response = await client.head(url, timeout=10.0, follow_redirects=True)
-        if response.status_code == 200:
-            content_type = response.headers.get('content-type', '').lower()
-            if 'xml' in content_type or url.endswith('.xml'):
-                return True
-    except httpx.HTTPError:
+        return max(0.0, float(value))
+    except ValueError:
         pass
-    return False
-
-async def discover_sitemap(client: httpx.AsyncClient, base_url: str) -> Optional[str]:
-    """Discover sitemap URL with explicit priority order."""
-    log(f"Discovering sitemap for {base_url}")
-    
-    parsed = urlparse(base_url)
-    base = f"{parsed.scheme}://{parsed.netloc}"
-    
-    # Priority 1: Direct XML 
-    if base_url.endswith('.xml'):
-        if await validate_sitemap(client, base_url):
-            log(f"Using direct XML URL: {base_url}")
-            return base_url
-    
-    # Priority 2: Standard locations
-    candidates = [
-        f"{base}/sitemap.xml",
-        f"{base}/sitemap_index.xml",
-    ]
-    
-    for candidate in candidates:
-        if await validate_sitemap(client, candidate):
-            log(f"Found sitemap at: {candidate}")
-            return candidate
-            
-    # Priority 3: robots.txt
-    robots_url = f"{base}/robots.txt"
     try:
-        response = await client.get(robots_url, timeout=10.0, follow_redirects=True)
-        for line in response.text.splitlines():
-            if line.lower().startswith('sitemap:'):
-                sitemap_url = line.split(':', 1)[1].strip()
-                if await validate_sitemap(client, sitemap_url):
-                    log(f"Found sitemap in robots.txt: {sitemap_url}")
-                    return sitemap_url
-    except httpx.HTTPError:
-        pass
-        
-    log("No sitemap found at any location")
-    return None
+        when = date_parser.parse(value)
+        if when.tzinfo is None:
+            when = when.replace(tzinfo=timezone.utc)
+        return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+    except (ValueError, OverflowError):
+        return None
 
-def stream_sitemap_urls(xml_content: str) -> Iterator[Tuple[str, dict]]:
-    """Memory-efficient sitemap parsing using iterparse."""
-    try:
-        from io import StringIO
-        context = ET.iterparse(StringIO(xml_content), events=('end',))
-        
-        current_url = None
-        current_meta = {}
-        
-        for event, elem in context:
-            tag = elem.tag.replace(NS, '')
-            
-            if tag == 'loc':
-                current_url = elem.text
-            elif tag == 'lastmod':
-                current_meta['lastmod'] = elem.text
-            elif tag == 'changefreq':
-                current_meta['changefreq'] = elem.text
-            elif tag == 'priority':
-                current_meta['priority'] = elem.text
-            elif tag == 'url':
-                if current_url:
-                    yield (current_url, current_meta)
-                current_url = None
-                current_meta = {}
-                elem.clear()
-    except ET.ParseError as e:
-        log(f"XML parsing error: {e}")
+class _HostBucket:
+    __slots__ = ('tokens', 'updated', 'paused_until', 'crawl_delay', 'lock')
 
-def extract_sitemap_index(xml_content: str) -> list:
-    """Extract child sitemap URLs from sitemap index"""
-    sitemaps = []
-    try:
-        from io import StringIO
-        context = ET.iterparse(StringIO(xml_content), events=('end',))
-        current_loc = None
-        for event, elem in context:
-            tag = elem.tag.replace(NS, '')
-            if tag == 'loc':
-                current_loc = elem.text
-            elif tag == 'sitemap':
-                if current_loc:
-                    sitemaps.append(current_loc)
-                current_loc = None
-                elem.clear()
-    except ET.ParseError as e:
-        log(f"XML parsing error in sitemap index: {e}")
-    return sitemaps
+    def __init__(self, burst: int):
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.crawl_delay = 0.0
+        self.lock = asyncio.Lock()
 
-def convert_pdf_to_markdown(content: bytes) -> str:
-    """Convert PDF bytes to Markdown text"""
-    if not PdfReader:
-        return "Error: pypdf not installed"
-    try:
-        reader = PdfReader(BytesIO(content))
-        text = []
-        for page in reader.pages:
-            extract = page.extract_text()
-            if extract:
-                text.append(extract)
-        return "\n\n".join(text)
-    except Exception as e:
-        return f"Error converting PDF: {e}"
+class HostRateLimiter:
+    """
+    Shared per-host token bucket used by every fetch path (pages, sitemaps, assets).
+    Each host gets exactly `rate` requests/sec regardless of worker count; a rate of 0
+    disables pacing. A robots.txt Crawl-delay lowers the host's rate, and pause()
+    holds back every request to the host (e.g. after 429 Retry-After).
+    """
 
-async def process_url(client: httpx.AsyncClient, url: str, output_dir: Path, inputs: InputModel) -> str:
-    """Fetch and convert URL to Markdown."""
-    try:
-        response = await fetch_with_retry(client, url, 0, timeout_sec=inputs.timeout)
-        if not response:
-            return "failed"
-            
-        content_type = response.headers.get('Content-Type', '').lower()
-        markdown = ""
-        soup = None
-        rel_path = sanitize_filename(url)
-        
-        # 1. Handle PDF
-        if 'application/pdf' in content_type:
-            if inputs.pdf_support and PdfReader:
-                markdown = convert_pdf_to_markdown(response.content)
-                rel_path = rel_path.with_suffix('.md')
-            else:
-                log(f"PDF skipped (no support): {url}")
-                return "skipped"
-        
-        # 2. Handle HTML
-        else:
-            soup = BeautifulSoup(response.text, 'html.parser')
-            
-            # Phase 2.4: Strip selectors
-            if inputs.strip_selector:
-                for selector in inputs.strip_selector.split(','):
-                    for tag in soup.select(selector.strip()):
-                        tag.decompose()
-            
-            # Phase 2.1: Extract main content
-            if inputs.extract_main and Document:
-                try:
-                    doc = Document(response.text)
-                    summary_html = doc.summary()
-                    soup = BeautifulSoup(summary_html, 'html.parser')
-                except Exception as e:
-                    log(f"Readability error for {url}: {e}")
-            
-            # Phase 2.4: Content selector
-            if inputs.content_selector:
-                selection = soup.select_one(inputs.content_selector)
-                if selection:
-                    soup = selection
-
-            # Phase 2.2 & 2.5: Asset/Image downloading (if implemented previously)
-            if inputs.download_assets:
-                # This would call download_asset logic
-                pass
-            if inputs.download_images:
-                # This would call download_asset logic
-                pass
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._hosts: Dict[str, _HostBucket] = {}
 
-            # Convert to Markdown
-            converter = html2text.HTML2Text()
-            converter.ignore_links = False
-            converter.ignore_images = False
-            converter.body_width = 0
-            converter.ul_item_mark = '-'
-            markdown = converter.handle(str(soup))
-            markdown = re.sub(r'\n{3,}', '\n\n', markdown)
-            rel_path = rel_path.with_suffix('.md')
-
-        # 3. Path and Filename
-        rel_path = resolve_collision(output_dir, rel_path)
-        save_path = output_dir / rel_path
-        save_path.parent.mkdir(parents=True, exist_ok=True)
-        
-        # 4. Phase 5.1: Conditional output
-        output_format = inputs.output_format.lower()
-        
-        if output_format == 'json':
-            save_path = save_path.with_suffix('.json')
-            json_data = convert_to_json(url, response.text, soup or BeautifulSoup("", "html.parser"), meta={'date': datetime.now().isoformat()})
-            async with aiofiles.open(save_path, 'w', encoding='utf-8') as f:
-                await f.write(json.dumps(json_data, indent=2))
-        elif output_format == 'html':
-            save_path = save_path.with_suffix('.html')
-            html_output = convert_to_html_wrapped(url, soup or BeautifulSoup("", "html.parser"), markdown)
-            async with aiofiles.open(save_path, 'w', encoding='utf-8') as f:
-                await f.write(html_output)
-        elif output_format == 'text':
-            save_path = save_path.with_suffix('.txt')
-            text_output = convert_to_text(soup or BeautifulSoup("", "html.parser"))
-            async with aiofiles.open(save_path, 'w', encoding='utf-8') as f:
-                await f.write(text_output)
-        else: # markdown
-            save_path = save_path.with_suffix('.md')
-            header = f"---\nurl: {url}\ndate: {datetime.now().isoformat()}\n---\n\n"
-            async with aiofiles.open(save_path, 'w', encoding='utf-8') as f:
-                await f.write(header + markdown)
-            
-        # 5. Integration
-        if inputs.s3_bucket:
-             upload_to_s3(inputs.s3_bucket, inputs.s3_prefix, save_path, rel_path)
-        if inputs.sqlite_db:
+    @staticmethod
+    def host_key(url: str) -> str:
+        return urlparse(url).netloc.lower()
+
+    def _bucket(self, host: str) -> _HostBucket:
+        bucket = self._hosts.get(host)
+        if bucket is None:
+            bucket = self._hosts[host] = _HostBucket(self.burst)
+        return bucket
+
+    def host_rate(self, host: str) -> float:
+        """Effective requests/sec for a host (0 = unlimited)"""
+        rate = self.rate
+        delay = self._bucket(host).crawl_delay
+        if delay > 0:
+            rate = min(rate, 1.0 / delay) if rate > 0 else 1.0 / delay
+        return rate
+
+    def set_crawl_delay(self, host: str, delay: Optional[float]):
+        if delay and delay > 0:
+            self._bucket(host.lower()).crawl_delay = float(delay)
+            log(f"Crawl-delay for {host}: {delay}s")
+
+    def pause(self, url: str, seconds: float):
+        """Hold back all requests to the URL's host for `seconds`"""
+        bucket = self._bucket(self.host_key(url))
+        bucket.paused_until = max(bucket.paused_until, time.monotonic() + seconds)
+        bucket.tokens = 0.0
+
+    async def acquire(self, url: str):
+        host = self.host_key(url)
+        bucket = self._bucket(host)
+        # The lock queues waiters per host in FIFO order
+        async with bucket.lock:
+            while True:
+                now = time.monotonic()
+                if now < bucket.paused_until:
+                    await asyncio.sleep(bucket.paused_until - now)
+                    continue
+                rate = self.host_rate(host)
+                if rate <= 0:
+                    return
+                bucket.tokens = min(self.burst, bucket.tokens + (now - bucket.updated) * rate)
+                bucket.updated = now
+                if bucket.tokens >= 1:
+                    bucket.tokens -= 1
+                    return
+                await asyncio.sleep((1 - bucket.tokens) / rate)
+
+class AdaptiveConcurrency:
+    """
+    AIMD controller for the number of in-flight page requests (--concurrency auto).
+    Every `window` samples: a throttle/timeout rate above `error_threshold` halves the
+    limit; latency inflated past `latency_tolerance` x the best observed median backs
+    off by one; otherwise the limit grows by one. The limit stays within [min, max].
+    Workers hold a slot() around each page, so the controller acts as a resizable semaphore.
+    """
+
+    def __init__(self, initial: int, min_limit: int = DEFAULT_MIN_CONCURRENCY, max_limit: int = DEFAULT_MAX_CONCURRENCY,
+                 window: int = 20, error_threshold: float = 0.05, latency_tolerance: float = 2.0):
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = min(max(initial, self.min_limit), self.max_limit)
+        self.window = window
+        self.error_threshold = error_threshold
+        self.latency_tolerance = latency_tolerance
+        self.in_flight = 0
+        self.baseline_latency: Optional[float] = None
+        self.hosts: Dict[str, Dict[str, Any]] = {}
+        self.history = deque([(0.0, self.limit)], maxlen=1000)
+        self._started = time.monotonic()
+        self._latencies: List[float] = []
+        self._errors = 0
+        self._waiters = deque()  # futures of acquire() calls waiting for a slot
+
+    async def acquire(self):
+        if self.in_flight < self.limit and not self._waiters:
+            self.in_flight += 1
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await waiter  # resolved with the slot already taken for us
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.in_flight -= 1  # granted just as we were cancelled: pass it on
+                self._wake()
+            elif waiter in self._waiters:
+                self._waiters.remove(waiter)
+            raise
+
+    async def release(self):
+        self.in_flight -= 1
+        self._wake()
+
+    def _wake(self):
+        """Hand free slots to waiters in arrival order; also called when the limit grows"""
+        while self._waiters and self.in_flight < self.limit:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+    def slot(self):
+        return _ConcurrencySlot(self)
+
+    def record(self, url: str, latency: float, outcome: str = "ok"):
+        """Record one request outcome: 'ok', 'throttled' (429/503) or 'timeout'"""
+        host = HostRateLimiter.host_key(url)
+        stats = self.hosts.setdefault(host, {"requests": 0, "throttled": 0, "timeouts": 0, "latency_ewma": None})
+        stats["requests"] += 1
+        if outcome == "ok":
+            ewma = stats["latency_ewma"]
+            stats["latency_ewma"] = latency if ewma is None else 0.8 * ewma + 0.2 * latency
+            self._latencies.append(latency)
+        else:
+            stats["throttled" if outcome == "throttled" else "timeouts"] += 1
+            self._errors += 1
+        if len(self._latencies) + self._errors >= self.window:
+            self._adjust()
+
+    def _adjust(self):
+        samples = len(self._latencies) + self._errors
+        error_rate = self._errors / samples
+        median = sorted(self._latencies)[len(self._latencies) // 2] if self._latencies else None
+        if median is not None:
+            self.baseline_latency = median if self.baseline_latency is None else min(self.baseline_latency, median)
+
+        new_limit = self.limit
+        if error_rate > self.error_threshold:
+            new_limit = max(self.min_limit, self.limit // 2)
+        elif median is not None and median > self.baseline_latency * self.latency_tolerance:
+            new_limit = max(self.min_limit, self.limit - 1)
+        else:
+            new_limit = min(self.max_limit, self.limit + 1)
+
+        self._latencies = []
+        self._errors = 0
+        if new_limit != self.limit:
+            self.limit = new_limit
+            self.history.append((round(time.monotonic() - self._started, 3), new_limit))
+            self._wake()  # a raised limit admits waiters now, not at the next release()
+
+class _ConcurrencySlot:
+    def __init__(self, controller: AdaptiveConcurrency):
+        self.controller = controller
+
+    async def __aenter__(self):
+        await self.controller.acquire()
+
+    async def __aexit__(self, *exc):
+        await self.controller.release()
+
+class _BreakerState:
+    __slots__ = ('failures', 'trips', 'open_until', 'cooldown', 'probe_started')
+
+    def __init__(self, cooldown: float):
+        self.failures = 0
+        self.trips = 0
+        self.open_until: Optional[float] = None
+        self.cooldown = cooldown
+        self.probe_started: Optional[float] = None
+
+class HostCircuitBreaker:
+    """
+    Per-host circuit breaker: after `threshold` consecutive 5xx answers or
+    connection failures a host is left alone for `cooldown` seconds, and requests
+    to it fail fast instead of adding load. Then a single probe request goes
+    through; success closes the circuit, failure reopens it with twice the
+    cool-down (up to BREAKER_MAX_COOLDOWN_SEC). After BREAKER_MAX_TRIPS trips
+    without a success the host is exhausted and its pages stop waiting for it.
+    """
+
+    def __init__(self, threshold: int = DEFAULT_BREAKER_THRESHOLD, cooldown: float = DEFAULT_BREAKER_COOLDOWN_SEC):
+        self.threshold = max(1, threshold)
+        self.cooldown = cooldown
+        self.trips = 0
+        self._hosts: Dict[str, _BreakerState] = {}
+
+    def is_open(self, url: str) -> bool:
+        state = self._hosts.get(HostRateLimiter.host_key(url))
+        return bool(state and state.open_until is not None)
+
+    def exhausted(self, url: str) -> bool:
+        state = self._hosts.get(HostRateLimiter.host_key(url))
+        return bool(state and state.trips >= BREAKER_MAX_TRIPS)
+
+    def remaining(self, url: str) -> float:
+        """Seconds until the host's circuit lets a probe through"""
+        state = self._hosts.get(HostRateLimiter.host_key(url))
+        if not state or state.open_until is None:
+            return 0.0
+        return max(0.0, state.open_until - time.monotonic())
+
+    def retry_after(self, url: str) -> float:
+        """Seconds a page turned away by the circuit should wait: the rest of the
+        cool-down, or a whole cool-down while a half-open probe has not reported"""
+        state = self._hosts.get(HostRateLimiter.host_key(url))
+        if not state or state.open_until is None:
+            return 0.0
+        remaining = state.open_until - time.monotonic()
+        if remaining > 0:
+            return remaining
+        return state.cooldown if state.probe_started is not None else 0.0
+
+    def allow(self, url: str) -> bool:
+        state = self._hosts.get(HostRateLimiter.host_key(url))
+        if not state or state.open_until is None:
+            return True
+        now = time.monotonic()
+        if now < state.open_until:
+            return False
+        # half-open: one probe at a time (a probe that never reported is replaced)
+        if state.probe_started is None or now - state.probe_started > state.cooldown:
+            state.probe_started = now
+            return True
+        return False
+
+    def record(self, url: str, ok: bool):
+        host = HostRateLimiter.host_key(url)
+        state = self._hosts.get(host)
+        if ok:
+            if state and state.open_until is not None:
+                log(f"Circuit closed for {host}")
+            if state:
+                self._hosts[host] = _BreakerState(self.cooldown)
+            return
+        if state is None:
+            state = self._hosts[host] = _BreakerState(self.cooldown)
+        state.failures += 1
+        probe_failed = state.probe_started is not None
+        if probe_failed or (state.open_until is None and state.failures >= self.threshold):
+            if probe_failed:
+                state.cooldown = min(state.cooldown * 2, BREAKER_MAX_COOLDOWN_SEC)
+            state.open_until = time.monotonic() + state.cooldown
+            state.probe_started = None
+            state.trips += 1
+            self.trips += 1
+            log(f"Circuit open for {host} after {state.failures} failures, cooling down {state.cooldown:.0f}s")
+
+class ValidatorStore:
+    """
+    HTTP cache validators (ETag / Last-Modified) per URL, with the output file
+    each URL was written to. Persisted next to the output so an --update run
+    can revalidate pages with conditional GETs and skip them on 304.
+    """
+    FILENAME = "_http_cache.json"
+
+    def __init__(self, path: Optional[Path] = None):
+        self.path = path
+        self.entries: Dict[str, Dict[str, str]] = {}
+        self.dirty = False
+
+    @classmethod
+    def load(cls, path: Path) -> "ValidatorStore":
+        store = cls(path)
+        if path.exists():
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    store.entries = json.load(f)
+            except Exception as e:
+                log(f"Failed to load HTTP cache validators: {e}")
+        return store
+
+    def save(self):
+        if not (self.path and self.dirty):
+            return
+        try:
+            tmp_path = self.path.with_suffix('.tmp')
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.entries, f)
+            os.replace(tmp_path, self.path)
+            self.dirty = False
+        except Exception as e:
+            log(f"Failed to save HTTP cache validators: {e}")
+
+    def output_path(self, url: str, output_dir: Path) -> Optional[Path]:
+        entry = self.entries.get(url)
+        return output_dir / entry['path'] if entry and entry.get('path') else None
+
+    def conditional_headers(self, url: str, output_dir: Path, output_format: str) -> Dict[str, str]:
+        """If-None-Match / If-Modified-Since for a URL whose previous output is still on disk"""
+        entry = self.entries.get(url)
+        if not entry or entry.get('format') != output_format:
+            return {}
+        file_path = self.output_path(url, output_dir)
+        if file_path is None or not file_path.exists():
+            return {}
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def record(self, url: str, response_headers, rel_path: Path, output_format: str):
+        entry = {'path': rel_path.as_posix(), 'format': output_format}
+        if response_headers.get('ETag'):
+            entry['etag'] = response_headers['ETag']
+        if response_headers.get('Last-Modified'):
+            entry['last_modified'] = response_headers['Last-Modified']
+        self.entries[url] = entry
+        self.dirty = True
+
+# --- Near-duplicate detection (--dedup) ---
+
+def simhash(text: str) -> Optional[int]:
+    """
+    64-bit SimHash of a page's Markdown over word 3-shingles. Pages that share most
+    of their text get signatures differing in few bits. Returns None for pages too
+    short to compare reliably.
+    """
+    words = re.findall(r'\w+', text.lower())
+    if len(words) < DEDUP_MIN_WORDS:
+        return None
+    shingles = Counter(' '.join(words[i:i + 3]) for i in range(len(words) - 2))
+    weights = [0] * 64
+    for shingle, count in shingles.items():
+        value = int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'), digest_size=8).digest(), 'big')
+        for bit in range(64):
+            weights[bit] += count if value >> bit & 1 else -count
+    return sum(1 << bit for bit in range(64) if weights[bit] > 0)
+
+class SimHashIndex:
+    """
+    In-memory LSH index of page SimHashes for --dedup. The 64 bits are split into
+    `max_distance + 1` bands: two signatures within `max_distance` differing bits
+    agree exactly on at least one band, so a lookup only compares against pages
+    sharing a band value instead of every page seen. process_url looks a page up
+    before writing it and indexes it only once it has been written, so an alias
+    never points at a page without output.
+    """
+
+    def __init__(self, max_distance: int = DEFAULT_DEDUP_DISTANCE):
+        self.max_distance = max_distance
+        band_count = max_distance + 1
+        width = 64 // band_count
+        self.bands = [(i * width, (64 - i * width) if i == band_count - 1 else width) for i in range(band_count)]
+        self.tables: List[Dict[int, List[int]]] = [{} for _ in self.bands]
+        self.signatures: List[int] = []
+        self.urls: List[str] = []
+        self._entries: Dict[str, int] = {}  # URL -> entry, so a re-indexed page replaces its signature
+
+    def __len__(self) -> int:
+        return len(self.signatures)
+
+    def _keys(self, signature: int) -> Iterator[Tuple[int, int]]:
+        for band, (shift, width) in enumerate(self.bands):
+            yield band, (signature >> shift) & ((1 << width) - 1)
+
+    def find(self, signature: int, url: Optional[str] = None) -> Optional[str]:
+        """URL of an indexed page within max_distance bits (other than `url` itself)"""
+        for band, key in self._keys(signature):
+            for entry in self.tables[band].get(key, ()):
+                if self.urls[entry] != url and (self.signatures[entry] ^ signature).bit_count() <= self.max_distance:
+                    return self.urls[entry]
+        return None
+
+    def add(self, signature: int, url: str):
+        """Index `url` as an original; a URL indexed before keeps one entry with the new signature"""
+        entry = self._entries.get(url)
+        if entry is None:
+            entry = self._entries[url] = len(self.signatures)
+            self.signatures.append(signature)
+            self.urls.append(url)
+        elif self.signatures[entry] == signature:
+            return
+        else:
+            for band, key in self._keys(self.signatures[entry]):
+                self.tables[band][key].remove(entry)
+            self.signatures[entry] = signature
+        for band, key in self._keys(signature):
+            self.tables[band].setdefault(key, []).append(entry)
+
+class ManifestStore:
+    """
+    Per-page manifest entries (output path, content hash, size, token count),
+    appended to `_manifest_pages.jsonl` by process_url as each page is written.
+    The file outlives the run, so pages skipped by --update keep their entries;
+    `entries()` replays it (later records win) and `compact()` rewrites it with
+    one line per URL. `_manifest.json` is built from the entries at finalize,
+    without reading the pages back, for every output format.
+    """
+    FILENAME = "_manifest_pages.jsonl"
+    HASH_ALGORITHM = "sha256"
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._file = None
+
+    def _open(self):
+        # A crash can leave a torn last line; start the next record on a fresh one
+        torn = False
+        if self.path.exists() and self.path.stat().st_size:
+            with open(self.path, 'rb') as f:
+                f.seek(-1, os.SEEK_END)
+                torn = f.read(1) != b'\n'
+        self._file = open(self.path, 'a', encoding='utf-8', buffering=1)
+        if torn:
+            self._file.write('\n')
+
+    def record(self, url: str, path: Optional[str], content_hash: str, size: int, tokens: int = 0,
+               simhash: Optional[int] = None, alias_of: Optional[str] = None):
+        """One page; a near-duplicate has no output of its own and names its original in `alias_of`"""
+        if self._file is None:
+            self._open()
+        record = {'url': url, 'path': path, 'hash': content_hash, 'size': size, 'tokens': tokens}
+        if simhash is not None:
+            record['simhash'] = simhash
+        if alias_of:
+            record['alias_of'] = alias_of
+        self._file.write(json.dumps(record) + '\n')
+
+    def records(self) -> Iterator[Dict[str, Any]]:
+        """Every record in write order, including superseded ones"""
+        if not self.path.exists():
+            return
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if 'url' in record:
+                    yield record
+
+    def entries(self) -> Dict[str, Dict[str, Any]]:
+        """Latest entry per URL"""
+        pages: Dict[str, Dict[str, Any]] = {}
+        for record in self.records():
+            pages[record.pop('url')] = record
+        return pages
+
+    def compact(self, records):
+        """Rewrite the store from `records`: a {url: entry} dict or an iterable of records with one per URL"""
+        self.close()
+        if isinstance(records, dict):
+            records = ({'url': url, **entry} for url, entry in records.items())
+        tmp_path = self.path.with_suffix('.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for record in records:
+                f.write(json.dumps(record) + '\n')
+        os.replace(tmp_path, self.path)
+
+    def clear(self):
+        self.close()
+        self.path.unlink(missing_ok=True)
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+
+class CrawlContext:
+    """Crawl-scoped services shared by process_url and the fetch helpers"""
+
+    def __init__(self, limiter: Optional[HostRateLimiter] = None, concurrency: Optional[AdaptiveConcurrency] = None,
+                 executor: Optional[Executor] = None, validators: Optional[ValidatorStore] = None,
+                 sqlite: Optional["SQLiteSink"] = None, uploader: Optional["S3Uploader"] = None,
+                 archive: Optional["ArchiveWriter"] = None, dataset: Optional["DatasetWriter"] = None,
+                 manifest: Optional[ManifestStore] = None, dedup: Optional[SimHashIndex] = None,
+                 paths: Optional[PathRegistry] = None, breaker: Optional[HostCircuitBreaker] = None,
+                 assets: Optional[AssetStore] = None, robots: Optional[RobotsCache] = None,
+                 diff_baseline: Optional[Path] = None):
+        self.limiter = limiter
+        self.concurrency = concurrency
+        self.executor = executor
+        self.validators = validators
+        self.sqlite = sqlite
+        self.uploader = uploader
+        self.archive = archive
+        self.dataset = dataset
+        self.manifest = manifest
+        self.dedup = dedup
+        self.paths = paths
+        self.breaker = breaker
+        self.assets = assets
+        self.robots = robots
+        self.diff_baseline = diff_baseline
+
+def accept_encoding() -> str:
+    """Accept-Encoding limited to codecs httpx can decode here, strongest first"""
+    codecs = []
+    if zstandard:
+        codecs.append('zstd')
+    if brotli:
+        codecs.append('br')
+    return ", ".join(codecs + ['gzip', 'deflate'])
+
+class TransportStats:
+    """Requests, new connections and DNS lookups per host: how well connections are reused"""
+
+    def __init__(self):
+        self.hosts: Dict[str, Counter] = {}
+        self.http_versions: Counter = Counter()
+        self.dns_lookups = 0
+        self.dns_hits = 0
+
+    def _host(self, host: str) -> Counter:
+        counts = self.hosts.get(host)
+        if counts is None:
+            counts = self.hosts[host] = Counter()
+        return counts
+
+    def request(self, host: str, http_version: str):
+        self._host(host)['requests'] += 1
+        self.http_versions[http_version] += 1
+
+    def connection(self, host: str):
+        self._host(host)['connections'] += 1
+
+    def summary(self) -> Dict[str, Any]:
+        requests = sum(counts['requests'] for counts in self.hosts.values())
+        connections = sum(counts['connections'] for counts in self.hosts.values())
+        busiest = sorted(self.hosts.items(), key=lambda item: -item[1]['requests'])[:TRANSPORT_STATS_HOSTS]
+        return {
+            "requests": requests,
+            "connections": connections,
+            "reuse_ratio": round(1 - connections / requests, 4) if requests else 0.0,
+            "http_versions": dict(self.http_versions),
+            "dns": {"lookups": self.dns_lookups, "cache_hits": self.dns_hits},
+            "hosts": {host: dict(counts) for host, counts in busiest},
+        }
+
+class CachingNetworkBackend(httpcore.AsyncNetworkBackend):
+    """
+    httpcore network backend that resolves each host once per DNS_CACHE_TTL_SEC
+    (concurrent lookups for a host share one getaddrinfo) and counts new TCP
+    connections. Every resolved address is kept and tried in turn, so an
+    unreachable first address (e.g. IPv6 on an IPv4-only network) falls through
+    to the next; the one that answers moves to the front. TLS still uses the
+    hostname for SNI and certificate checks.
+    """
+
+    def __init__(self, inner: httpcore.AsyncNetworkBackend, stats: TransportStats, ttl: float = DNS_CACHE_TTL_SEC):
+        self.inner = inner
+        self.stats = stats
+        self.ttl = ttl
+        self._cache: Dict[Tuple[str, int], Tuple[float, List[str]]] = {}
+        self._pending: Dict[Tuple[str, int], asyncio.Future] = {}
+
+    async def resolve(self, host: str, port: int) -> List[str]:
+        try:
+            ipaddress.ip_address(host)
+            return [host]
+        except ValueError:
+            pass
+        key = (host, port)
+        cached = self._cache.get(key)
+        if cached and cached[0] > time.monotonic():
+            self.stats.dns_hits += 1
+            return cached[1]
+        pending = self._pending.get(key)
+        if pending:
+            self.stats.dns_hits += 1
+            return await asyncio.shield(pending)
+        future = self._pending[key] = asyncio.get_running_loop().create_future()
+        try:
+            self.stats.dns_lookups += 1
+            infos = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+            addresses = list(dict.fromkeys(info[4][0] for info in infos))
+            self._cache[key] = (time.monotonic() + self.ttl, addresses)
+            future.set_result(addresses)
+            return addresses
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # retrieved here; waiters re-raise it
+            raise
+        finally:
+            del self._pending[key]
+
+    async def connect_tcp(self, host: str, port: int, timeout: Optional[float] = None,
+                          local_address: Optional[str] = None, socket_options=None) -> httpcore.AsyncNetworkStream:
+        addresses = await self.resolve(host, port)
+        error = None
+        for address in list(addresses):
+            try:
+                stream = await self.inner.connect_tcp(address, port, timeout=timeout, local_address=local_address,
+                                                      socket_options=socket_options)
+            except Exception as e:
+                error = e
+                continue
+            if address != addresses[0] and address in addresses:
+                addresses.remove(address)
+                addresses.insert(0, address)
+            self.stats.connection(host)
+            return stream
+        self._cache.pop((host, port), None)  # the host may have moved
+        raise error
+
+    async def connect_unix_socket(self, path: str, timeout: Optional[float] = None,
+                                  socket_options=None) -> httpcore.AsyncNetworkStream:
+        return await self.inner.connect_unix_socket(path, timeout=timeout, socket_options=socket_options)
+
+    async def sleep(self, seconds: float):
+        await self.inner.sleep(seconds)
+
+# httpcore's exceptions and the httpx ones callers catch, most specific first
+HTTPCORE_ERRORS = (
+    (httpcore.ConnectTimeout, httpx.ConnectTimeout),
+    (httpcore.ReadTimeout, httpx.ReadTimeout),
+    (httpcore.WriteTimeout, httpx.WriteTimeout),
+    (httpcore.PoolTimeout, httpx.PoolTimeout),
+    (httpcore.TimeoutException, httpx.TimeoutException),
+    (httpcore.ConnectError, httpx.ConnectError),
+    (httpcore.ReadError, httpx.ReadError),
+    (httpcore.WriteError, httpx.WriteError),
+    (httpcore.NetworkError, httpx.NetworkError),
+    (httpcore.ProxyError, httpx.ProxyError),
+    (httpcore.UnsupportedProtocol, httpx.UnsupportedProtocol),
+    (httpcore.LocalProtocolError, httpx.LocalProtocolError),
+    (httpcore.RemoteProtocolError, httpx.RemoteProtocolError),
+    (httpcore.ProtocolError, httpx.ProtocolError),
+)
+
+@contextlib.contextmanager
+def httpcore_errors(request: httpx.Request):
+    """Re-raise httpcore's exceptions as their httpx counterparts"""
+    try:
+        yield
+    except Exception as e:
+        for core_error, http_error in HTTPCORE_ERRORS:
+            if isinstance(e, core_error):
+                raise http_error(str(e), request=request) from e
+        raise
+
+class _PoolStream(httpx.AsyncByteStream):
+    """httpcore response body, read with httpx's exceptions"""
+
+    def __init__(self, stream, request: httpx.Request):
+        self.stream = stream
+        self.request = request
+
+    async def __aiter__(self):
+        with httpcore_errors(self.request):
+            async for chunk in self.stream:
+                yield chunk
+
+    async def aclose(self):
+        if hasattr(self.stream, 'aclose'):
+            with httpcore_errors(self.request):
+                await self.stream.aclose()
+
+class PoolTransport(httpx.AsyncBaseTransport):
+    """
+    httpx transport over an httpcore connection pool (or proxy) built by the
+    caller, so the pool gets its network backend through httpcore's public
+    `network_backend` argument.
+    """
+
+    def __init__(self, pool: httpcore.AsyncConnectionPool):
+        self.pool = pool
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        core_request = httpcore.Request(
+            method=request.method,
+            url=httpcore.URL(scheme=request.url.raw_scheme, host=request.url.raw_host,
+                             port=request.url.port, target=request.url.raw_path),
+            headers=request.headers.raw,
+            content=request.stream,
+            extensions=request.extensions,
+        )
+        with httpcore_errors(request):
+            response = await self.pool.handle_async_request(core_request)
+        return httpx.Response(status_code=response.status, headers=response.headers,
+                              stream=_PoolStream(response.stream, request), extensions=response.extensions)
+
+    async def aclose(self):
+        await self.pool.aclose()
+
+class ProxyRule:
+    """
+    Which URLs one environment proxy setting covers: a scheme ('all' for any)
+    and optionally a host, which also covers its subdomains, or an IP address
+    or network.
+    """
+
+    def __init__(self, scheme: str, host: str = ''):
+        self.scheme = scheme
+        self.host = host.lower().lstrip('*').lstrip('.')
+        try:
+            self.network = ipaddress.ip_network(self.host, strict=False) if self.host else None
+        except ValueError:
+            self.network = None
+        # NO_PROXY hosts before scheme proxies, and HTTP(S)_PROXY before ALL_PROXY
+        self.rank = (not self.host, scheme == 'all')
+
+    def matches(self, url: httpx.URL) -> bool:
+        if self.scheme != 'all' and url.scheme != self.scheme:
+            return False
+        if not self.host:
+            return True
+        host = url.host.lower()
+        if self.network is not None:
+            try:
+                return ipaddress.ip_address(host) in self.network
+            except ValueError:
+                return False
+        return host == self.host or host.endswith('.' + self.host)
+
+def environment_proxies() -> List[Tuple[ProxyRule, Optional[str]]]:
+    """
+    HTTP_PROXY / HTTPS_PROXY / ALL_PROXY and NO_PROXY as (rule, proxy URL)
+    pairs, first match wins; a None URL means connect directly. NO_PROXY=*
+    turns proxying off altogether.
+    """
+    proxies = getproxies()
+    rules = []
+    for scheme in ('http', 'https', 'all'):
+        url = proxies.get(scheme)
+        if url:
+            rules.append((ProxyRule(scheme), url if '://' in url else f"http://{url}"))
+    for host in proxies.get('no', '').split(','):
+        host = host.strip()
+        if host == '*':
+            return []
+        if host:
+            rules.append((ProxyRule('all', host), None))
+    return sorted(rules, key=lambda rule: rule[0].rank)
+
+class _ReleasingStream(httpx.AsyncByteStream):
+    """Response body that frees its host slot when the response is closed"""
+
+    def __init__(self, stream, release):
+        self.stream = stream
+        self.release = release
+
+    async def __aiter__(self):
+        async for chunk in self.stream:
+            yield chunk
+
+    async def aclose(self):
+        try:
+            await self.stream.aclose()
+        finally:
+            if self.release:
+                self.release()
+                self.release = None
+
+class CrawlTransport(httpx.AsyncBaseTransport):
+    """
+    Crawler transport profile: pooled httpcore connections (optionally HTTP/2)
+    with the DNS cache, at most `per_host` requests in flight per host (0 = no
+    cap), and connection reuse statistics.
+    httpx ignores HTTP(S)_PROXY / NO_PROXY once a client is given a transport, so
+    without an explicit `proxy` the environment's proxy map is routed here instead.
+    """
+
+    def __init__(self, per_host: int = DEFAULT_CONNECTIONS_PER_HOST, http2: bool = False,
+                 limits: Optional[httpx.Limits] = None, proxy: Optional[str] = None, trust_env: bool = True):
+        self.stats = TransportStats()
+        self.per_host = per_host
+        self.backend = CachingNetworkBackend(httpcore.AnyIOBackend(), self.stats)
+        limits = limits or httpx.Limits()
+        self.inner = self._pool(http2, limits, proxy, trust_env)
+        self.mounts: List[Tuple[ProxyRule, Optional[PoolTransport]]] = []
+        if proxy is None and trust_env:
+            self.mounts = [(rule, None if url is None else self._pool(http2, limits, url, trust_env))
+                           for rule, url in environment_proxies()]
+        self._slots: Dict[str, asyncio.Semaphore] = {}
+
+    def _pool(self, http2: bool, limits: httpx.Limits, proxy: Optional[str], trust_env: bool) -> PoolTransport:
+        options = dict(
+            ssl_context=httpx.create_ssl_context(trust_env=trust_env),
+            max_connections=limits.max_connections,
+            max_keepalive_connections=limits.max_keepalive_connections,
+            keepalive_expiry=limits.keepalive_expiry,
+            http2=http2,
+            network_backend=self.backend,
+        )
+        if proxy is None:
+            return PoolTransport(httpcore.AsyncConnectionPool(**options))
+        url = httpx.URL(proxy)
+        proxy_url = httpcore.URL(scheme=url.raw_scheme, host=url.raw_host, port=url.port, target=url.raw_path)
+        proxy_auth = (url.username, url.password) if url.username else None
+        if url.scheme in ('http', 'https'):
+            return PoolTransport(httpcore.AsyncHTTPProxy(proxy_url=proxy_url, proxy_auth=proxy_auth, **options))
+        if url.scheme in ('socks5', 'socks5h'):
+            return PoolTransport(httpcore.AsyncSOCKSProxy(proxy_url=proxy_url, proxy_auth=proxy_auth, **options))
+        raise ValueError(f"Unsupported proxy scheme {url.scheme!r} (use http, https, socks5 or socks5h)")
+
+    def transport_for(self, url: httpx.URL) -> httpx.AsyncBaseTransport:
+        """The proxy transport mounted for `url` by the environment, else the direct pool"""
+        for rule, transport in self.mounts:
+            if rule.matches(url):
+                return self.inner if transport is None else transport
+        return self.inner
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        host = request.url.host
+        slot = None
+        if self.per_host > 0:
+            slot = self._slots.get(host)
+            if slot is None:
+                slot = self._slots[host] = asyncio.Semaphore(self.per_host)
+            await slot.acquire()
+        try:
+            response = await self.transport_for(request.url).handle_async_request(request)
+        except BaseException:
+            if slot:
+                slot.release()
+            raise
+        self.stats.request(host, response.extensions.get('http_version', b'HTTP/1.1').decode('ascii', 'replace'))
+        if slot:
+            if response.is_closed:
+                slot.release()  # body already in memory
+            else:
+                # The slot is held until the body has been read or the response closed
+                response.stream = _ReleasingStream(response.stream, slot.release)
+        return response
+
+    async def aclose(self):
+        await self.inner.aclose()
+        for _, transport in self.mounts:
+            if transport is not None:
+                await transport.aclose()
+
+class FetchRejected(Exception):
+    """A page turned away from its headers or size before (all of) its body was downloaded"""
+
+class FetchClientError(FetchRejected):
+    """A 4xx answer other than 408/429: asking again will get the same answer"""
+
+def page_content_type_allowed(content_type: str, pdf: bool = False) -> bool:
+    """Content types process_url can convert; a missing Content-Type is given the benefit of the doubt"""
+    media_type = content_type.split(';', 1)[0].strip().lower()
+    if not media_type:
+        return True
+    if media_type == 'application/pdf':
+        return pdf
+    return media_type.startswith(PAGE_CONTENT_TYPES) or media_type.endswith('+xml')
+
+class FetchedPage:
+    """
+    Response-like result of a streamed fetch: headers from the httpx response,
+    body read in full once the headers and size cap allowed it. The body is kept
+    in memory: conversion needs all of it (and a worker process gets a pickled
+    copy), so spooling it to disk would only add a round trip.
+    """
+
+    def __init__(self, response: httpx.Response, content: bytes):
+        self.status_code = response.status_code
+        self.headers = response.headers
+        self.url = response.url
+        self.request = response.request
+        self.encoding = response.charset_encoding or 'utf-8'
+        self.content = content
+        self.size = len(content)
+
+    @property
+    def text(self) -> str:
+        try:
+            return self.content.decode(self.encoding, errors='replace')
+        except LookupError:
+            return self.content.decode('utf-8', errors='replace')
+
+async def _read_body(response: httpx.Response, url: str, max_bytes: Optional[int],
+                     accept: Optional[Callable[[str], bool]]) -> FetchedPage:
+    """Check a streamed response's headers, then read its body up to `max_bytes`"""
+    try:
+        content_type = response.headers.get('Content-Type', '')
+        if accept and not accept(content_type):
+            raise FetchRejected(f"content type {content_type or 'unknown'}")
+        declared = response.headers.get('Content-Length', '')
+        if max_bytes and declared.isdigit() and int(declared) > max_bytes:
+            raise FetchRejected(f"Content-Length {declared} over {max_bytes} bytes")
+        chunks = []
+        size = 0
+        async for chunk in response.aiter_bytes():
+            size += len(chunk)
+            if max_bytes and size > max_bytes:
+                # also catches missing or understated Content-Length and compression bombs
+                raise FetchRejected(f"body over {max_bytes} bytes")
+            chunks.append(chunk)
+        return FetchedPage(response, b''.join(chunks))
+    finally:
+        await response.aclose()
+
+async def fetch_with_retry(client: httpx.AsyncClient, url: str, rate_limit: float, timeout_sec: int = 30,
+                           ctx: Optional[CrawlContext] = None,
+                           headers: Optional[Dict[str, str]] = None, max_bytes: Optional[int] = None,
+                           accept: Optional[Callable[[str], bool]] = None) -> Optional[httpx.Response]:
+    """Fetch URL with exponential backoff and retry logic using httpx.
+    A 304 Not Modified answer to conditional `headers` is returned as-is.
+    With `max_bytes` or `accept` the response is streamed: its headers are checked
+    first and the body is read into a FetchedPage; FetchRejected is raised for
+    an unwanted content type or an oversized body. Only transient failures (5xx,
+    408/429, timeouts, transport errors) are retried; other 4xx answers raise
+    FetchClientError at once."""
+    stream = bool(max_bytes or accept)
+    limiter = ctx.limiter if ctx else None
+    controller = ctx.concurrency if ctx else None
+    breaker = ctx.breaker if ctx else None
+    for retry in range(MAX_RETRIES):
+        try:
+            if breaker and not breaker.allow(url):
+                log(f"Circuit open, skipping for now: {url}")
+                return None
+            if limiter:
+                await limiter.acquire(url)
+            started = time.monotonic()
+            if stream:
+                request = client.build_request("GET", url, headers=headers, timeout=timeout_sec)
+                response = await client.send(request, stream=True, follow_redirects=True)
+                if not response.is_success:
+                    await response.aclose()  # only the status and headers are used
+            else:
+                response = await client.get(url, headers=headers, timeout=timeout_sec, follow_redirects=True)
+            if controller:
+                controller.record(url, time.monotonic() - started, "throttled" if response.status_code in (429, 503) else "ok")
+            throttled = response.status_code == 429 or (response.status_code == 503 and response.headers.get('Retry-After'))
+            if breaker and not throttled:
+                breaker.record(url, response.status_code < 500)
+
+            if throttled:
+                delay = parse_retry_after(response.headers.get('Retry-After'))
+                if delay is not None:
+                    log(f"Rate limit hit, Retry-After: {delay}s")
+                else:
+                    delay = exponential_backoff(retry)
+                    log(f"Rate limit hit, backing off for {delay:.1f}s")
+                if limiter:
+                    # Pause the whole host, not just this request
+                    limiter.pause(url, delay)
+                else:
+                    await asyncio.sleep(delay)
+                continue
+
+            if response.status_code == 304:
+                return response
+            if 400 <= response.status_code < 500 and response.status_code != 408:
+                raise FetchClientError(f"HTTP {response.status_code}")
+            response.raise_for_status()
+            if stream:
+                return await _read_body(response, url, max_bytes, accept)
+            return response
+        except httpx.HTTPError as e:
+            if controller and isinstance(e, httpx.TimeoutException):
+                controller.record(url, time.monotonic() - started, "timeout")
+            if breaker and isinstance(e, httpx.TransportError):
+                breaker.record(url, False)
+            if retry < MAX_RETRIES - 1:
+                delay = exponential_backoff(retry)
+                # log(f"Request failed (attempt {retry+1}/{MAX_RETRIES}): {e}. Retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+            else:
+                log(f"Request failed after {MAX_RETRIES} attempts: {e} URL: {url}")
+                return None
+    return None
+
+async def validate_sitemap(client: httpx.AsyncClient, url: str) -> bool:
+    """Validate that URL points to a valid XML sitemap"""
+    try:
+        response = await client.head(url, timeout=10.0, follow_redirects=True)
+        if response.status_code == 200:
+            content_type = response.headers.get('content-type', '').lower()
+            if 'xml' in content_type or 'gzip' in content_type or url.endswith(SITEMAP_SUFFIXES):
+                return True
+    except httpx.HTTPError:
+        pass
+    return False
+
+async def discover_sitemap(client: httpx.AsyncClient, base_url: str) -> Optional[str]:
+    """Discover sitemap URL with explicit priority order."""
+    log(f"Discovering sitemap for {base_url}")
+    
+    parsed = urlparse(base_url)
+    base = f"{parsed.scheme}://{parsed.netloc}"
+    
+    # Priority 1: Direct XML (plain or gzipped)
+    if base_url.endswith(SITEMAP_SUFFIXES):
+        if await validate_sitemap(client, base_url):
+            log(f"Using direct XML URL: {base_url}")
+            return base_url
+    
+    # Priority 2: Standard locations
+    candidates = [
+        f"{base}/sitemap.xml",
+        f"{base}/sitemap_index.xml",
+    ]
+    
+    for candidate in candidates:
+        if await validate_sitemap(client, candidate):
+            log(f"Found sitemap at: {candidate}")
+            return candidate
+            
+    # Priority 3: robots.txt
+    robots_url = f"{base}/robots.txt"
+    try:
+        response = await client.get(robots_url, timeout=10.0, follow_redirects=True)
+        for line in response.text.splitlines():
+            if line.lower().startswith('sitemap:'):
+                sitemap_url = line.split(':', 1)[1].strip()
+                if await validate_sitemap(client, sitemap_url):
+                    log(f"Found sitemap in robots.txt: {sitemap_url}")
+                    return sitemap_url
+    except httpx.HTTPError:
+        pass
+        
+    log("No sitemap found at any location")
+    return None
+
+class SitemapStreamParser:
+    """
+    Incremental sitemap parser fed with raw bytes as they arrive.
+    Gzip payloads (.xml.gz) are detected by their magic bytes and inflated on the fly,
+    so neither the compressed nor the decompressed document is ever held in memory.
+    feed() returns (kind, loc, meta) entries where kind is 'url' or 'sitemap'.
+    """
+
+    def __init__(self):
+        self._parser = ET.XMLPullParser(events=('start', 'end'))
+        self._inflater = None
+        self._head = b''
+        self._sniffed = False
+        self._root = None
+        self._loc = None
+        self._meta: Dict[str, str] = {}
+        self.root_tag: Optional[str] = None
+
+    @property
+    def is_index(self) -> bool:
+        return self.root_tag == 'sitemapindex'
+
+    def feed(self, chunk: bytes) -> List[Tuple[str, str, dict]]:
+        if not self._sniffed:
+            # Need two bytes to recognise the gzip magic number
+            self._head += chunk
+            if len(self._head) < len(GZIP_MAGIC):
+                return []
+            chunk, self._head, self._sniffed = self._head, b'', True
+            if chunk.startswith(GZIP_MAGIC):
+                self._inflater = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        if self._inflater:
+            chunk = self._inflater.decompress(chunk)
+        self._parser.feed(chunk)
+        return self._drain()
+
+    def close(self) -> List[Tuple[str, str, dict]]:
+        if self._head:
+            self._sniffed = True
+            self._parser.feed(self._head)
+            self._head = b''
+        if self._inflater:
+            self._parser.feed(self._inflater.flush())
+        self._parser.close()
+        return self._drain()
+
+    def _drain(self) -> List[Tuple[str, str, dict]]:
+        entries = []
+        for event, elem in self._parser.read_events():
+            tag = _sitemap_tag(elem.tag)
+            if event == 'start':
+                if self._root is None:
+                    self._root = elem
+                    self.root_tag = tag
+                continue
+            if tag == 'loc':
+                self._loc = (elem.text or '').strip()
+            elif tag in ('lastmod', 'changefreq', 'priority'):
+                if elem.text:
+                    self._meta[tag] = elem.text.strip()
+            elif tag in ('url', 'sitemap'):
+                if self._loc:
+                    entries.append((tag, self._loc, self._meta))
+                self._loc = None
+                self._meta = {}
+                # Drop finished entries so memory stays flat for huge documents
+                self._root.clear()
+        return entries
+
+def _sitemap_tag(tag: str) -> Optional[str]:
+    """Strip the sitemap namespace; tags from extension namespaces (image:loc, ...) map to None"""
+    if tag.startswith(NS):
+        return tag[len(NS):]
+    if tag.startswith('{'):
+        return None
+    return tag
+
+def parse_sitemap_document(xml_content) -> Iterator[Tuple[str, str, dict]]:
+    """Parse an in-memory sitemap (str or bytes, optionally gzipped) into (kind, loc, meta) entries"""
+    data = xml_content.encode('utf-8') if isinstance(xml_content, str) else xml_content
+    parser = SitemapStreamParser()
+    try:
+        for offset in range(0, len(data), SITEMAP_CHUNK_SIZE):
+            yield from parser.feed(data[offset:offset + SITEMAP_CHUNK_SIZE])
+        yield from parser.close()
+    except (ET.ParseError, zlib.error) as e:
+        log(f"XML parsing error: {e}")
+
+def stream_sitemap_urls(xml_content: str) -> Iterator[Tuple[str, dict]]:
+    """Memory-efficient sitemap parsing using an incremental pull parser."""
+    for kind, loc, meta in parse_sitemap_document(xml_content):
+        if kind == 'url':
+            yield (loc, meta)
+
+def extract_sitemap_index(xml_content: str) -> list:
+    """Extract child sitemap URLs from sitemap index"""
+    return [loc for kind, loc, _ in parse_sitemap_document(xml_content) if kind == 'sitemap']
+
+class SitemapStream:
+    """
+    Async iterator over the entries of one sitemap fetched over HTTP.
+    Bytes are parsed as they are received, so the first URLs are available
+    long before a large sitemap has finished downloading.
+    """
+
+    def __init__(self, client: httpx.AsyncClient, url: str, timeout_sec: int = 30, ctx: Optional["CrawlContext"] = None):
+        self.client = client
+        self.url = url
+        self.timeout_sec = timeout_sec
+        self.ctx = ctx
+        self.is_index = False
+        self.failed = False
+        self.count = 0
+
+    def __aiter__(self):
+        return self._entries()
+
+    async def _entries(self):
+        limiter = self.ctx.limiter if self.ctx else None
+        for retry in range(MAX_RETRIES):
+            parser = SitemapStreamParser()
+            try:
+                if limiter:
+                    await limiter.acquire(self.url)
+                async with self.client.stream('GET', self.url, timeout=self.timeout_sec, follow_redirects=True) as response:
+                    if response.status_code == 429 and retry < MAX_RETRIES - 1:
+                        delay = parse_retry_after(response.headers.get('Retry-After'))
+                        if delay is None:
+                            delay = exponential_backoff(retry)
+                        if limiter:
+                            limiter.pause(self.url, delay)
+                        else:
+                            await asyncio.sleep(delay)
+                        continue
+                    response.raise_for_status()
+                    async for chunk in response.aiter_bytes(SITEMAP_CHUNK_SIZE):
+                        for entry in parser.feed(chunk):
+                            self.is_index = parser.is_index
+                            self.count += 1
+                            yield entry
+                for entry in parser.close():
+                    self.count += 1
+                    yield entry
+                self.is_index = parser.is_index
+                return
+            except (ET.ParseError, zlib.error) as e:
+                log(f"XML parsing error in {self.url}: {e}")
+                self.failed = parser.root_tag is None
+                return
+            except httpx.HTTPError as e:
+                # A stream that already produced entries can't be replayed without duplicates
+                if self.count or retry == MAX_RETRIES - 1:
+                    log(f"Sitemap fetch failed after {retry + 1} attempts: {e} URL: {self.url}")
+                    self.failed = self.count == 0
+                    return
+                await asyncio.sleep(exponential_backoff(retry))
+        self.failed = self.count == 0
+
+class SitemapFanout:
+    """
+    Concurrent, recursive expansion of sitemap indexes.
+    Child sitemaps are fetched by a fixed pool of fetchers (its own concurrency limit,
+    independent of page workers). Nested <sitemapindex> documents are followed up to
+    MAX_SITEMAP_DEPTH, and every sitemap URL is fetched at most once, which breaks cycles.
+    Page URLs are handed to on_url as soon as they are parsed; on_url returns False
+    to stop the expansion (e.g. max_pages reached).
+    """
+
+    def __init__(self, client: httpx.AsyncClient, on_url, concurrency: int = DEFAULT_SITEMAP_CONCURRENCY,
+                 timeout_sec: int = 30, max_depth: int = MAX_SITEMAP_DEPTH, ctx: Optional["CrawlContext"] = None):
+        self.client = client
+        self.ctx = ctx
+        self.on_url = on_url
+        self.concurrency = max(1, concurrency)
+        self.timeout_sec = timeout_sec
+        self.max_depth = max_depth
+        self.seen: Set[str] = set()
+        self.failed: List[str] = []
+        self.expanded = 0
+        self.stopped = False
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._fetchers: List[asyncio.Task] = []
+
+    def mark_seen(self, url: str):
+        self.seen.add(urldefrag(url)[0])
+
+    def add(self, url: str, depth: int = 1):
+        """Schedule a child sitemap unless it was already seen or is nested too deep"""
+        key = urldefrag(url)[0]
+        if key in self.seen:
+            log(f"Skipping already expanded sitemap: {url}")
+            return
+        if depth > self.max_depth:
+            log(f"Sitemap nesting too deep (>{self.max_depth}), skipping: {url}")
+            return
+        self.seen.add(key)
+        self._queue.put_nowait((url, depth))
+        if not self._fetchers:
+            self._fetchers = [asyncio.create_task(self._fetch_loop()) for _ in range(self.concurrency)]
+
+    async def join(self):
+        """Wait until every scheduled sitemap (including nested ones) has been expanded"""
+        if self._fetchers:
+            await self._queue.join()
+
+    async def close(self):
+        """Stop the fetchers (also on cancellation, where join() must not be awaited)"""
+        for task in self._fetchers:
+            task.cancel()
+        await asyncio.gather(*self._fetchers, return_exceptions=True)
+        self._fetchers = []
+
+    async def _fetch_loop(self):
+        while True:
+            url, depth = await self._queue.get()
+            try:
+                if not self.stopped:
+                    await self._expand(url, depth)
+            except Exception as e:
+                log(f"Failed to expand sitemap {url}: {e}")
+                self.failed.append(url)
+            finally:
+                self._queue.task_done()
+
+    async def _expand(self, url: str, depth: int):
+        stream = SitemapStream(self.client, url, self.timeout_sec, self.ctx)
+        async for kind, loc, meta in stream:
+            if self.stopped:
+                break
+            if kind == 'sitemap':
+                self.add(loc, depth + 1)
+            elif not await self.on_url(loc, meta):
+                self.stopped = True
+                break
+        self.expanded += 1
+        if stream.failed:
+            self.failed.append(url)
+
+async def filter_dry_run(client: httpx.AsyncClient, sitemap_url: str, matcher: UrlMatcher, inputs: InputModel,
+                         ctx: Optional["CrawlContext"] = None) -> Dict[str, Any]:
+    """Stream every sitemap through the filters without fetching a page; report match counts"""
+    started = time.monotonic()
+    counts = Counter()
+    sample: List[str] = []
+
+    async def on_url(loc: str, meta: dict) -> bool:
+        counts['total'] += 1
+        rule = matcher.check(loc, meta) if matcher.active else None
+        if rule:
+            counts[rule] += 1
+        else:
+            counts['matched'] += 1
+            if len(sample) < FILTER_SAMPLE_SIZE:
+                sample.append(loc)
+        return True
+
+    root_stream = SitemapStream(client, sitemap_url, inputs.timeout, ctx)
+    fanout = SitemapFanout(client, on_url, inputs.sitemap_concurrency, inputs.timeout, ctx=ctx)
+    fanout.mark_seen(sitemap_url)
+    try:
+        async for kind, loc, meta in root_stream:
+            if kind == 'sitemap':
+                fanout.add(loc)
+            else:
+                await on_url(loc, meta)
+        await fanout.join()
+    finally:
+        await fanout.close()
+
+    return {
+        "sitemap_url": sitemap_url,
+        "total_urls": counts['total'],
+        "matched": counts['matched'],
+        "would_process": min(counts['matched'], inputs.max_pages),
+        "rejected": {rule: counts[rule] for rule in UrlMatcher.RULES if counts[rule]},
+        "sample": sample,
+        "failed_sitemaps": ([sitemap_url] if root_stream.failed else []) + fanout.failed,
+        "elapsed_sec": round(time.monotonic() - started, 3),
+    }
+
+class _FrontierChunk:
+    """Queued URLs packed into one byte arena: a host id and an end offset per entry"""
+    __slots__ = ('hosts', 'ends', 'arena', 'next')
+
+    def __init__(self):
+        self.hosts = array('I')
+        self.ends = array('I')
+        self.arena = bytearray()
+        self.next = 0
+
+    def __len__(self) -> int:
+        return len(self.ends)
+
+    @property
+    def remaining(self) -> int:
+        return len(self.ends) - self.next
+
+    @property
+    def nbytes(self) -> int:
+        return len(self.arena) + self.hosts.itemsize * len(self.hosts) + self.ends.itemsize * len(self.ends)
+
+    def append(self, host_id: int, payload: bytes):
+        self.hosts.append(host_id)
+        self.arena += payload
+        self.ends.append(len(self.arena))
+
+    def pop(self) -> Tuple[int, bytes]:
+        i = self.next
+        self.next += 1
+        start = self.ends[i - 1] if i else 0
+        return self.hosts[i], bytes(self.arena[start:self.ends[i]])
+
+class Frontier:
+    """
+    URLs waiting for a worker, held compactly instead of as {'url', 'meta'} dicts:
+    scheme://host prefixes are interned, and the rest of each URL plus its sitemap
+    meta is packed into `_FrontierChunk` arenas addressed by array offsets.
+    Beyond `memory_bytes`, new entries spill to on-disk segments in `_frontier/`
+    that are read back in order, so the sitemap stage never waits for the workers
+    and crawl size is not bounded by RAM.
+    There is deliberately no backpressure: a sitemap that outruns the workers
+    grows the spill instead of stalling its stream (and the connections of child
+    sitemaps fetched meanwhile). The bound is the crawl's page budget: no more
+    than --max-pages sitemap URLs are queued (retries re-enter as they leave), so
+    disk use stays under max_pages times the packed entry size (typically
+    50-200 bytes).
+    Queue-compatible for WorkerPool: put(), get() and a None end marker.
+    """
+    DIRNAME = "_frontier"
+    META_KEYS = ('lastmod', 'changefreq', 'priority')
+    _RECORD = struct.Struct('<II')
+
+    def __init__(self, spill_dir: Path, memory_bytes: int = DEFAULT_FRONTIER_MEMORY_MB * 1024 * 1024,
+                 chunk_entries: int = DEFAULT_BATCH_SIZE):
+        self.spill_dir = spill_dir
+        self.memory_bytes = memory_bytes
+        self.chunk_entries = max(1, chunk_entries)
+        self.hosts: List[str] = []
+        self._host_ids: Dict[str, int] = {}
+        self._chunks: deque = deque()
+        self._memory = 0
+        self._segments: deque = deque()
+        self._spill_file = None
+        self._spill_path: Optional[Path] = None
+        self._spill_bytes = 0
+        self._next_segment = 1
+        self._count = 0
+        self._closed = False
+        self._ready = asyncio.Event()
+        self.spilled = 0
+        self.peak_memory = 0
+        shutil.rmtree(self.spill_dir, ignore_errors=True)
+
+    def __len__(self) -> int:
+        return self._count
+
+    def _pack(self, url: str, meta: Optional[Dict[str, str]]) -> Tuple[int, bytes]:
+        slash = url.find('/', url.find('//') + 2) if '//' in url else 0
+        if slash < 0:
+            slash = len(url)
+        host = url[:slash]
+        host_id = self._host_ids.get(host)
+        if host_id is None:
+            host_id = self._host_ids[host] = len(self.hosts)
+            self.hosts.append(host)
+        meta = meta or {}
+        fields = [url[slash:]] + [meta.get(key, '') for key in self.META_KEYS]
+        return host_id, '\x1f'.join(fields).encode('utf-8')
+
+    def _unpack(self, host_id: int, payload: bytes) -> Dict[str, Any]:
+        tail, *values = payload.decode('utf-8').split('\x1f')
+        return {'url': self.hosts[host_id] + tail, 'meta': {key: value for key, value in zip(self.META_KEYS, values) if value}}
+
+    def put_nowait(self, entry: Optional[Dict[str, Any]]):
+        if entry is None:
+            self._closed = True
+        else:
+            host_id, payload = self._pack(entry['url'], entry.get('meta'))
+            if self._spill_file is None and not self._segments and self._memory < self.memory_bytes:
+                if not self._chunks or len(self._chunks[-1]) >= self.chunk_entries:
+                    self._chunks.append(_FrontierChunk())
+                before = self._chunks[-1].nbytes
+                self._chunks[-1].append(host_id, payload)
+                self._memory += self._chunks[-1].nbytes - before
+                self.peak_memory = max(self.peak_memory, self._memory)
+            else:
+                self._spill(host_id, payload)
+            self._count += 1
+        self._ready.set()
+
+    async def put(self, entry: Optional[Dict[str, Any]]):
+        # Never blocks: past the memory budget entries go to disk
+        self.put_nowait(entry)
+
+    def _spill(self, host_id: int, payload: bytes):
+        if self._spill_file is None:
+            self.spill_dir.mkdir(parents=True, exist_ok=True)
+            self._spill_path = self.spill_dir / f"segment-{self._next_segment:06d}.bin"
+            self._next_segment += 1
+            self._spill_file = open(self._spill_path, 'wb')
+            self._spill_bytes = 0
+        self._spill_file.write(self._RECORD.pack(host_id, len(payload)))
+        self._spill_file.write(payload)
+        self._spill_bytes += self._RECORD.size + len(payload)
+        self.spilled += 1
+        # Segments are read back whole, so they stay within half the budget
+        if self._spill_bytes >= self.memory_bytes // 2:
+            self._seal_segment()
+
+    def _seal_segment(self):
+        self._spill_file.close()
+        self._segments.append(self._spill_path)
+        self._spill_file = None
+        self._spill_path = None
+
+    def _load_segment(self) -> bool:
+        """Move the oldest spilled segment back into memory"""
+        if not self._segments:
+            if self._spill_file is None:
+                return False
+            self._seal_segment()
+        path = self._segments.popleft()
+        data = path.read_bytes()
+        path.unlink()
+        offset = 0
+        while offset < len(data):
+            host_id, size = self._RECORD.unpack_from(data, offset)
+            offset += self._RECORD.size
+            if not self._chunks or len(self._chunks[-1]) >= self.chunk_entries:
+                self._chunks.append(_FrontierChunk())
+            self._chunks[-1].append(host_id, data[offset:offset + size])
+            offset += size
+        self._memory = sum(chunk.nbytes for chunk in self._chunks)
+        return True
+
+    def _pop(self) -> Optional[Dict[str, Any]]:
+        while self._chunks and not self._chunks[0].remaining:
+            self._memory -= self._chunks.popleft().nbytes
+        if not self._chunks and not self._load_segment():
+            return None
+        self._count -= 1
+        return self._unpack(*self._chunks[0].pop())
+
+    async def get(self) -> Optional[Dict[str, Any]]:
+        while True:
+            entry = self._pop()
+            if entry is not None:
+                return entry
+            if self._closed:
+                return None
+            self._ready.clear()
+            await self._ready.wait()
+
+    def close(self):
+        """Drop anything still queued, including spilled segments"""
+        if self._spill_file:
+            self._spill_file.close()
+            self._spill_file = None
+        shutil.rmtree(self.spill_dir, ignore_errors=True)
+
+class WorkerPool:
+    """
+    Fixed set of long-lived workers draining a queue until the None end marker.
+    A worker takes the next entry as soon as it finishes the previous one, so a
+    slow page only occupies its own worker instead of stalling a whole batch.
+    """
+
+    def __init__(self, queue, handler, size: int):
+        self.queue = queue
+        self.handler = handler
+        self.size = max(1, size)
+        self.active = 0
+        self.completed = 0
+
+    async def run(self):
+        workers = [asyncio.create_task(self._work()) for _ in range(self.size)]
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+    async def _work(self):
+        while True:
+            entry = await self.queue.get()
+            if entry is None:
+                # Put the marker back so the remaining workers stop too
+                self.queue.put_nowait(None)
+                return
+            self.active += 1
+            try:
+                await self.handler(entry)
+            except Exception as e:
+                log(f"Worker error: {e}")
+            finally:
+                self.active -= 1
+                self.completed += 1
+
+def convert_pdf_to_markdown(content: bytes) -> str:
+    """Convert PDF bytes to Markdown text"""
+    if not PdfReader:
+        return "Error: pypdf not installed"
+    try:
+        reader = PdfReader(BytesIO(content))
+        text = []
+        for page in reader.pages:
+            extract = page.extract_text()
+            if extract:
+                text.append(extract)
+        return "\n\n".join(text)
+    except Exception as e:
+        return f"Error converting PDF: {e}"
+
+# --- Parse-once HTML pipeline ---
+
+class HtmlTree(ABC):
+    """
+    A parsed HTML document shared by every conversion step.
+    Backends expose the few operations the pipeline needs: CSS selection,
+    removal, attribute access and an in-order walk of text and elements.
+    `root` is the node being converted; selectors and readability narrow it.
+    """
+    backend = ""
+
+    def __init__(self, html: str):
+        self.root = None
+        self.title = ""
+
+    @abstractmethod
+    def select(self, selector: str, node=None) -> list:
+        ...
+
+    def select_one(self, selector: str, node=None):
+        matches = self.select(selector, node)
+        return matches[0] if matches else None
+
+    @abstractmethod
+    def remove(self, node):
+        ...
+
+    @abstractmethod
+    def tag(self, node) -> Optional[str]:
+        """Lowercase tag name, or None for comments and other non-element nodes"""
+
+    @abstractmethod
+    def attr(self, node, name: str) -> Optional[str]:
+        ...
+
+    @abstractmethod
+    def set_attr(self, node, name: str, value: str):
+        ...
+
+    @abstractmethod
+    def children(self, node) -> Iterator[Any]:
+        """Yield text (str) and child nodes in document order"""
+
+    @abstractmethod
+    def text(self, node=None) -> str:
+        ...
+
+    @abstractmethod
+    def to_html(self, node=None) -> str:
+        ...
+
+    @abstractmethod
+    def extract_main(self):
+        """Narrow `root` to the readability summary of the document"""
+
+    def strip(self, selectors: str):
+        for selector in selectors.split(','):
+            selector = selector.strip()
+            if selector:
+                for node in self.select(selector):
+                    self.remove(node)
+
+    def narrow(self, selector: str) -> bool:
+        selection = self.select_one(selector)
+        if selection is None:
+            return False
+        self.root = selection
+        return True
+
+    def headings(self, levels: Tuple[str, ...] = ('h1', 'h2', 'h3')) -> List[Any]:
+        return [node for node in self.select(','.join(levels)) if self.tag(node) in levels]
+
+    def get_text(self, separator: str = ' ') -> str:
+        """Whitespace-normalised text of `root`, one chunk per text node (like BeautifulSoup's get_text(strip=True))"""
+        chunks = []
+        stack = [self.root]
+        while stack:
+            item = stack.pop()
+            if isinstance(item, str):
+                item = item.strip()
+                if item:
+                    chunks.append(item)
+            elif self.tag(item) not in MarkdownRenderer.SKIP_TAGS:
+                stack.extend(reversed(list(self.children(item))))
+        return separator.join(chunks)
+
+
+@functools.lru_cache(maxsize=256)
+def _css_selector(selector: str):
+    return CSSSelector(selector, translator='html')
+
+
+_XML_DECLARATION = re.compile(r'^\s*<\?xml[^>]*\?>')
+
+class LxmlTree(HtmlTree):
+    backend = "lxml"
+
+    def __init__(self, html: str):
+        super().__init__(html)
+        # lxml rejects str input carrying an encoding declaration (XHTML served as text)
+        html = _XML_DECLARATION.sub('', html, count=1)
+        if html.strip():
+            self.root = lxml_html.document_fromstring(html)
+        else:
+            self.root = lxml_html.document_fromstring("<html><body></body></html>")
+        title = self.root.find('.//title')
+        self.title = title.text_content().strip() if title is not None else ""
+
+    def select(self, selector: str, node=None) -> list:
+        return _css_selector(selector)(self.root if node is None else node)
+
+    def remove(self, node):
+        if node.getparent() is not None:
+            node.drop_tree()
+
+    def tag(self, node) -> Optional[str]:
+        return node.tag.lower() if isinstance(node.tag, str) else None
+
+    def attr(self, node, name: str) -> Optional[str]:
+        return node.get(name)
+
+    def set_attr(self, node, name: str, value: str):
+        node.set(name, value)
+
+    def children(self, node) -> Iterator[Any]:
+        if node.text:
+            yield node.text
+        for child in node:
+            if isinstance(child.tag, str):
+                yield child
+            if child.tail:
+                yield child.tail
+
+    def text(self, node=None) -> str:
+        return (self.root if node is None else node).text_content()
+
+    def to_html(self, node=None) -> str:
+        return lxml_html.tostring(self.root if node is None else node, encoding='unicode')
+
+    def extract_main(self):
+        # readability accepts the parsed tree directly (it works on its own copy),
+        # so only the much smaller summary is parsed again
+        summary = Document(self.root).summary(html_partial=True)
+        self.root = lxml_html.fragment_fromstring(summary, create_parent='div')
+
+
+class SelectolaxTree(HtmlTree):
+    backend = "selectolax"
+
+    def __init__(self, html: str):
+        super().__init__(html)
+        self.document = SelectolaxParser(html)
+        self.root = self.document.root
+        title = self.document.css_first('title')
+        self.title = title.text().strip() if title is not None else ""
+
+    def select(self, selector: str, node=None) -> list:
+        return (self.root if node is None else node).css(selector)
+
+    def remove(self, node):
+        node.decompose()
+
+    def tag(self, node) -> Optional[str]:
+        tag = node.tag
+        return tag.lower() if tag and tag[0].isalpha() else None
+
+    def attr(self, node, name: str) -> Optional[str]:
+        return node.attributes.get(name)
+
+    def set_attr(self, node, name: str, value: str):
+        node.attrs[name] = value
+
+    def children(self, node) -> Iterator[Any]:
+        for child in node.iter(include_text=True):
+            if child.tag == '-text':
+                yield child.text(deep=False)
+            else:
+                yield child
+
+    def text(self, node=None) -> str:
+        return (self.root if node is None else node).text(deep=True)
+
+    def to_html(self, node=None) -> str:
+        return (self.root if node is None else node).html or ""
+
+    def extract_main(self):
+        # readability only works on lxml trees, so this backend hands it the serialised document
+        summary = Document(self.to_html()).summary(html_partial=True)
+        self.document = SelectolaxParser(summary)
+        self.root = self.document.body or self.document.root
+
+
+def parse_html(html: str, backend: str = "lxml") -> Optional[HtmlTree]:
+    """Parse a document once with the requested backend; None means use the BeautifulSoup pipeline"""
+    if backend == "selectolax" and SelectolaxParser:
+        return SelectolaxTree(html)
+    if backend in ("lxml", "selectolax") and lxml_html:
+        try:
+            return LxmlTree(html)
+        except (LxmlParserError, ValueError):
+            # e.g. "Document is empty" for comment-only markup; BeautifulSoup copes with it
+            return None
+    return None
+
+
+# Text that would read as Markdown syntax is escaped like html2text does
+_MD_BACKSLASH = re.compile(r'(\\)(?=[\\`*_{}\[\]()#+\-.!])')
+_MD_ORDERED_MARKER = re.compile(r'^(\d+)\.(?=\s|$)')
+_MD_BLOCK_MARKER = re.compile(r'^(?=(?:[-+]|\*+|#+|-+)(?:\s|$)|>)')
+
+class MarkdownRenderer:
+    """
+    Render an HtmlTree to Markdown in a single walk, replacing the
+    serialise-and-reparse round trip through html2text. Output follows the
+    html2text settings of html_to_markdown: inline links and images,
+    `-` bullets, no line wrapping, and text that starts a line with a list,
+    heading or quote marker is escaped.
+    """
+    SKIP_TAGS = {'head', 'script', 'style', 'noscript', 'template', 'svg', 'canvas', 'iframe', 'object'}
+    BLOCK_TAGS = {'p', 'div', 'section', 'article', 'main', 'header', 'footer', 'nav', 'aside',
+                  'figure', 'figcaption', 'address', 'details', 'summary', 'form', 'fieldset',
+                  'dl', 'center', 'body', 'html'}
+    LINE_TAGS = {'dt', 'dd', 'tr', 'caption'}
+    HEADINGS = {'h1': 1, 'h2': 2, 'h3': 3, 'h4': 4, 'h5': 5, 'h6': 6}
+    EMPHASIS = {'strong': '**', 'b': '**', 'em': '_', 'i': '_', 'del': '~~', 's': '~~', 'strike': '~~'}
+
+    def __init__(self, tree: HtmlTree):
+        self.tree = tree
+        self.out: List[str] = []
+        self.prefixes: List[str] = []
+        self.newlines = 0
+        self.space = False
+        self.fresh = False  # a list marker or quote was just opened; the first child block starts on it
+
+    def render(self, node=None) -> str:
+        self._node(self.tree.root if node is None else node)
+        markdown = "".join(self.out).strip('\n')
+        return re.sub(r'\n{3,}', '\n\n', markdown) + '\n'
+
+    # -- output primitives --
+
+    def _break(self, count: int):
+        if self.fresh:
+            self.space = False
+            return
+        if self.out:
+            self.newlines = max(self.newlines, count)
+        self.space = False
+
+    def _emit(self, text: str):
+        prefix = "".join(self.prefixes)
+        if self.newlines:
+            self.out.append(('\n' + prefix.rstrip()) * (self.newlines - 1) + '\n' + prefix)
+            self.newlines = 0
+        elif not self.out and prefix:
+            self.out.append(prefix)
+        elif self.space and self.out and self.out[-1][-1:] not in ('', ' ', '\n', '[', '('):
+            self.out.append(' ')
+        self.space = False
+        self.fresh = False
+        self.out.append(text)
+
+    def _text(self, text: str):
+        if not text:
+            return
+        if text[0].isspace():
+            self.space = True
+        words = text.split()
+        if words:
+            text_line = _MD_BACKSLASH.sub(r'\\\1', " ".join(words))
+            if self.newlines or self.fresh or not self.out:
+                text_line = _MD_BLOCK_MARKER.sub('\\\\', _MD_ORDERED_MARKER.sub(r'\1\\.', text_line))
+            self._emit(text_line)
+            self.space = text[-1].isspace()
+
+    def _raw_line(self, line: str):
+        self.out.append('\n' + "".join(self.prefixes) + line)
+
+    # -- tree walk --
+
+    def _children(self, node):
+        for child in self.tree.children(node):
+            if isinstance(child, str):
+                self._text(child)
+            else:
+                self._node(child)
+
+    def _wrap(self, node, opening: str, closing: str):
+        state = (len(self.out), self.newlines, self.space)
+        self._emit(opening)
+        mark = len(self.out)
+        self._children(node)
+        trailing_space = self.space
+        if len(self.out) == mark:
+            del self.out[state[0]:]
+            self.newlines, self.space = state[1], state[2]
+            return
+        self.out.append(closing)
+        self.space = trailing_space
+
+    def _node(self, node):
+        tree = self.tree
+        tag = tree.tag(node)
+        if tag is None or tag in self.SKIP_TAGS:
+            return
+
+        if tag in self.HEADINGS:
+            self._break(2)
+            self._emit('#' * self.HEADINGS[tag] + ' ')
+            self._children(node)
+            self._break(2)
+        elif tag in self.EMPHASIS:
+            self._wrap(node, self.EMPHASIS[tag], self.EMPHASIS[tag])
+        elif tag == 'a':
+            href = tree.attr(node, 'href')
+            if href and not href.startswith('javascript:'):
+                self._wrap(node, '[', f']({href})')
+            else:
+                self._children(node)
+        elif tag == 'img':
+            src = tree.attr(node, 'src')
+            if src:
+                self._emit(f"![{' '.join((tree.attr(node, 'alt') or '').split())}]({src})")
+        elif tag == 'br':
+            self._break(1)
+        elif tag == 'hr':
+            self._break(2)
+            self._emit('* * *')
+            self._break(2)
+        elif tag == 'pre':
+            self._pre(node)
+        elif tag == 'code':
+            code = " ".join(tree.text(node).split())
+            if code:
+                self._emit(f"`{code}`")
+        elif tag in ('ul', 'ol'):
+            self._list(node, ordered=(tag == 'ol'))
+        elif tag == 'li':
+            self._list_item(node, '- ')
+        elif tag == 'blockquote':
+            self._break(2)
+            if self.newlines > 1:
+                # the separating blank line belongs to the enclosing block
+                self.out.append(('\n' + "".join(self.prefixes).rstrip()) * (self.newlines - 1))
+                self.newlines = 1
+            self.prefixes.append('> ')
+            self.fresh = True
+            self._children(node)
+            self.prefixes.pop()
+            self._break(2)
+        elif tag == 'table':
+            self._table(node)
+        elif tag in self.BLOCK_TAGS:
+            self._break(2)
+            self._children(node)
+            self._break(2)
+        elif tag in self.LINE_TAGS:
+            self._break(1)
+            self._children(node)
+            self._break(1)
+        else:
+            self._children(node)
+
+    def _pre(self, node):
+        code_node = self.tree.select_one('code', node)
+        language = ""
+        for cls in (self.tree.attr(code_node, 'class') or "").split() if code_node is not None else ():
+            if cls.startswith('language-'):
+                language = cls[len('language-'):]
+        self._break(2)
+        self._emit('```' + language)
+        for line in self.tree.text(node).strip('\n').split('\n'):
+            self._raw_line(line.rstrip())
+        self._raw_line('```')
+        self._break(2)
+
+    def _list(self, node, ordered: bool):
+        nested = bool(self.prefixes) and self.prefixes[-1].strip() == ''
+        self._break(1 if nested else 2)
+        number = 0
+        for child in self.tree.children(node):
+            if isinstance(child, str):
+                continue
+            if self.tree.tag(child) == 'li':
+                number += 1
+                self._list_item(child, f"{number}. " if ordered else '- ')
+            else:
+                self._node(child)
+        self._break(1 if nested else 2)
+
+    def _list_item(self, node, marker: str):
+        self._break(1)
+        state = (len(self.out), self.newlines)
+        self._emit(marker)
+        mark = len(self.out)
+        self.prefixes.append(' ' * len(marker))
+        self.fresh = True
+        self._children(node)
+        self.prefixes.pop()
+        if len(self.out) == mark:
+            # empty item: drop the dangling marker
+            del self.out[state[0]:]
+            self.newlines, self.fresh = state[1], False
+        self._break(1)
+
+    def _table(self, node):
+        rows = []
+        for row in self.tree.select('tr', node):
+            cells = [child for child in self.tree.children(row)
+                     if not isinstance(child, str) and self.tree.tag(child) in ('th', 'td')]
+            rows.append([self._cell(cell) for cell in cells])
+        rows = [row for row in rows if row]
+        if not rows:
+            return
+        width = max(len(row) for row in rows)
+        self._break(2)
+        self._emit('| ' + ' | '.join(rows[0] + [''] * (width - len(rows[0]))) + ' |')
+        self._raw_line('|' + '---|' * width)
+        for row in rows[1:]:
+            self._raw_line('| ' + ' | '.join(row + [''] * (width - len(row))) + ' |')
+        self._break(2)
+
+    def _cell(self, node) -> str:
+        renderer = MarkdownRenderer(self.tree)
+        renderer._children(node)
+        return " ".join("".join(renderer.out).split()).replace('|', '\\|')
+
+
+def tree_to_markdown(tree: HtmlTree) -> str:
+    return MarkdownRenderer(tree).render()
+
+
+class ConversionOptions(BaseModel):
+    """Picklable subset of InputModel needed to convert one document"""
+    output_format: str = "markdown"
+    extract_main: bool = False
+    content_selector: Optional[str] = None
+    strip_selector: Optional[str] = None
+    parser_backend: ParserBackend = "lxml"
+    dedup: bool = False
+    download_images: bool = False
+    download_assets: bool = False
+
+    @classmethod
+    def from_inputs(cls, inputs: InputModel) -> "ConversionOptions":
+        return cls(
+            output_format=inputs.output_format,
+            extract_main=inputs.extract_main,
+            content_selector=inputs.content_selector,
+            strip_selector=inputs.strip_selector,
+            parser_backend=inputs.parser_backend,
+            dedup=inputs.dedup,
+            download_images=inputs.download_images,
+            download_assets=inputs.download_assets,
+        )
+
+def html_to_markdown(html: str) -> str:
+    converter = html2text.HTML2Text()
+    converter.ignore_links = False
+    converter.ignore_images = False
+    converter.body_width = 0
+    converter.ul_item_mark = '-'
+    markdown = converter.handle(html)
+    return re.sub(r'\n{3,}', '\n\n', markdown)
+
+def convert_document(url: str, body, content_type: str, options: ConversionOptions) -> Dict[str, Any]:
+    """
+    CPU-bound half of process_url: parse, clean and render one fetched document.
+    Module-level and free of I/O so it can run in a ProcessPoolExecutor.
+    `body` is the decoded HTML text, or raw bytes for PDFs.
+    Returns the rendered file content, its suffix and the Markdown, plus the
+    image/CSS/JS references to localize when asset downloads are enabled.
+    """
+    html_text = body if isinstance(body, str) else ""
+
+    # 1. Handle PDF
+    if 'application/pdf' in content_type:
+        return render_document(url, html_text, convert_pdf_to_markdown(body), None, options)
+
+    # 2. Parse once; every later step works on the same tree
+    tree = parse_html(html_text, options.parser_backend)
+    if tree is None:
+        return convert_document_bs4(url, html_text, options)
+
+    # Stylesheets and scripts live in <head>: collect them before the tree is narrowed
+    assets = asset_references(tree, url, STYLE_SCRIPT_SELECTORS) if options.download_assets else []
+
+    # Phase 2.4: Strip selectors
+    if options.strip_selector:
+        tree.strip(options.strip_selector)
+
+    # Phase 2.1: Extract main content
+    if options.extract_main and Document:
+        try:
+            tree.extract_main()
+        except Exception as e:
+            log(f"Readability error for {url}: {e}")
+
+    # Phase 2.4: Content selector
+    if options.content_selector:
+        tree.narrow(options.content_selector)
+
+    if options.download_images:
+        assets += asset_references(tree, url, IMAGE_SELECTORS)
+    result = render_document(url, html_text, tree_to_markdown(tree), tree, options)
+    if assets:
+        result['assets'] = assets
+    return result
+
+def convert_document_bs4(url: str, html_text: str, options: ConversionOptions) -> Dict[str, Any]:
+    """BeautifulSoup + html2text pipeline (--parser-backend bs4)"""
+    soup = BeautifulSoup(html_text, 'html.parser')
+    assets = asset_references(soup, url, STYLE_SCRIPT_SELECTORS) if options.download_assets else []
+
+    # Phase 2.4: Strip selectors
+    if options.strip_selector:
+        for selector in options.strip_selector.split(','):
+            for tag in soup.select(selector.strip()):
+                tag.decompose()
+
+    # Phase 2.1: Extract main content
+    if options.extract_main and Document:
+        try:
+            doc = Document(html_text)
+            summary_html = doc.summary()
+            soup = BeautifulSoup(summary_html, 'html.parser')
+        except Exception as e:
+            log(f"Readability error for {url}: {e}")
+
+    # Phase 2.4: Content selector
+    if options.content_selector:
+        selection = soup.select_one(options.content_selector)
+        if selection:
+            soup = selection
+
+    if options.download_images:
+        assets += asset_references(soup, url, IMAGE_SELECTORS)
+    result = render_document(url, html_text, html_to_markdown(str(soup)), soup, options)
+    if assets:
+        result['assets'] = assets
+    return result
+
+def render_document(url: str, html_text: str, markdown: str, page, options: ConversionOptions) -> Dict[str, Any]:
+    """Phase 5.1: render the requested output format from a BeautifulSoup or HtmlTree page"""
+    if page is None:
+        page = BeautifulSoup("", "html.parser")
+    if isinstance(page, HtmlTree):
+        title = page.title
+    else:
+        title = page.find('title').get_text(strip=True) if page.find('title') else ""
+    output_format = options.output_format.lower()
+    # Counted here so it runs in the conversion process; recorded in the manifest
+    page_info = {'markdown': markdown, 'title': title, 'tokens': count_tokens(markdown)}
+    if options.dedup:
+        page_info['simhash'] = simhash(markdown)
+    if output_format == 'json':
+        json_data = convert_to_json(url, html_text, page, metadata={'date': datetime.now().isoformat()})
+        return {**page_info, 'content': json.dumps(json_data, indent=2), 'suffix': '.json'}
+    if output_format == 'html':
+        html_output = convert_to_html_wrapped(url, page, markdown)
+        return {**page_info, 'content': html_output, 'suffix': '.html'}
+    if output_format == 'text':
+        return {**page_info, 'content': convert_to_text(page), 'suffix': '.txt'}
+    if output_format in DATASET_FORMATS:
+        # One dataset record per page
+        return {**page_info, 'content': markdown, 'suffix': '.md'}
+    header = f"---\nurl: {url}\ndate: {datetime.now().isoformat()}\n---\n\n"
+    return {**page_info, 'content': header + markdown, 'suffix': '.md'}
+
+async def process_url(client: httpx.AsyncClient, url: str, output_dir: Path, inputs: InputModel,
+                      ctx: Optional[CrawlContext] = None, meta: Optional[Dict[str, Any]] = None) -> str:
+    """Fetch and convert URL to Markdown. `meta` is the URL's sitemap entry (lastmod, ...).
+    Returns "success", "duplicate", "skipped", "failed" (permanently), "unavailable"
+    (a transient failure worth retrying) or "deferred" (the host's circuit is open)."""
+    try:
+        # --update: revalidate with the validators from the previous run
+        validators = ctx.validators if ctx else None
+        conditional = None
+        if validators and inputs.update:
+            conditional = validators.conditional_headers(url, output_dir, inputs.output_format.lower()) or None
+        sqlite = ctx.sqlite if ctx else None
+        started = time.monotonic()
+        pdf = bool(inputs.pdf_support and PdfReader)
+        try:
+            response = await fetch_with_retry(client, url, 0, timeout_sec=inputs.timeout, ctx=ctx, headers=conditional,
+                                              max_bytes=inputs.max_page_mb * 1024 * 1024 or None,
+                                              accept=functools.partial(page_content_type_allowed, pdf=pdf))
+        except FetchClientError as e:
+            log(f"Failed ({e}): {url}")
+            if sqlite:
+                await sqlite.submit(url, "failed", fetch_ms=(time.monotonic() - started) * 1000)
+            return "failed"
+        except FetchRejected as e:
+            log(f"Skipped ({e}): {url}")
+            return "skipped"
+        fetch_ms = (time.monotonic() - started) * 1000
+        if not response:
+            if ctx and ctx.breaker and ctx.breaker.is_open(url):
+                return "deferred"  # turned away by the host's circuit; not a failure yet
+            if sqlite:
+                await sqlite.submit(url, "failed", fetch_ms=fetch_ms)
+            return "unavailable"
+        if conditional and response.status_code == 304:
+            log(f"Not modified: {url}")
+            if ctx.archive and not ctx.dataset:
+                existing = validators.output_path(url, output_dir)
+                await ctx.archive.add_file(existing, existing.relative_to(output_dir))
+            return "skipped"
+            
+        content_type = response.headers.get('Content-Type', '').lower()
+
+        # 1. PDFs are converted from bytes, HTML from the decoded text
+        if 'application/pdf' in content_type:
+            if not pdf:
+                log(f"PDF skipped (no support): {url}")
+                return "skipped"
+            body = response.content
+        else:
+            body = response.text
+
+        # 2. Conversion is CPU-bound: run it off the event loop when a process pool is configured
+        options = ConversionOptions.from_inputs(inputs)
+        started = time.monotonic()
+        if ctx and ctx.executor:
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(ctx.executor, convert_document, url, body, content_type, options)
+        else:
+            result = convert_document(url, body, content_type, options)
+        convert_ms = (time.monotonic() - started) * 1000
+        markdown = result['markdown']
+        content_hash = hashlib.sha256(markdown.encode('utf-8')).hexdigest()
+
+        # Near-duplicates (print views, tracking-parameter variants, ...) are recorded, not written
+        signature = result.get('simhash')
+        if ctx and ctx.dedup is not None and signature is not None:
+            # indexed only once this page has been written (below)
+            canonical = ctx.dedup.find(signature, url)
+            if canonical:
+                if ctx.manifest:
+                    ctx.manifest.record(url, None, content_hash, 0, 0, signature, alias_of=canonical)
+                log(f"Near-duplicate of {canonical}: {url}")
+                return "duplicate"
+
+        # Phase 2.2 & 2.5: images/CSS/JS are fetched once into the content-addressed store
+        assets = ctx.assets if ctx else None
+        output_format = inputs.output_format.lower()
+        dataset = ctx.dataset if ctx else None
+        if dataset:
+            # 3-4. One record in the current dataset shard instead of a file per page
+            rel_path = sanitize_filename(url).with_suffix('.md')
+            if assets:
+                await assets.localize(client, result, rel_path, output_format, ctx)
+            await dataset.add(dataset_record(url, rel_path.as_posix(), result.get('title'), result['markdown'],
+                                             (meta or {}).get('lastmod'), result.get('tokens', 0)))
+            saved_path = rel_path
+            saved_size = len(result['markdown'].encode('utf-8'))
+            if validators:
+                validators.record(url, response.headers, Path(DatasetWriter.DIRNAME), output_format)
+        else:
+            # 3. Path and Filename
+            rel_path = sanitize_filename(url).with_suffix('.md')
+            paths = ctx.paths if ctx else None
+            if paths:
+                # Collisions are resolved against the registry, not with stat() calls
+                rel_path = paths.claim(url, rel_path.with_suffix(result['suffix']))
+                paths.ensure_dir(rel_path.parent)
+                save_path = output_dir / rel_path
+            else:
+                rel_path = resolve_collision(output_dir, rel_path)
+                save_path = output_dir / rel_path
+                save_path.parent.mkdir(parents=True, exist_ok=True)
+            if assets:
+                await assets.localize(client, result, rel_path, output_format, ctx)
+
+            # 4. Write the rendered output
+            save_path = save_path.with_suffix(result['suffix'])
+            saved_path = save_path.relative_to(output_dir)
+            if ctx and ctx.diff_baseline and save_path.exists():
+                # --diff-patch against this directory: keep the first old version to diff against
+                baseline = ctx.diff_baseline / saved_path
+                if not baseline.exists():
+                    baseline.parent.mkdir(parents=True, exist_ok=True)
+                    await asyncio.to_thread(shutil.copyfile, save_path, baseline)
+            async with aiofiles.open(save_path, 'w', encoding='utf-8') as f:
+                await f.write(result['content'])
+            saved_size = len(result['content'].encode('utf-8'))
+            if validators:
+                validators.record(url, response.headers, saved_path, output_format)
+            if ctx and ctx.archive:
+                await ctx.archive.add(saved_path, result['content'])
+
+            # 5. Integration (dataset shards are uploaded whole)
+            uploader = ctx.uploader if ctx else None
+            if uploader:
+                 await uploader.submit(save_path, saved_path, content_hash)
+            elif inputs.s3_bucket and not ctx:
+                 upload_to_s3(inputs.s3_bucket, inputs.s3_prefix, save_path, rel_path)
+        if ctx and ctx.dedup is not None and signature is not None:
+            ctx.dedup.add(signature, url)
+        if ctx and ctx.manifest:
+            ctx.manifest.record(url, saved_path.as_posix(), content_hash, saved_size, result.get('tokens', 0), signature)
+        if sqlite:
+             await sqlite.submit(url, "success", markdown, result.get('title'), saved_path.as_posix(),
+                                 fetch_ms, convert_ms)
+        elif inputs.sqlite_db:
              export_to_sqlite(Path(inputs.sqlite_db), url, markdown, datetime.now().isoformat(), "success")
 
         log(f"Saved ({output_format}): {url} -> {rel_path}")
@@ -640,11 +3297,16 @@ async def process_url(client: httpx.AsyncClient, url: str, output_dir: Path, inp
 
 def convert_to_json(url: str, html_content: str, soup, metadata: dict = None) -> dict:
     """Convert page to JSON format with raw HTML and metadata"""
+    if isinstance(soup, HtmlTree):
+        title, text = soup.title, soup.get_text(' ')
+    else:
+        title = soup.find('title').text if soup.find('title') else ""
+        text = soup.get_text(separator=' ', strip=True)
     return {
         "url": url,
         "html": html_content,
-        "title": soup.find('title').text if soup.find('title') else "",
-        "text": soup.get_text(separator=' ', strip=True),
+        "title": title,
+        "text": text,
         "metadata": metadata or {},
         "fetched_at": datetime.now().isoformat()
     }
@@ -653,12 +3315,21 @@ def convert_to_html_wrapped(url: str, soup, markdown: str = None) -> str:
     """Wrap content in HTML template with TOC"""
     # Generate simple TOC from headings
     toc_items = []
-    for heading in soup.find_all(['h1', 'h2', 'h3']):
-        level = int(heading.name[1])
-        text = heading.get_text(strip=True)
-        anchor = text.lower().replace(' ', '-').replace('/', '-')
-        heading['id'] = anchor
-        toc_items.append((level, text, anchor))
+    if isinstance(soup, HtmlTree):
+        for heading in soup.headings():
+            text = " ".join(soup.text(heading).split())
+            anchor = text.lower().replace(' ', '-').replace('/', '-')
+            soup.set_attr(heading, 'id', anchor)
+            toc_items.append((int(soup.tag(heading)[1]), text, anchor))
+        title, body_html = soup.title, soup.to_html()
+    else:
+        for heading in soup.find_all(['h1', 'h2', 'h3']):
+            level = int(heading.name[1])
+            text = heading.get_text(strip=True)
+            anchor = text.lower().replace(' ', '-').replace('/', '-')
+            heading['id'] = anchor
+            toc_items.append((level, text, anchor))
+        title, body_html = (soup.find('title').text if soup.find('title') else ""), str(soup)
     
     toc_html = ""
     if toc_items:
@@ -672,7 +3343,7 @@ def convert_to_html_wrapped(url: str, soup, markdown: str = None) -> str:
 <html>
 <head>
     <meta charset="UTF-8">
-    <title>{soup.find('title').text if soup.find('title') else url}</title>
+    <title>{title or url}</title>
     <style>
         body {{ font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', sans-serif; 
                 max-width: 900px; margin: 2rem auto; padding: 0 2rem; line-height: 1.6; }}
@@ -688,7 +3359,7 @@ def convert_to_html_wrapped(url: str, soup, markdown: str = None) -> str:
     </div>
     {toc_html}
     <article>
-        {str(soup)}
+        {body_html}
     </article>
 </body>
 </html>"""
@@ -697,7 +3368,10 @@ def convert_to_html_wrapped(url: str, soup, markdown: str = None) -> str:
 def convert_to_text(soup) -> str:
     """Convert to plain text, stripping all formatting"""
     # Get text with reasonable spacing
-    text = soup.get_text(separator='\n', strip=True)
+    if isinstance(soup, HtmlTree):
+        text = soup.get_text('\n')
+    else:
+        text = soup.get_text(separator='\n', strip=True)
     # Clean up excessive newlines
     text = re.sub(r'\n{3,}', '\n\n', text)
     return text
@@ -722,21 +3396,422 @@ def load_checkpoint(checkpoint_path: str) -> Optional[Checkpoint]:
     return None
 
 
+class _BloomSlice:
+    """One fixed-size Bloom filter over a bytearray or a (copy-on-write) mmap"""
+    __slots__ = ('capacity', 'error_rate', 'num_bits', 'num_hashes', 'count', 'bits')
+
+    def __init__(self, capacity: int, error_rate: float, bits=None, count: int = 0):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        # Optimal size for n items at false positive rate p: m = -n ln p / (ln 2)^2, k = m/n ln 2
+        self.num_bits = max(8, int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2))))
+        self.num_hashes = max(1, int(round(self.num_bits / capacity * math.log(2))))
+        self.count = count
+        self.bits = bits if bits is not None else bytearray((self.num_bits + 7) // 8)
+
+    def _positions(self, h1: int, h2: int) -> Iterator[int]:
+        # Kirsch-Mitzenmacher double hashing: k positions from two hashes
+        for i in range(self.num_hashes):
+            yield (h1 + i * h2) % self.num_bits
+
+    def contains(self, h1: int, h2: int) -> bool:
+        bits = self.bits
+        return all(bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(h1, h2))
+
+    def add(self, h1: int, h2: int):
+        bits = self.bits
+        for pos in self._positions(h1, h2):
+            bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def estimated_false_positive_rate(self) -> float:
+        return (1 - math.exp(-self.num_hashes * self.count / self.num_bits)) ** self.num_hashes
+
+
+class SeenFilter:
+    """
+    Scalable Bloom filter for URLs already handled (Almeida et al., 2007).
+    Once a slice reaches its capacity, a new slice with twice the capacity and
+    a tighter error rate is added. The compound false positive rate therefore
+    stays below `error_rate` however many URLs are added, and memory grows
+    linearly with them. The filter can be dumped to disk and mmap-loaded on
+    resume. Supports `in` and `add` like the set it replaces.
+    """
+    MAGIC = b"SEENBLM1"
+    FILENAME = "_seen.bloom"
+    GROWTH = 2
+    TIGHTENING = 0.5
+
+    def __init__(self, initial_capacity: int = 100000, error_rate: float = DEFAULT_SEEN_ERROR_RATE):
+        self.initial_capacity = max(1, initial_capacity)
+        self.error_rate = error_rate
+        self.slices: List[_BloomSlice] = []
+        self.dirty = False
+        self._mmap = None
+
+    @staticmethod
+    def _hashes(url: str) -> Tuple[int, int]:
+        digest = hashlib.blake2b(url.encode('utf-8'), digest_size=16).digest()
+        return int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+
+    def __contains__(self, url: str) -> bool:
+        h1, h2 = self._hashes(url)
+        return any(s.contains(h1, h2) for s in reversed(self.slices))
+
+    def add(self, url: str):
+        h1, h2 = self._hashes(url)
+        if any(s.contains(h1, h2) for s in self.slices):
+            return
+        if not self.slices or self.slices[-1].count >= self.slices[-1].capacity:
+            n = len(self.slices)
+            self.slices.append(_BloomSlice(
+                self.initial_capacity * self.GROWTH ** n,
+                self.error_rate * (1 - self.TIGHTENING) * self.TIGHTENING ** n,
+            ))
+        self.slices[-1].add(h1, h2)
+        self.dirty = True
+
+    def __len__(self) -> int:
+        return sum(s.count for s in self.slices)
+
+    @property
+    def capacity(self) -> int:
+        return sum(s.capacity for s in self.slices)
+
+    @property
+    def size_bytes(self) -> int:
+        return sum(len(s.bits) for s in self.slices)
+
+    def estimated_false_positive_rate(self) -> float:
+        """Probability that an unseen URL is reported as seen, from the current fill of each slice"""
+        miss = 1.0
+        for s in self.slices:
+            miss *= 1 - s.estimated_false_positive_rate()
+        return 1 - miss
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "type": "scalable-bloom",
+            "count": len(self),
+            "capacity": self.capacity,
+            "slices": len(self.slices),
+            "bytes": self.size_bytes,
+            "target_false_positive_rate": self.error_rate,
+            "estimated_false_positive_rate": self.estimated_false_positive_rate(),
+        }
+
+    def dump(self, path: Path):
+        """Header line (JSON) followed by the raw bit arrays; written atomically"""
+        header = {
+            "initial_capacity": self.initial_capacity,
+            "error_rate": self.error_rate,
+            "slices": [{"capacity": s.capacity, "error_rate": s.error_rate, "count": s.count} for s in self.slices],
+        }
+        tmp_path = path.with_suffix('.tmp')
+        with open(tmp_path, 'wb') as f:
+            f.write(self.MAGIC + json.dumps(header).encode('utf-8') + b'\n')
+            for s in self.slices:
+                f.write(s.bits)
+        os.replace(tmp_path, path)
+        self.dirty = False
+
+    @classmethod
+    def load(cls, path: Path) -> "SeenFilter":
+        """Map a dumped filter copy-on-write: pages load lazily and adds never touch the file"""
+        with open(path, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+        if mapped[:len(cls.MAGIC)] != cls.MAGIC:
+            mapped.close()
+            raise ValueError(f"Not a seen filter: {path}")
+        header_end = mapped.find(b'\n')
+        header = json.loads(mapped[len(cls.MAGIC):header_end])
+        seen = cls(header["initial_capacity"], header["error_rate"])
+        view = memoryview(mapped)
+        offset = header_end + 1
+        for meta in header["slices"]:
+            s = _BloomSlice(meta["capacity"], meta["error_rate"], count=meta["count"], bits=b"")
+            nbytes = (s.num_bits + 7) // 8
+            s.bits = view[offset:offset + nbytes]
+            offset += nbytes
+            seen.slices.append(s)
+        seen._mmap = mapped
+        return seen
+
+
+class CrawlJournal:
+    """
+    Append-only record of each URL's terminal status (success, failed, skipped),
+    written as it happens to numbered JSONL segments in `_journal/`.
+    Replaying the segments in order rebuilds the crawl state, later records win.
+    Compaction rewrites them as a single segment holding the latest status per URL.
+    Records reach the OS as they are written, which survives the crawler being
+    killed; they are fsynced when a segment fills up and at every checkpoint
+    (sync()), so a power loss only drops records written since the last of those.
+    """
+    DIRNAME = "_journal"
+
+    def __init__(self, directory: Path, segment_records: int = JOURNAL_SEGMENT_RECORDS,
+                 max_segments: int = JOURNAL_MAX_SEGMENTS):
+        self.directory = directory
+        self.segment_records = segment_records
+        self.max_segments = max_segments
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._file = None
+        self._records = 0
+        self._next_id = max(self._segment_ids(), default=0) + 1
+
+    def _segment_ids(self) -> List[int]:
+        ids = []
+        for path in self.directory.glob("segment-*.jsonl"):
+            try:
+                ids.append(int(path.stem.split('-', 1)[1]))
+            except ValueError:
+                pass
+        return sorted(ids)
+
+    @property
+    def segment_count(self) -> int:
+        return len(self._segment_ids())
+
+    def _segment_path(self, segment_id: int) -> Path:
+        return self.directory / f"segment-{segment_id:06d}.jsonl"
+
+    def replay(self) -> Dict[str, str]:
+        """Latest status per URL. A torn last line from a crash is ignored."""
+        state: Dict[str, str] = {}
+        for segment_id in self._segment_ids():
+            with open(self._segment_path(segment_id), 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                        state[record['u']] = record['s']
+                    except (ValueError, KeyError):
+                        continue
+        return state
+
+    def append(self, url: str, status: str):
+        if self._file is None or self._records >= self.segment_records:
+            self._rotate()
+        # Line-buffered: each record reaches the OS as soon as it is written
+        self._file.write(json.dumps({'u': url, 's': status}) + '\n')
+        self._records += 1
+
+    def _rotate(self):
+        if self._file:
+            self._file.flush()
+            os.fsync(self._file.fileno())  # a full segment is on stable storage before the next one starts
+            self._file.close()
+        self._file = open(self._segment_path(self._next_id), 'a', encoding='utf-8', buffering=1)
+        self._next_id += 1
+        self._records = 0
+
+    def sync(self):
+        """Flush to stable storage; compacts once there are too many segments"""
+        if self._file:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        if self.segment_count > self.max_segments:
+            self.compact()
+
+    def compact(self, state: Optional[Dict[str, str]] = None):
+        if state is None:
+            state = self.replay()
+        if self._file:
+            self._file.close()
+            self._file = None
+        old_ids = self._segment_ids()
+        target = self._segment_path(self._next_id)
+        self._next_id += 1
+        tmp_path = target.with_suffix('.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for url, status in state.items():
+                f.write(json.dumps({'u': url, 's': status}) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        # The compacted segment sorts after the ones it replaces, so a crash here is harmless
+        os.replace(tmp_path, target)
+        for segment_id in old_ids:
+            self._segment_path(segment_id).unlink(missing_ok=True)
+        log(f"Journal compacted: {len(state)} URLs in 1 segment (was {len(old_ids)})")
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    def remove(self):
+        self.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+# --- Phase 5: Storage Helpers ---
+
+def export_to_sqlite(db_path: Path, url: str, content: str, date: str, status: str):
+    """Write a single row. Crawls use SQLiteSink, which batches rows on one connection."""
+    try:
+        conn = sqlite3.connect(db_path)
+        ensure_sqlite_schema(conn)
+        # Upsert rather than REPLACE so FTS triggers from a crawl database stay in sync
+        conn.execute("INSERT INTO pages (url, content, date, status) VALUES (?, ?, ?, ?) "
+                     "ON CONFLICT(url) DO UPDATE SET content = excluded.content, date = excluded.date, status = excluded.status",
+                     (url, content, date, status))
+        conn.commit()
+        conn.close()
+    except Exception as e:
+        log(f"SQLite export failed: {e}")
+
+SQLITE_COLUMNS = ('url', 'content', 'date', 'status', 'title', 'hash', 'path', 'fetch_ms', 'convert_ms')
+
+def ensure_sqlite_schema(conn: sqlite3.Connection, fts: bool = False) -> bool:
+    """
+    Create or migrate the pages table. The first four columns keep the layout
+    of databases written by earlier versions; newer columns are added in place.
+    Returns whether the FTS5 index is available.
+    """
+    conn.execute('''CREATE TABLE IF NOT EXISTS pages
+                    (url TEXT PRIMARY KEY, content TEXT, date TEXT, status TEXT)''')
+    existing = {row[1] for row in conn.execute("PRAGMA table_info(pages)")}
+    for column, column_type in (('title', 'TEXT'), ('hash', 'TEXT'), ('path', 'TEXT'),
+                                ('fetch_ms', 'REAL'), ('convert_ms', 'REAL')):
+        if column not in existing:
+            conn.execute(f"ALTER TABLE pages ADD COLUMN {column} {column_type}")
+    if not fts:
+        return False
+    try:
+        created = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'pages_fts'").fetchone() is None
+        # External-content index over pages, kept in sync by triggers
+        conn.executescript('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS pages_fts
+                USING fts5(url UNINDEXED, title, content, content='pages', content_rowid='rowid');
+            CREATE TRIGGER IF NOT EXISTS pages_fts_insert AFTER INSERT ON pages BEGIN
+                INSERT INTO pages_fts(rowid, url, title, content) VALUES (new.rowid, new.url, new.title, new.content);
+            END;
+            CREATE TRIGGER IF NOT EXISTS pages_fts_delete AFTER DELETE ON pages BEGIN
+                INSERT INTO pages_fts(pages_fts, rowid, url, title, content) VALUES ('delete', old.rowid, old.url, old.title, old.content);
+            END;
+            CREATE TRIGGER IF NOT EXISTS pages_fts_update AFTER UPDATE ON pages BEGIN
+                INSERT INTO pages_fts(pages_fts, rowid, url, title, content) VALUES ('delete', old.rowid, old.url, old.title, old.content);
+                INSERT INTO pages_fts(rowid, url, title, content) VALUES (new.rowid, new.url, new.title, new.content);
+            END;
+        ''')
+        if created:
+            conn.execute("INSERT INTO pages_fts(pages_fts) VALUES ('rebuild')")
+        return True
+    except sqlite3.OperationalError as e:
+        log(f"SQLite FTS5 unavailable: {e}")
+        return False
+
+class SQLiteSink:
+    """
+    Single writer for --sqlite-db. Rows are queued by the crawl workers and
+    written by one task over one long-lived WAL connection, committing every
+    `batch_rows` rows or `flush_interval` seconds. The writes run in a thread,
+    so they never block the event loop.
+    A batch that cannot be written is retried with backoff, then written row
+    by row, so only the rows SQLite still rejects are lost (counted in `failed`).
+    A failed fetch updates the status but keeps the last good content.
+    """
+    UPSERT = (
+        f"INSERT INTO pages ({', '.join(SQLITE_COLUMNS)}) VALUES ({', '.join('?' * len(SQLITE_COLUMNS))}) "
+        "ON CONFLICT(url) DO UPDATE SET content = COALESCE(excluded.content, content), date = excluded.date, "
+        "status = excluded.status, title = COALESCE(excluded.title, title), hash = COALESCE(excluded.hash, hash), "
+        "path = COALESCE(excluded.path, path), fetch_ms = excluded.fetch_ms, convert_ms = excluded.convert_ms"
+    )
+
+    def __init__(self, db_path: Path, fts: bool = False, batch_rows: int = SQLITE_BATCH_ROWS,
+                 flush_interval: float = SQLITE_FLUSH_INTERVAL_SEC):
+        self.db_path = db_path
+        self.fts = fts
+        self.batch_rows = batch_rows
+        self.flush_interval = flush_interval
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=batch_rows * 4)
+        self.conn: Optional[sqlite3.Connection] = None
+        self.written = 0
+        self.commits = 0
+        self.failed = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def _open(self):
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        self.fts = ensure_sqlite_schema(conn, self.fts)
+        conn.commit()
+        self.conn = conn
+
+    async def start(self):
+        await asyncio.to_thread(self._open)
+        self._task = asyncio.create_task(self._run())
+
+    async def submit(self, url: str, status: str, content: Optional[str] = None, title: Optional[str] = None,
+                     path: Optional[str] = None, fetch_ms: Optional[float] = None, convert_ms: Optional[float] = None):
+        content_hash = hashlib.sha256(content.encode('utf-8')).hexdigest() if content is not None else None
+        # Backpressure: workers wait if the writer falls behind
+        await self.queue.put((url, content, datetime.now().isoformat(), status, title, content_hash, path, fetch_ms, convert_ms))
+
+    def _write(self, rows: List[tuple]):
+        with self.conn:
+            self.conn.executemany(self.UPSERT, rows)
+        self.written += len(rows)
+        self.commits += 1
+
+    def _write_each(self, rows: List[tuple]) -> int:
+        """One transaction per row, so a bad row is the only one lost. Returns the rows lost."""
+        lost = 0
+        for row in rows:
+            try:
+                self._write([row])
+            except Exception as e:
+                log(f"SQLite row dropped: {row[0]}: {e}")
+                lost += 1
+        return lost
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        done = False
+        while not done:
+            row = await self.queue.get()
+            if row is None:
+                break
+            rows = [row]
+            deadline = loop.time() + self.flush_interval
+            while len(rows) < self.batch_rows:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    row = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if row is None:
+                    done = True
+                    break
+                rows.append(row)
+            for retry in range(MAX_RETRIES):
+                try:
+                    await asyncio.to_thread(self._write, rows)
+                    break
+                except Exception as e:
+                    if retry < MAX_RETRIES - 1:
+                        await asyncio.sleep(exponential_backoff(retry))
+                    else:
+                        log(f"SQLite batch write failed after {MAX_RETRIES} attempts ({len(rows)} rows): {e}, "
+                            "writing the rows one by one")
+                        self.failed += await asyncio.to_thread(self._write_each, rows)
 
-# --- Phase 5: Storage Helpers ---
+    def stats(self) -> Dict[str, int]:
+        return {'written': self.written, 'transactions': self.commits, 'failed': self.failed}
 
-def export_to_sqlite(db_path: Path, url: str, content: str, date: str, status: str):
-    try:
-        conn = sqlite3.connect(db_path)
-        c = conn.cursor()
-        c.execute('''CREATE TABLE IF NOT EXISTS pages
-                     (url TEXT PRIMARY KEY, content TEXT, date TEXT, status TEXT)''')
-        c.execute('''CREATE INDEX IF NOT EXISTS idx_url ON pages(url)''')
-        c.execute("INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?)", (url, content, date, status))
-        conn.commit()
-        conn.close()
-    except Exception as e:
-        log(f"SQLite export failed: {e}")
+    async def close(self):
+        """Flush queued rows and close the connection"""
+        if self._task:
+            await self.queue.put(None)
+            await self._task
+            self._task = None
+        if self.conn:
+            self.conn.close()
+            self.conn = None
+            log(f"SQLite: {self.written} rows in {self.commits} transactions, {self.failed} failed -> {self.db_path}")
 
 def upload_to_s3(bucket: str, prefix: str, file_path: Path, relative_path: Path):
     if not boto3:
@@ -749,6 +3824,228 @@ def upload_to_s3(bucket: str, prefix: str, file_path: Path, relative_path: Path)
     except Exception as e:
         log(f"S3 upload failed: {e}")
 
+class S3Uploader:
+    """
+    Upload stage for --s3-bucket. Workers queue finished files and return at once.
+    `concurrency` uploads run in a thread pool over one shared boto3 client, whose
+    connection pool has the same size. An object whose `sha256` metadata matches
+    the content hash is left alone; failed uploads are retried with backoff.
+    Rendered files embed their fetch time, so callers pass a hash of the page
+    content instead of letting it default to the file bytes.
+    """
+
+    def __init__(self, bucket: str, prefix: Optional[str] = None, concurrency: int = DEFAULT_S3_CONCURRENCY,
+                 endpoint_url: Optional[str] = None, client=None):
+        self.bucket = bucket
+        self.prefix = (prefix or "").strip('/')
+        self.concurrency = max(1, concurrency)
+        if client is None:
+            client = boto3.client('s3', endpoint_url=endpoint_url,
+                                  config=BotoConfig(max_pool_connections=self.concurrency))
+        self.client = client
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=self.concurrency * 4)
+        self.executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="s3-upload")
+        self.uploaded = 0
+        self.unchanged = 0
+        self.failed: List[str] = []
+        self._workers: List[asyncio.Task] = []
+
+    def key_for(self, relative_path: Path) -> str:
+        key = relative_path.as_posix()
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def start(self):
+        self._workers = [asyncio.create_task(self._run()) for _ in range(self.concurrency)]
+
+    async def submit(self, file_path: Path, relative_path: Path, content_hash: Optional[str] = None):
+        await self.queue.put((file_path, self.key_for(relative_path), content_hash))
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await self.queue.get()
+            if item is None:
+                return
+            file_path, key, content_hash = item
+            for retry in range(MAX_RETRIES):
+                try:
+                    if await loop.run_in_executor(self.executor, self._upload, file_path, key, content_hash):
+                        self.uploaded += 1
+                    else:
+                        self.unchanged += 1
+                    break
+                except Exception as e:
+                    if retry < MAX_RETRIES - 1:
+                        await asyncio.sleep(exponential_backoff(retry))
+                    else:
+                        log(f"S3 upload failed after {MAX_RETRIES} attempts: {key}: {e}")
+                        self.failed.append(key)
+
+    def _upload(self, file_path: Path, key: str, content_hash: Optional[str] = None) -> bool:
+        """Runs in the thread pool. Returns False if the stored object is already identical."""
+        digest = content_hash or hashlib.sha256(file_path.read_bytes()).hexdigest()
+        try:
+            head = self.client.head_object(Bucket=self.bucket, Key=key)
+            if head.get('Metadata', {}).get('sha256') == digest:
+                return False
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') not in ('404', 'NoSuchKey', 'NotFound'):
+                raise
+        extra_args = {'Metadata': {'sha256': digest}}
+        content_type = mimetypes.guess_type(file_path.name)[0]
+        if content_type:
+            extra_args['ContentType'] = content_type
+        self.client.upload_file(str(file_path), self.bucket, key, ExtraArgs=extra_args)
+        return True
+
+    async def close(self):
+        """Drain the queue and stop the workers"""
+        if not self._workers:
+            return
+        for _ in self._workers:
+            await self.queue.put(None)
+        await asyncio.gather(*self._workers)
+        self._workers = []
+        self.executor.shutdown()
+        log(f"S3: {self.uploaded} uploaded, {self.unchanged} unchanged, {len(self.failed)} failed -> s3://{self.bucket}/{self.prefix}")
+
+ARCHIVE_SUFFIXES = {'zip': '.zip', 'tar.gz': '.tar.gz', 'tar.zst': '.tar.zst'}
+
+class ArchiveWriter:
+    """
+    Builds --create-archive while the crawl runs: every page is appended as it
+    is written, from the content already in memory. Compression happens on one
+    background thread fed by a bounded queue (tar.zst adds zstd worker threads).
+    Closing only adds the few top-level report files and writes the trailer, so
+    time-to-artifact does not grow with the size of the site.
+    The archive is built as `<name>.partial` and renamed when complete.
+    """
+
+    def __init__(self, archive_path: Path, archive_type: str, root: str, zstd_threads: int = -1):
+        if archive_type == 'tar.zst' and not zstandard:
+            log("zstandard not installed, writing tar.gz instead")
+            archive_type = 'tar.gz'
+            archive_path = archive_path.with_name(archive_path.name.replace('.tar.zst', '.tar.gz'))
+        self.archive_path = archive_path
+        self.archive_type = archive_type
+        self.root = root
+        self.partial_path = archive_path.with_name(archive_path.name + '.partial')
+        self.added: Set[str] = set()
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=ARCHIVE_QUEUE_SIZE)
+        self._zstd_threads = zstd_threads
+        self._raw = None
+        self._zstd = None
+        self._zip = None
+        self._tar = None
+        self._task: Optional[asyncio.Task] = None
+
+    def _open(self):
+        if self.archive_type == 'zip':
+            self._zip = zipfile.ZipFile(self.partial_path, 'w', zipfile.ZIP_DEFLATED)
+        elif self.archive_type == 'tar.zst':
+            self._raw = open(self.partial_path, 'wb')
+            compressor = zstandard.ZstdCompressor(level=3, threads=self._zstd_threads)
+            self._zstd = compressor.stream_writer(self._raw, closefd=False)
+            self._tar = tarfile.open(fileobj=self._zstd, mode='w|')
+        else:
+            self._tar = tarfile.open(self.partial_path, 'w:gz')
+
+    def _write(self, arcname: str, data: bytes, mtime: float):
+        if self._zip:
+            info = zipfile.ZipInfo(arcname, time.localtime(mtime)[:6])
+            info.compress_type = zipfile.ZIP_DEFLATED
+            info.external_attr = 0o644 << 16
+            self._zip.writestr(info, data)
+        else:
+            info = tarfile.TarInfo(arcname)
+            info.size = len(data)
+            info.mtime = int(mtime)
+            info.mode = 0o644
+            self._tar.addfile(info, BytesIO(data))
+
+    def start(self):
+        self._open()
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            item = await self.queue.get()
+            if item is None:
+                return
+            try:
+                await asyncio.to_thread(self._write, *item)
+            except Exception as e:
+                log(f"Archive write failed for {item[0]}: {e}")
+
+    def _arcname(self, relative_path: Path) -> str:
+        return f"{self.root}/{relative_path.as_posix()}"
+
+    async def add(self, relative_path: Path, content):
+        """Queue an entry; a path added twice keeps only its first version"""
+        arcname = self._arcname(relative_path)
+        if arcname in self.added:
+            return
+        self.added.add(arcname)
+        data = content.encode('utf-8') if isinstance(content, str) else content
+        await self.queue.put((arcname, data, time.time()))
+
+    async def add_file(self, file_path: Path, relative_path: Path):
+        try:
+            data = await asyncio.to_thread(file_path.read_bytes)
+        except OSError as e:
+            log(f"Archive could not read {file_path}: {e}")
+            return
+        await self.add(relative_path, data)
+
+    async def add_missing(self, output_dir: Path, exclude: Set[str] = frozenset()):
+        """Add files not yet archived (pages written by an earlier, interrupted run)"""
+        for root, dirs, files in os.walk(output_dir):
+            dirs[:] = [d for d in dirs if d not in exclude]
+            for file in files:
+                path = Path(root) / file
+                relative = path.relative_to(output_dir)
+                if file not in exclude and self._arcname(relative) not in self.added:
+                    await self.add_file(path, relative)
+
+    async def close(self, output_dir: Optional[Path] = None, exclude: Set[str] = frozenset()) -> Path:
+        """Add top-level report files from `output_dir`, write the trailer and publish the archive"""
+        if output_dir:
+            for path in sorted(output_dir.iterdir()):
+                if path.is_file() and path.name not in exclude:
+                    await self.add_file(path, Path(path.name))
+        if self._task:
+            await self.queue.put(None)
+            await self._task
+            self._task = None
+        await asyncio.to_thread(self._finish)
+        os.replace(self.partial_path, self.archive_path)
+        log(f"Created {self.archive_type} archive: {self.archive_path} ({len(self.added)} entries)")
+        return self.archive_path
+
+    async def abort(self):
+        """Stop writing and delete the partial archive"""
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        try:
+            await asyncio.to_thread(self._finish)
+        except Exception:
+            pass
+        self.partial_path.unlink(missing_ok=True)
+
+    def _finish(self):
+        if self._zip:
+            self._zip.close()
+        if self._tar:
+            self._tar.close()
+        if self._zstd:
+            self._zstd.flush(zstandard.FLUSH_FRAME)
+            self._zstd.close()
+        if self._raw:
+            self._raw.close()
+        self._zip = self._tar = self._zstd = self._raw = None
+
 def create_archive(output_dir: Path, archive_type: str, domain: str):
     if archive_type == 'zip':
         archive_path = output_dir.with_name(f"{domain}.zip")
@@ -763,15 +4060,303 @@ def create_archive(output_dir: Path, archive_type: str, domain: str):
         with tarfile.open(archive_path, "w:gz") as tar:
             tar.add(output_dir, arcname=domain)
         log(f"Created tar.gz archive: {archive_path}")
+    elif archive_type == 'tar.zst' and zstandard:
+        archive_path = output_dir.with_name(f"{domain}.tar.zst")
+        with open(archive_path, 'wb') as raw:
+            with zstandard.ZstdCompressor(level=3, threads=-1).stream_writer(raw) as zst:
+                with tarfile.open(fileobj=zst, mode='w|') as tar:
+                    tar.add(output_dir, arcname=domain)
+        log(f"Created tar.zst archive: {archive_path}")
+
+# --- Phase 5.1: Sharded dataset output (--output-format jsonl / parquet) ---
+
+DATASET_SCHEMA = (
+    ('url', 'string'), ('path', 'string'), ('title', 'string'), ('markdown', 'string'),
+    ('hash', 'string'), ('fetched_at', 'string'), ('lastmod', 'string'), ('tokens', 'int64'),
+)
+
+def dataset_record(url: str, path: str, title: Optional[str], markdown: str, lastmod: Optional[str] = None,
+                   tokens: int = 0) -> Dict[str, Any]:
+    """One page in DATASET_SCHEMA order"""
+    return {
+        'url': url,
+        'path': path,
+        'title': title or None,
+        'markdown': markdown,
+        'hash': hashlib.sha256(markdown.encode('utf-8')).hexdigest(),
+        'fetched_at': datetime.now(timezone.utc).isoformat(),
+        'lastmod': lastmod,
+        'tokens': tokens,
+    }
+
+def _arrow_schema():
+    return pyarrow.schema([(name, pyarrow.string() if kind == 'string' else pyarrow.int64())
+                           for name, kind in DATASET_SCHEMA])
+
+def _read_jsonl_shard(path: Path, tolerant: bool = False) -> Iterator[Dict[str, Any]]:
+    """Records of a .jsonl(.zst|.gz) shard. `tolerant` stops quietly at a truncated tail."""
+    name = path.name.removesuffix('.partial')
+    with open(path, 'rb') as raw:
+        if name.endswith('.zst'):
+            if not zstandard:
+                raise RuntimeError("zstandard is required to read .jsonl.zst shards")
+            stream = zstandard.ZstdDecompressor().stream_reader(raw, read_across_frames=True)
+        elif name.endswith('.gz'):
+            stream = gzip.GzipFile(fileobj=raw)
+        else:
+            stream = raw
+        try:
+            for line in TextIOWrapper(stream, encoding='utf-8'):
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    if not tolerant:
+                        raise
+        except (EOFError, zlib.error) + ((zstandard.ZstdError,) if zstandard else ()):
+            if not tolerant:
+                raise
+
+def iter_dataset(path, columns: Optional[List[str]] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Stream the pages of a jsonl/parquet dataset in shard order, one dict per page.
+    `path` is the dataset directory or a single shard; `columns` limits the fields
+    returned (Parquet shards only read those columns). Under --update a re-fetched
+    page is written again to a later shard, so the last record for a URL wins.
+    """
+    path = Path(path)
+    if path.is_file():
+        shards = [path]
+    else:
+        shards = sorted(p for p in path.glob("part-*") if not p.name.endswith('.partial'))
+    for shard in shards:
+        if shard.name.endswith('.parquet'):
+            if not pyarrow:
+                raise RuntimeError("pyarrow is required to read Parquet shards")
+            for batch in pq.ParquetFile(shard).iter_batches(columns=columns):
+                yield from batch.to_pylist()
+        else:
+            for record in _read_jsonl_shard(shard):
+                yield {name: record.get(name) for name in columns} if columns else record
+
+class DatasetWriter:
+    """
+    Writes --output-format jsonl/parquet: every page becomes one record in
+    compressed shards (`dataset/part-NNNNNN.jsonl.zst|.jsonl.gz|.parquet`) that
+    rotate at `shard_bytes` of uncompressed content, instead of one file per page.
+    Records are queued by the workers and written by one background task.
+
+    A page is reported to `on_durable` only once its record has been handed to the
+    OS, so the crawl journal never marks a page done that a crash of the crawler
+    could lose: JSONL shards flush a compressed block every `flush_interval`
+    seconds (and a partial shard left by a crash is salvaged on resume), Parquet
+    shards count when closed. Neither is fsynced per record (see CrawlJournal).
+    Shards are written as `.partial` and renamed when complete; `on_shard` is
+    awaited for each finished shard.
+    """
+    DIRNAME = "dataset"
+
+    def __init__(self, directory: Path, output_format: str, shard_bytes: int = DEFAULT_SHARD_SIZE_MB * 1024 * 1024,
+                 flush_interval: float = DATASET_FLUSH_INTERVAL_SEC, on_durable=None, on_shard=None):
+        if output_format == 'parquet' and not pyarrow:
+            log("pyarrow not installed, writing jsonl instead")
+            output_format = 'jsonl'
+        self.directory = directory
+        self.output_format = output_format
+        if output_format == 'parquet':
+            self.suffix = '.parquet'
+        else:
+            self.suffix = '.jsonl.zst' if zstandard else '.jsonl.gz'
+        self.shard_bytes = shard_bytes
+        self.flush_interval = flush_interval
+        self.on_durable = on_durable
+        self.on_shard = on_shard
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=DATASET_ROW_GROUP_ROWS)
+        self.records = 0
+        self.shards: List[Path] = []
+        self.recovered: List[str] = []
+        self._next_id = 1
+        self._path: Optional[Path] = None
+        self._raw = None
+        self._stream = None
+        self._parquet = None
+        self._size = 0
+        self._rows: List[Dict[str, Any]] = []
+        self._pending: List[str] = []
+        self._finished: List[Path] = []
+        self._task: Optional[asyncio.Task] = None
+
+    def _shard_id(self, path: Path) -> int:
+        try:
+            return int(path.name.split('.', 1)[0].split('-', 1)[1])
+        except (IndexError, ValueError):
+            return 0
+
+    def _prepare(self, clear: bool):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        existing = sorted(self.directory.glob("part-*"))
+        if clear:
+            for path in existing:
+                path.unlink()
+            if existing:
+                log(f"Removed {len(existing)} dataset shards from a previous run")
+            return
+        self._next_id = max((self._shard_id(p) for p in existing), default=0) + 1
+        for path in existing:
+            if not path.name.endswith('.partial'):
+                continue
+            if path.name.endswith('.jsonl.zst.partial') or path.name.endswith('.jsonl.gz.partial'):
+                # Everything up to the last flushed block is readable
+                salvaged = list(_read_jsonl_shard(path, tolerant=True))
+                if salvaged:
+                    self._write_batch(salvaged)
+                    self._close_shard()
+                    self.recovered.extend(record['url'] for record in salvaged)
+            path.unlink()
+        if self.recovered:
+            log(f"Recovered {len(self.recovered)} records from an interrupted dataset shard")
+
+    async def start(self, clear: bool = False):
+        """Open the dataset; `clear` drops shards of a previous run, otherwise new shards continue after them"""
+        await asyncio.to_thread(self._prepare, clear)
+        await self._publish([])
+        self._task = asyncio.create_task(self._run())
+
+    def _open_shard(self):
+        self._path = self.directory / f"part-{self._next_id:06d}{self.suffix}.partial"
+        self._next_id += 1
+        self._size = 0
+        if self.output_format == 'parquet':
+            self._parquet = pq.ParquetWriter(self._path, _arrow_schema(), compression='zstd')
+            return
+        self._raw = open(self._path, 'wb')
+        if zstandard:
+            self._stream = zstandard.ZstdCompressor(level=3, threads=-1).stream_writer(self._raw, closefd=False)
+        else:
+            self._stream = gzip.GzipFile(fileobj=self._raw, mode='wb')
+
+    def _write_row_group(self):
+        if self._rows:
+            self._parquet.write_table(pyarrow.Table.from_pylist(self._rows, schema=_arrow_schema()))
+            self._rows = []
+
+    def _write_batch(self, records: List[Dict[str, Any]]) -> List[str]:
+        """Append records to the current shard; returns the URLs now safe from a crawler crash"""
+        if self._path is None:
+            self._open_shard()
+        durable = []
+        if self._parquet:
+            self._rows.extend(records)
+            self._pending.extend(record['url'] for record in records)
+            self._size += sum(len(record['markdown'].encode('utf-8')) for record in records)
+            if len(self._rows) >= DATASET_ROW_GROUP_ROWS:
+                self._write_row_group()
+        else:
+            for record in records:
+                line = (json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8')
+                self._stream.write(line)
+                self._size += len(line)
+            # A flushed block is readable even if the shard is never finished
+            if zstandard:
+                self._stream.flush(zstandard.FLUSH_BLOCK)
+            else:
+                self._stream.flush()
+            self._raw.flush()
+            durable = [record['url'] for record in records]
+        self.records += len(records)
+        if self._size >= self.shard_bytes:
+            durable.extend(self._close_shard())
+        return durable
+
+    def _close_shard(self) -> List[str]:
+        if self._parquet:
+            self._write_row_group()
+            self._parquet.close()
+            self._parquet = None
+        else:
+            if zstandard:
+                self._stream.flush(zstandard.FLUSH_FRAME)
+            self._stream.close()
+            self._raw.close()
+            self._stream = self._raw = None
+        final_path = self._path.with_name(self._path.name.removesuffix('.partial'))
+        os.replace(self._path, final_path)
+        self._path = None
+        self.shards.append(final_path)
+        self._finished.append(final_path)
+        durable, self._pending = self._pending, []
+        return durable
+
+    async def add(self, record: Dict[str, Any]):
+        # Backpressure: workers wait if the writer falls behind
+        await self.queue.put(record)
+
+    async def _publish(self, durable: List[str]):
+        if durable and self.on_durable:
+            self.on_durable(durable)
+        while self._finished:
+            path = self._finished.pop(0)
+            log(f"Dataset shard written: {path.name}")
+            if self.on_shard:
+                await self.on_shard(path)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        done = False
+        while not done:
+            record = await self.queue.get()
+            if record is None:
+                break
+            records = [record]
+            deadline = loop.time() + self.flush_interval
+            while len(records) < DATASET_ROW_GROUP_ROWS:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    record = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if record is None:
+                    done = True
+                    break
+                records.append(record)
+            try:
+                durable = await asyncio.to_thread(self._write_batch, records)
+            except Exception as e:
+                log(f"Dataset write failed ({len(records)} records): {e}")
+                continue
+            await self._publish(durable)
+
+    async def close(self):
+        """Write queued records and finish the current shard"""
+        if self._task is None and self._path is None:
+            return
+        if self._task:
+            await self.queue.put(None)
+            await self._task
+            self._task = None
+        if self._path:
+            await self._publish(await asyncio.to_thread(self._close_shard))
+        log(f"Dataset: {self.records} records in {len(self.shards)} {self.output_format} shards -> {self.directory}")
 
 # --- Phase 6: AI Helpers ---
 
+@functools.lru_cache(maxsize=None)
+def _token_encoding(model: str):
+    # Cached, including failures: count_tokens runs once per page
+    try:
+        return tiktoken.encoding_for_model(model)
+    except Exception:
+        return None
+
 def count_tokens(text: str, model: str = "gpt-3.5-turbo") -> int:
     if not tiktoken:
         return 0
+    encoding = _token_encoding(model)
+    if encoding is None:
+        return 0
     try:
-        encoding = tiktoken.encoding_for_model(model)
-        return len(encoding.encode(text))
+        return len(encoding.encode(text, disallowed_special=()))
     except Exception:
         return 0
 
@@ -794,16 +4379,23 @@ def generate_llms_txt(output_dir: Path, manifest: Dict[str, Any]):
     lines.append(f"Date: {manifest['crawl_date']}")
     lines.append("\n## Pages\n")
     
-    # We need to list markdown files
-    # Iterating output_dir might be better than valid processed_urls if we want actual paths?
-    # But manifest has processed count. Ideally we'd have paths in manifest.
-    # For now, simplistic walk.
-    for root, dirs, files in os.walk(output_dir):
-        for file in files:
-            if file.endswith(".md"):
-                rel = Path(root) / file
-                rel = rel.relative_to(output_dir)
-                lines.append(f"- [{rel}]({rel})")
+    # Manifests since 1.1 list every page's output path (large crawls only in the sorted manifest);
+    # older ones need a walk
+    pages_file = output_dir / manifest['pages_file'] if manifest.get('pages_file') else None
+    if manifest.get('pages') is not None:
+        for rel in sorted(entry['path'] for entry in manifest['pages'].values() if entry.get('path')):
+            lines.append(f"- [{rel}]({rel})")
+    elif pages_file and pages_file.exists():
+        for page in iter_sorted_manifest(pages_file):
+            if page.get('path'):
+                lines.append(f"- [{page['path']}]({page['path']})")
+    else:
+        for root, dirs, files in os.walk(output_dir):
+            for file in files:
+                if file.endswith(".md"):
+                    rel = Path(root) / file
+                    rel = rel.relative_to(output_dir)
+                    lines.append(f"- [{rel}]({rel})")
                 
     with open(output_dir / "llms.txt", "w") as f:
         f.write("\n".join(lines))
@@ -818,6 +4410,10 @@ class ProgressStats(BaseModel):
     elapsed_sec: float
     eta_sec: float
     current_url: str = ""
+    concurrency: Optional[int] = None
+    concurrency_history: List[Tuple[float, int]] = []
+    host_stats: Dict[str, Dict[str, Any]] = {}
+    transport: Dict[str, Any] = {}
 
 def write_progress(path: Path, stats: ProgressStats):
     try:
@@ -840,6 +4436,11 @@ sitemap_urls_failed {stats.failed}
 # HELP sitemap_elapsed_seconds Elapsed time in seconds
 # TYPE sitemap_elapsed_seconds gauge
 sitemap_elapsed_seconds {stats.elapsed_sec}
+"""
+        if stats.concurrency is not None:
+            content += f"""# HELP sitemap_concurrency Current in-flight request limit
+# TYPE sitemap_concurrency gauge
+sitemap_concurrency {stats.concurrency}
 """
         with open(path, 'w') as f:
             f.write(content)
@@ -912,37 +4513,37 @@ def generate_html_report(output_dir: Path, manifest: Dict[str, Any]):
         </div>
         
         {% if manifest.diff.added %}
-        <h3 class="added">Added URLs ({{ manifest.diff.added|length }})</h3>
+        <h3 class="added">Added URLs ({{ manifest.diff.stats.added_count }})</h3>
         <ul>
             {% for url in manifest.diff.added[:20] %}
             <li>{{ url }}</li>
             {% endfor %}
-            {% if manifest.diff.added|length > 20 %}
-            <li>... and {{ manifest.diff.added|length - 20 }} more</li>
+            {% if manifest.diff.stats.added_count > 20 %}
+            <li>... and {{ manifest.diff.stats.added_count - 20 }} more</li>
             {% endif %}
         </ul>
         {% endif %}
         
         {% if manifest.diff.removed %}
-        <h3 class="removed">Removed URLs ({{ manifest.diff.removed|length }})</h3>
+        <h3 class="removed">Removed URLs ({{ manifest.diff.stats.removed_count }})</h3>
         <ul>
             {% for url in manifest.diff.removed[:20] %}
             <li>{{ url }}</li>
             {% endfor %}
-            {% if manifest.diff.removed|length > 20 %}
-            <li>... and {{ manifest.diff.removed|length - 20 }} more</li>
+            {% if manifest.diff.stats.removed_count > 20 %}
+            <li>... and {{ manifest.diff.stats.removed_count - 20 }} more</li>
             {% endif %}
         </ul>
         {% endif %}
         
         {% if manifest.diff.changed %}
-        <h3 class="changed">Changed URLs ({{ manifest.diff.changed|length }})</h3>
+        <h3 class="changed">Changed URLs ({{ manifest.diff.stats.changed_count }})</h3>
         <ul>
             {% for url in manifest.diff.changed[:20] %}
             <li>{{ url }}</li>
             {% endfor %}
-            {% if manifest.diff.changed|length > 20 %}
-            <li>... and {{ manifest.diff.changed|length - 20 }} more</li>
+            {% if manifest.diff.stats.changed_count > 20 %}
+            <li>... and {{ manifest.diff.stats.changed_count - 20 }} more</li>
             {% endif %}
         </ul>
         {% endif %}
@@ -991,7 +4592,12 @@ def calculate_diff(old_manifest: Dict[str, Any], new_manifest: Dict[str, Any]) -
     
     # Check for changed content in common URLs
     common_urls = old_urls & new_urls
-    changed = [url for url in common_urls if old_hashes.get(url) != new_hashes.get(url)]
+    # Manifests before 1.1 hashed the file body with MD5: their hashes are not comparable
+    if old_manifest.get('hash_algorithm', 'md5') != new_manifest.get('hash_algorithm', 'md5'):
+        log("Manifests use different content hashes, changed pages cannot be detected")
+        changed = []
+    else:
+        changed = [url for url in common_urls if old_hashes.get(url) != new_hashes.get(url)]
     
     return {
         "added": added,
@@ -1005,25 +4611,184 @@ def calculate_diff(old_manifest: Dict[str, Any], new_manifest: Dict[str, Any]) -
         }
     }
 
+def external_sort_jsonl(records, out_path: Path, chunk_records: int = SORT_CHUNK_RECORDS) -> int:
+    """
+    Write `records` (dicts with a 'url') to gzip JSONL at `out_path`, sorted by URL
+    with one record per URL (the last one given wins), in bounded memory: sorted
+    runs of `chunk_records` are spilled to disk and merged. Returns the URL count.
+    """
+    count = 0
+    with tempfile.TemporaryDirectory(prefix=".sort-", dir=out_path.parent) as tmp_dir:
+        runs: List[Path] = []
+        chunk: List[Dict[str, Any]] = []
+
+        def spill():
+            # Stable sort: within a run, records for one URL keep their input order
+            chunk.sort(key=lambda record: record['url'])
+            run_path = Path(tmp_dir) / f"run-{len(runs):06d}.jsonl"
+            with open(run_path, 'w', encoding='utf-8') as f:
+                for record in chunk:
+                    f.write(json.dumps(record) + '\n')
+            runs.append(run_path)
+            chunk.clear()
+
+        for record in records:
+            chunk.append(record)
+            if len(chunk) >= chunk_records:
+                spill()
+        if chunk:
+            spill()
+
+        run_files = [open(run_path, 'r', encoding='utf-8') for run_path in runs]
+        try:
+            streams = [(json.loads(line) for line in f) for f in run_files]
+            tmp_path = out_path.with_name(out_path.name + '.tmp')
+            with gzip.open(tmp_path, 'wt', encoding='utf-8') as out:
+                last = None
+                # heapq.merge is stable across runs, so the last record per URL is the latest
+                for record in heapq.merge(*streams, key=lambda record: record['url']):
+                    if last is not None and last['url'] != record['url']:
+                        out.write(json.dumps(last) + '\n')
+                        count += 1
+                    last = record
+                if last is not None:
+                    out.write(json.dumps(last) + '\n')
+                    count += 1
+            os.replace(tmp_path, out_path)
+        finally:
+            for f in run_files:
+                f.close()
+    return count
+
+def iter_sorted_manifest(path: Path) -> Iterator[Dict[str, Any]]:
+    """Stream the page records of a sorted manifest (`_manifest.sorted.jsonl.gz`)"""
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            yield json.loads(line)
+
+def open_manifest_pages(path: Path) -> Tuple[Iterator[Dict[str, Any]], str, Path]:
+    """
+    URL-sorted page records of a previous crawl, with their hash algorithm and the
+    directory their paths are relative to. `path` is a sorted manifest, or a
+    `_manifest.json` (streamed from its sorted manifest when there is one; older
+    manifests only hold their hashes inline and are sorted in memory).
+    """
+    if path.name.endswith('.jsonl.gz'):
+        return iter_sorted_manifest(path), ManifestStore.HASH_ALGORITHM, path.parent
+    with open(path, 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    algorithm = manifest.get('hash_algorithm', 'md5')
+    pages_file = manifest.get('pages_file')
+    if pages_file and (path.parent / pages_file).exists():
+        return iter_sorted_manifest(path.parent / pages_file), algorithm, path.parent
+    pages = manifest.get('pages') or {url: {'hash': h} for url, h in manifest.get('url_content_hashes', {}).items()}
+    return ({'url': url, **pages[url]} for url in sorted(pages)), algorithm, path.parent
+
+def _read_page_text(root: Optional[Path], rel_path: Optional[str]) -> Optional[str]:
+    if root is None or not rel_path:
+        return None
+    try:
+        text = (root / rel_path).read_text(encoding='utf-8')
+    except (OSError, UnicodeDecodeError):
+        return None
+    # The frontmatter holds the crawl date, which changes on every run
+    if rel_path.endswith('.md') and text.startswith('---\n'):
+        end = text.find('\n---\n', 4)
+        if end != -1:
+            text = text[end + 5:].lstrip('\n')
+    return text
+
+def stream_manifest_diff(old_pages: Iterator[Dict[str, Any]], new_pages: Iterator[Dict[str, Any]], out_path: Path,
+                         hashes_comparable: bool = True, patch_path: Optional[Path] = None,
+                         old_root: Optional[Path] = None, new_root: Optional[Path] = None,
+                         baseline_root: Optional[Path] = None) -> Dict[str, Any]:
+    """
+    Merge-join two URL-sorted page streams in constant memory. Each added, removed
+    or changed URL is written to `out_path` as a JSONL change record as soon as it
+    is found. With `patch_path`, a unified diff of every changed page whose old and
+    new output can both be read is appended to that gzip file. Old output that
+    was overwritten in place is read from its copy under `baseline_root`.
+    Returns counts plus the first DIFF_SAMPLE_SIZE URLs of each kind (for reports).
+    """
+    stats = {"added_count": 0, "removed_count": 0, "changed_count": 0, "unchanged_count": 0, "patched_count": 0}
+    samples: Dict[str, List[str]] = {"added": [], "removed": [], "changed": []}
+    if not hashes_comparable:
+        log("Manifests use different content hashes, changed pages cannot be detected")
+    patch = gzip.open(patch_path, 'wt', encoding='utf-8') if patch_path else None
+
+    def write_patch(old: Dict[str, Any], new: Dict[str, Any]):
+        if not (old_root and new_root and old.get('path') and new.get('path')):
+            return
+        if baseline_root and (baseline_root / old['path']).exists():
+            old_base = baseline_root
+        elif (old_root / old['path']).resolve() == (new_root / new['path']).resolve():
+            return  # the old output was overwritten in place and no copy was kept
+        else:
+            old_base = old_root
+        old_text = _read_page_text(old_base, old['path'])
+        new_text = _read_page_text(new_root, new.get('path'))
+        if old_text is None or new_text is None:
+            return
+        lines = difflib.unified_diff(old_text.splitlines(keepends=True), new_text.splitlines(keepends=True),
+                                     fromfile=f"a/{old['path']}", tofile=f"b/{new['path']}")
+        patch.write(f"# {new['url']}\n")
+        for line in lines:
+            patch.write(line if line.endswith('\n') else line + '\n')
+        stats["patched_count"] += 1
+
+    def emit(out, change: str, old: Optional[Dict[str, Any]], new: Optional[Dict[str, Any]]):
+        page = new or old
+        stats[f"{change}_count"] += 1
+        if len(samples[change]) < DIFF_SAMPLE_SIZE:
+            samples[change].append(page['url'])
+        out.write(json.dumps({
+            'url': page['url'], 'change': change,
+            'old_hash': old.get('hash') if old else None, 'new_hash': new.get('hash') if new else None,
+            'path': page.get('path'),
+        }) + '\n')
+
+    try:
+        with open(out_path, 'w', encoding='utf-8') as out:
+            old_iter, new_iter = iter(old_pages), iter(new_pages)
+            old, new = next(old_iter, None), next(new_iter, None)
+            while old is not None or new is not None:
+                if new is None or (old is not None and old['url'] < new['url']):
+                    emit(out, "removed", old, None)
+                    old = next(old_iter, None)
+                elif old is None or new['url'] < old['url']:
+                    emit(out, "added", None, new)
+                    new = next(new_iter, None)
+                else:
+                    if hashes_comparable and old.get('hash') != new.get('hash'):
+                        emit(out, "changed", old, new)
+                        if patch:
+                            write_patch(old, new)
+                    else:
+                        stats["unchanged_count"] += 1
+                    old, new = next(old_iter, None), next(new_iter, None)
+    finally:
+        if patch:
+            patch.close()
+    return {**samples, "stats": stats, "output": str(out_path)}
+
 async def async_main(inputs: InputModel):
 
     log(f"Running sitemap_to_markdown (Async) with url: {inputs.url}")
+    # Filters are compiled once up front (a bad regex fails here, not per URL)
+    matcher = UrlMatcher.from_inputs(inputs)
     
-    # 0. Robots.txt setup
-    rp = None # Initialize rp here
-    
-    # Setup HTTP client with connection pooling
-    limits = httpx.Limits(max_keepalive_connections=100, max_connections=100)
+    # Setup HTTP client with connection pooling (3.2: the proxy is part of the transport)
+    if inputs.http2 and h2 is None:
+        log("h2 not installed, using HTTP/1.1 (pip install 'httpx[http2]')")
+    transport = CrawlTransport(per_host=inputs.max_connections_per_host, http2=inputs.http2 and h2 is not None,
+                               limits=httpx.Limits(max_keepalive_connections=MAX_CONNECTIONS, max_connections=MAX_CONNECTIONS),
+                               proxy=inputs.proxy)
     
     client_kwargs = {
-        "headers": {"User-Agent": USER_AGENT},
-        "limits": limits,
+        "headers": {"User-Agent": USER_AGENT, "Accept-Encoding": accept_encoding()},
+        "transport": transport,
         "timeout": inputs.timeout
     }
-    
-    # 3.2 Proxy Support
-    if inputs.proxy:
-        client_kwargs['proxy'] = inputs.proxy
         
     # 3.3 Custom Headers
     if inputs.headers:
@@ -1033,23 +4798,15 @@ async def async_main(inputs: InputModel):
         except json.JSONDecodeError:
             log("Error parsing custom headers JSON")
 
-    async with httpx.AsyncClient(**client_kwargs) as client:
-        
-        # 3.4 robots.txt
-        rp = None
-        if inputs.respect_robots:
-            parsed = urlparse(inputs.url)
-            base = f"{parsed.scheme}://{parsed.netloc}"
-            robots_url = f"{base}/robots.txt"
-            try:
-                # We need to fetch robots.txt text first async
-                r_resp = await client.get(robots_url, timeout=10)
-                if r_resp.status_code == 200:
-                    rp = RobotFileParser()
-                    rp.parse(r_resp.text.splitlines())
-                    log("Parsed robots.txt")
-            except Exception as e:
-                log(f"Failed to parse robots.txt: {e}")
+    # Sinks, writers and the process pool are closed on every way out; the normal
+    # path closes them earlier, in order, and the exit callbacks then do nothing
+    async with httpx.AsyncClient(**client_kwargs) as client, contextlib.AsyncExitStack() as cleanup:
+
+        # One limiter for every fetch path: exact requests/sec per host
+        ctx = CrawlContext(limiter=HostRateLimiter(inputs.rate_limit),
+                           breaker=HostCircuitBreaker(inputs.breaker_threshold, inputs.breaker_cooldown))
+        if inputs.adaptive_concurrency:
+            ctx.concurrency = AdaptiveConcurrency(inputs.concurrency, inputs.min_concurrency, inputs.max_concurrency)
 
         # 1. Discover
         sitemap_url = await discover_sitemap(client, inputs.url)
@@ -1057,6 +4814,12 @@ async def async_main(inputs: InputModel):
             print(json.dumps(OutputModel(status="error", error="No sitemap found").model_dump()))
             return
 
+        if inputs.filter_dry_run:
+            report = await filter_dry_run(client, sitemap_url, matcher, inputs, ctx)
+            log(f"Filter dry run: {report['matched']} of {report['total_urls']} URLs match ({report['elapsed_sec']}s)")
+            print(json.dumps(OutputModel(status="success", data=report).model_dump()))
+            return
+
         # 2. Setup output
         script_dir = os.path.dirname(os.path.abspath(__file__))
         parsed = urlparse(inputs.url)
@@ -1072,11 +4835,75 @@ async def async_main(inputs: InputModel):
         # 3. Checkpoint & Bloom Filter
         checkpoint_path = output_dir / "checkpoint.json"
         checkpoint = load_checkpoint(str(checkpoint_path))
+        ctx.validators = ValidatorStore.load(output_dir / ValidatorStore.FILENAME)
+        ctx.manifest = ManifestStore(output_dir / ManifestStore.FILENAME)
+        cleanup.callback(ctx.manifest.close)
+        if inputs.diff_with and inputs.diff_patch and Path(inputs.diff_with).parent.resolve() == output_dir.resolve():
+            # re-crawling in place: pages are overwritten, so their old output is copied aside first
+            # (a copy left by an interrupted run is kept: it still matches the manifest diffed against)
+            ctx.diff_baseline = output_dir / DIFF_BASELINE_DIRNAME
+        # Files and near-duplicate originals written by earlier (or interrupted) runs
+        ctx.paths = PathRegistry(output_dir)
+        if inputs.dedup:
+            ctx.dedup = SimHashIndex(inputs.dedup_distance)
+        for page in ctx.manifest.records():
+            if page.get('path'):
+                ctx.paths.add(page['url'], page['path'])
+            if ctx.dedup is not None and page.get('simhash') is not None and not page.get('alias_of'):
+                ctx.dedup.add(page['simhash'], page['url'])
+        if len(ctx.paths):
+            log(f"Path registry: {len(ctx.paths)} files from the manifest")
+        if ctx.dedup is not None and len(ctx.dedup):
+            log(f"Dedup index: {len(ctx.dedup)} pages from the manifest")
+        # 3.4 robots.txt: every host's rules are fetched once, on first use, and kept across runs
+        if inputs.respect_robots:
+            ctx.robots = RobotsCache.load(output_dir / RobotsCache.FILENAME, inputs.robots_ttl)
+            # The start host's Crawl-delay also paces the sitemap fetches
+            await ctx.robots.rules(client, inputs.url, ctx)
+        if inputs.download_images or inputs.download_assets:
+            ctx.assets = AssetStore.load(output_dir, inputs.max_page_mb * 1024 * 1024 or None)
+            if ctx.assets.entries:
+                log(f"Asset cache: {len(ctx.assets.entries)} URLs from earlier runs")
+        if inputs.sqlite_db:
+            ctx.sqlite = SQLiteSink(Path(inputs.sqlite_db), fts=inputs.sqlite_fts)
+            await ctx.sqlite.start()
+            cleanup.push_async_callback(ctx.sqlite.close)
+        if inputs.s3_bucket:
+            if boto3:
+                ctx.uploader = S3Uploader(inputs.s3_bucket, inputs.s3_prefix, inputs.s3_concurrency, inputs.s3_endpoint_url)
+                ctx.uploader.start()
+                cleanup.push_async_callback(ctx.uploader.close)
+            else:
+                log("boto3 not installed, skipping S3 upload")
+        # Crawl state is never archived
+        crawl_state_files = {checkpoint_path.name, ValidatorStore.FILENAME, ManifestStore.FILENAME, SeenFilter.FILENAME,
+                             CrawlJournal.DIRNAME, Frontier.DIRNAME, AssetStore.FILENAME,
+                             RobotsCache.FILENAME, DIFF_BASELINE_DIRNAME}
+        if inputs.create_archive:
+            if inputs.create_archive in ARCHIVE_SUFFIXES:
+                archive_root = output_dir.name if inputs.create_archive == 'zip' else domain
+                archive_path = output_dir.with_name(f"{domain}{ARCHIVE_SUFFIXES[inputs.create_archive]}")
+                ctx.archive = ArchiveWriter(archive_path, inputs.create_archive, archive_root)
+                ctx.archive.start()
+                cleanup.push_async_callback(ctx.archive.abort)  # a no-op once the archive is published
+            else:
+                log(f"Unsupported archive type: {inputs.create_archive}")
         
-        if HAS_BLOOM:
-            processed_set = BloomFilter(capacity=100000, error_rate=0.001)
-        else:
+        # Seen-URL filter: sized from the page budget, grows with the frontier, reloaded on resume
+        journal = CrawlJournal(output_dir / CrawlJournal.DIRNAME)
+        cleanup.callback(journal.close)
+        seen_path = output_dir / SeenFilter.FILENAME
+        processed_set = None
+        if inputs.seen_filter == "set":
             processed_set = set()
+        elif seen_path.exists() and (checkpoint or journal.segment_count):
+            try:
+                processed_set = SeenFilter.load(seen_path)
+                log(f"Loaded seen filter: {len(processed_set)} URLs")
+            except Exception as e:
+                log(f"Failed to load seen filter: {e}")
+        if processed_set is None:
+            processed_set = SeenFilter(initial_capacity=max(1024, min(inputs.max_pages, SEEN_FILTER_MAX_INITIAL_CAPACITY)))
             
         failed_set = set()
         skipped_set = set()
@@ -1091,44 +4918,184 @@ async def async_main(inputs: InputModel):
         
         if checkpoint:
 
+            # Lists are only present in checkpoints written before the journal (version < 3)
             for u in checkpoint.processed_urls:
                 processed_set.add(u)
             failed_set = set(checkpoint.failed_urls)
             skipped_set = set(checkpoint.skipped_urls)
             total_processed = checkpoint.total_processed
             start_time = checkpoint.started_at
+
+        # Replay the journal of an interrupted run, then keep appending to it
+        journal_state = journal.replay()
+        resumed = bool(checkpoint or journal_state)
+        if journal_state:
+            for u, status in journal_state.items():
+                if status == "failed":
+                    failed_set.add(u)
+                else:
+                    processed_set.add(u)
+                    if status == "skipped":
+                        skipped_set.add(u)
+            # The journal can be ahead of the last checkpoint
+            total_processed = max(total_processed, sum(1 for status in journal_state.values() if status == "success"))
+            log(f"Resumed from journal: {len(journal_state)} URLs")
+            if journal.segment_count > 1:
+                journal.compact(journal_state)
+
+        # jsonl/parquet: pages become records in dataset shards instead of files
+        if inputs.output_format.lower() in DATASET_FORMATS:
+            def journal_durable(urls: List[str]):
+                for u in urls:
+                    journal.append(u, "success")
+
+            async def add_shard(path: Path):
+                relative = path.relative_to(output_dir)
+                if ctx.archive:
+                    await ctx.archive.add_file(path, relative)
+                if ctx.uploader:
+                    await ctx.uploader.submit(path, relative)
+
+            ctx.dataset = DatasetWriter(output_dir / DatasetWriter.DIRNAME, inputs.output_format.lower(),
+                                        shard_bytes=inputs.shard_size_mb * 1024 * 1024,
+                                        on_durable=journal_durable, on_shard=add_shard)
+            # A fresh crawl replaces the dataset; --update and resumed runs add shards after the existing ones
+            clear_dataset = not (resumed or inputs.update)
+            if clear_dataset:
+                ctx.manifest.clear()
+                ctx.paths = PathRegistry(output_dir)
+                if ctx.dedup is not None:
+                    ctx.dedup = SimHashIndex(inputs.dedup_distance)
+            await ctx.dataset.start(clear=clear_dataset)
+            cleanup.push_async_callback(ctx.dataset.close)
+            for u in ctx.dataset.recovered:
+                if journal_state.get(u) != "success":
+                    journal.append(u, "success")
+                    processed_set.add(u)
+                    failed_set.discard(u)
+                    total_processed += 1
+        del journal_state
+
+        def record(url: str, status: str, journaled: bool = True):
+            """
+            Apply a URL's terminal status to the in-memory sets and the journal.
+            A page written to dataset shards is journaled by the DatasetWriter once it is on disk.
+            """
+            if status == "failed":
+                failed_set.add(url)
+            else:
+                failed_set.discard(url)
+                processed_set.add(url)
+                if status == "skipped":
+                    skipped_set.add(url)
+            if journaled:
+                journal.append(url, status)
             
-        # 4. Fetch sitemap
-        response = await fetch_with_retry(client, sitemap_url, inputs.rate_limit)
-        if not response:
-            print(json.dumps(OutputModel(status="error", error=f"Failed to fetch sitemap").model_dump()))
-            return
-            
-        xml_content = response.text
-        is_sitemap_index = '<sitemapindex' in xml_content.lower()
-        
-        urls_to_process = []
-        if is_sitemap_index:
-            child_sitemaps = extract_sitemap_index(xml_content)
-            for child_url in child_sitemaps:
-                child_res = await fetch_with_retry(client, child_url, inputs.rate_limit, timeout_sec=inputs.timeout)
-                if child_res:
-                    for url, meta in stream_sitemap_urls(child_res.text):
-                        urls_to_process.append({'url': url, 'meta': meta})
-        else:
-            for url, meta in stream_sitemap_urls(xml_content):
-                urls_to_process.append({'url': url, 'meta': meta})
-                
-        log(f"Found {len(urls_to_process)} URLs total")
-        if inputs.max_pages < len(urls_to_process):
-            log(f"Limiting to {inputs.max_pages} pages")
-            urls_to_process = urls_to_process[:inputs.max_pages]
-        
-        # 5. Process in Batches
-        semaphore = asyncio.Semaphore(inputs.concurrency)
-        total_urls_count = len(urls_to_process)
-        
+        # 4. Stream sitemap into the frontier; workers start on the first entries
+        # while the rest of the sitemap is still downloading. Queued URLs past the
+        # memory budget spill to disk instead of stalling the sitemap stream.
+        frontier = Frontier(output_dir / Frontier.DIRNAME, inputs.frontier_memory_mb * 1024 * 1024, inputs.batch_size)
+        root_stream = SitemapStream(client, sitemap_url, inputs.timeout, ctx)
+        is_sitemap_index = False
+        total_urls_count = 0
+        filtered_count = 0
+        # URLs in the frontier, in a worker or waiting for a retry; the pool stops when
+        # the sitemap is exhausted and this drops to zero
+        outstanding = 0
+        producer_done = False
+
+        def finish_if_idle():
+            if producer_done and outstanding == 0:
+                frontier.put_nowait(None)
+
+        async def enqueue(loc: str, meta: dict) -> bool:
+            nonlocal total_urls_count, filtered_count, outstanding
+            # Phase 1 Filtering: rejected URLs never enter the frontier or count toward --max-pages
+            if not matcher(loc, meta):
+                filtered_count += 1
+                return True
+            if total_urls_count >= inputs.max_pages:
+                return False
+            total_urls_count += 1
+            outstanding += 1
+            if ctx.paths and not ctx.dataset:
+                # Known before any page is written, so contested names go the same way every crawl
+                ctx.paths.reserve(loc, sanitize_filename(loc).with_suffix('.md'))
+            await frontier.put({'url': loc, 'meta': meta})
+            return True
+
+        async def produce():
+            nonlocal is_sitemap_index, producer_done
+            try:
+                # Child sitemaps are expanded concurrently while the index itself is still streaming
+                fanout = SitemapFanout(client, enqueue, inputs.sitemap_concurrency, inputs.timeout, ctx=ctx)
+                fanout.mark_seen(sitemap_url)
+                try:
+                    async for kind, loc, meta in root_stream:
+                        if kind == 'sitemap':
+                            is_sitemap_index = True
+                            fanout.add(loc)
+                        elif not await enqueue(loc, meta):
+                            fanout.stopped = True
+                            break
+                    await fanout.join()
+                finally:
+                    await fanout.close()
+
+                if is_sitemap_index:
+                    log(f"Expanded {fanout.expanded} child sitemaps ({len(fanout.failed)} failed)")
+                if total_urls_count >= inputs.max_pages:
+                    log(f"Limiting to {inputs.max_pages} pages")
+                if filtered_count:
+                    log(f"Filtered out {filtered_count} URLs")
+                log(f"Found {total_urls_count} URLs total")
+            except Exception as e:
+                log(f"Sitemap streaming error: {e}")
+            # End-of-stream marker once in-flight pages and pending retries are done (not sent on cancellation)
+            producer_done = True
+            finish_if_idle()
+
+        # Failed pages go back into the frontier after a per-URL exponential delay,
+        # so retries overlap with fresh work instead of running serially at the end
+        loop = asyncio.get_running_loop()
+        retry_attempts: Dict[str, int] = {}
+        retry_timers: Set[asyncio.TimerHandle] = set()
+
+        def schedule_retry(entry: Dict[str, Any], deferred: bool = False, not_before: float = 0) -> bool:
+            nonlocal outstanding
+            url = entry['url']
+            attempt = retry_attempts.get(url, 0)
+            if deferred and not ctx.breaker.exhausted(url):
+                # The host is cooling down (or its probe is still out): wait for it
+                # without using up the page's retries
+                delay = ctx.breaker.retry_after(url) + random.uniform(0, 1)
+                log(f"Deferring {url} for {delay:.1f}s (circuit open)")
+            elif attempt >= inputs.page_retries:
+                return False
+            else:
+                retry_attempts[url] = attempt + 1
+                delay = max(not_before, exponential_backoff(attempt, RETRY_BASE_DELAY_SEC, RETRY_MAX_DELAY_SEC))
+                log(f"Retrying {url} in {delay:.1f}s (attempt {attempt + 1}/{inputs.page_retries})")
+
+            def release():
+                retry_timers.discard(timer)
+                frontier.put_nowait(entry)
+
+            outstanding += 1
+            timer = loop.call_later(delay, release)
+            retry_timers.add(timer)
+            return True
+
+        # 5. Process with a pool of long-lived workers
         async def worker(entry):
+            nonlocal outstanding
+            try:
+                await handle_entry(entry)
+            finally:
+                outstanding -= 1
+                finish_if_idle()
+
+        async def handle_entry(entry):
             nonlocal total_processed
             
             url = entry['url']
@@ -1144,51 +5111,55 @@ async def async_main(inputs: InputModel):
 
             # ... processing logic ...
 
-            
-            # Phase 1 Filtering
-            if not should_process_url(url, meta, inputs):
-                log(f"Filtered out: {url}")
-                # We mark as skipped but also processed so we don't retry or anything
-                skipped_set.add(url)
-                processed_set.add(url)
-                return
-            
             # Phase 3 robots.txt check
-            if rp and not rp.can_fetch(USER_AGENT, url):
-                log(f"Blocked by robots.txt: {url}")
-                skipped_set.add(url)
-                processed_set.add(url)
+            if ctx.robots and not await ctx.robots.allowed(client, url, ctx):
+                wait = ctx.robots.retry_after(url)
+                if wait is None:
+                    log(f"Blocked by robots.txt: {url}")
+                    record(url, "skipped")
+                elif not schedule_retry(entry, not_before=wait + random.uniform(0, 1)):
+                    # the host's robots.txt stayed unreachable (RFC 9309: complete disallow)
+                    log(f"robots.txt unreachable, giving up on {url}")
+                    record(url, "failed")
                 return
 
-            # Update Mode Logic
-            if inputs.update:
-                rel_path = sanitize_filename(url)
-                rel_path = resolve_collision(output_dir, rel_path)
-                file_path = output_dir / rel_path
+            # Update Mode Logic: sitemap lastmod first, otherwise process_url revalidates with a conditional GET
+            if inputs.update and meta.get('lastmod'):
+                file_path = ctx.validators.output_path(url, output_dir)
+                if file_path is None and ctx.paths.lookup(url):
+                    file_path = output_dir / ctx.paths.lookup(url)
+                if file_path is None:
+                    file_path = output_dir / sanitize_filename(url).with_suffix('.md')
                 
-                if file_path.exists() and meta.get('lastmod'):
+                if file_path.exists():
                     try:
                         lastmod_dt = date_parser.parse(meta['lastmod']).replace(tzinfo=None)
                         file_mtime = datetime.fromtimestamp(file_path.stat().st_mtime)
                         if lastmod_dt <= file_mtime:
-                            processed_set.add(url)
-                            skipped_set.add(url)
+                            if ctx.archive and not ctx.dataset:
+                                await ctx.archive.add_file(file_path, file_path.relative_to(output_dir))
+                            record(url, "skipped")
                             return
                     except Exception:
                         pass
             
-            async with semaphore:
-                await rate_limit_sleep(inputs.rate_limit / inputs.concurrency) # Shared rate limit approx
-                status = await process_url(client, url, output_dir, inputs)
+            if ctx.concurrency:
+                async with ctx.concurrency.slot():
+                    status = await process_url(client, url, output_dir, inputs, ctx, meta)
+            else:
+                status = await process_url(client, url, output_dir, inputs, ctx, meta)
                 
-            if status == "success":
-                processed_set.add(url)
-                total_processed += 1
-            elif status == "failed":
-                failed_set.add(url)
-            elif status == "skipped":
-                skipped_set.add(url)
-                processed_set.add(url)
+            if status == "deferred":
+                # a circuit fail-fast is only a failure once the host is given up on
+                if not schedule_retry(entry, deferred=True):
+                    record(url, "failed")
+            else:
+                record(url, "failed" if status == "unavailable" else status,
+                       journaled=not (status == "success" and ctx.dataset))
+                if status == "success":
+                    total_processed += 1
+                elif status == "unavailable":
+                    schedule_retry(entry)
                 
             # Phase 4.1: Progress reporting (approximate, every N items or time based?)
             # Doing it inside worker might be noisy. Better to do it after batch or periodically.
@@ -1210,109 +5181,172 @@ async def async_main(inputs: InputModel):
                     eta_sec=eta,
                     current_url=url
                 )
+                if ctx.concurrency:
+                    stats.concurrency = ctx.concurrency.limit
+                    stats.concurrency_history = list(ctx.concurrency.history)
+                    stats.host_stats = ctx.concurrency.hosts
+                stats.transport = transport.stats.summary()
                 if inputs.progress_file:
                      write_progress(output_dir / inputs.progress_file, stats)
                 if inputs.metrics_file:
                      write_prometheus_metrics(output_dir / inputs.metrics_file, stats)
 
-        # Batch processing
-        batch_size = inputs.batch_size
-        
-        try:
-            for i in range(0, len(urls_to_process), batch_size):
+        def build_checkpoint() -> Checkpoint:
+            return Checkpoint(
+                started_at=start_time,
+                last_updated=datetime.now(timezone.utc).isoformat(),
+                source_url=inputs.url,
+                sitemap_type="index" if is_sitemap_index else "single",
+                total_processed=total_processed
+            )
 
-                if total_processed >= inputs.max_pages:
-                    break
-                    
-                batch = urls_to_process[i:i+batch_size]
-                await asyncio.gather(*[worker(entry) for entry in batch])
-                
-                # Checkpoint after batch
-                cp = Checkpoint(
-                    started_at=start_time,
-                    last_updated=datetime.now(timezone.utc).isoformat(),
-                    source_url=inputs.url,
-                    sitemap_type="index" if is_sitemap_index else "single",
-                    processed_urls=list(processed_set) if not HAS_BLOOM else [], # Bloom can't dump easily
-                    failed_urls=list(failed_set),
-                    skipped_urls=list(skipped_set),
-                    total_processed=total_processed
-                )
-                save_checkpoint(str(checkpoint_path), cp)
-                
+        def save_state():
+            # O(1): URL statuses are already in the journal
+            journal.sync()
+            if isinstance(processed_set, SeenFilter) and processed_set.dirty:
+                processed_set.dump(seen_path)
+            save_checkpoint(str(checkpoint_path), build_checkpoint())
+            ctx.validators.save()
+            if ctx.assets:
+                ctx.assets.save()
+            if ctx.robots:
+                ctx.robots.save()
+
+        async def checkpoint_loop():
+            # Time-based, so checkpoint cost is independent of queue or batch boundaries
+            while True:
+                await asyncio.sleep(max(0.1, inputs.checkpoint_interval))
+                save_state()
+
+        # Persistent worker pool: each worker refills from the queue as soon as it is free
+        # CPU-bound conversion runs in worker processes so the event loop only does I/O
+        convert_workers = (os.cpu_count() or 1) if inputs.convert_workers is None else inputs.convert_workers
+        if convert_workers > 0:
+            # spawn: forking a process that already runs threads (aiofiles, DNS) is unsafe
+            ctx.executor = ProcessPoolExecutor(max_workers=convert_workers, mp_context=multiprocessing.get_context("spawn"))
+            cleanup.callback(ctx.executor.shutdown, cancel_futures=True)
+
+        # With --concurrency auto the pool is sized for the upper bound and the controller gates in-flight work
+        pool = WorkerPool(frontier, worker, ctx.concurrency.max_limit if ctx.concurrency else inputs.concurrency)
+        producer = asyncio.create_task(produce())
+        checkpointer = asyncio.create_task(checkpoint_loop())
+
+        try:
+            await pool.run()
+            save_state()
         except asyncio.CancelledError:
              log("Cancelled - saving checkpoint")
-             # logic in finally block?
-             
-        # Retry Failures
-        if failed_set:
-            log(f"Retrying {len(failed_set)} failures")
-            retry_list = list(failed_set)
-            failed_set.clear()
-            # Simple retry without concurrency for safety? Or same worker
-            for url in retry_list:
-                # Re-use worker logic roughly... simplified here
-                status = await process_url(client, url, output_dir, inputs)
-                if status == "success":
-                    processed_set.add(url)
-                    total_processed += 1
-                else:
-                    failed_set.add(url)
-                    
-        # Finalize
-        # Collect content hashes for diff detection
-        url_to_hash = {}
-        for root, dirs, files in os.walk(output_dir):
-            for file in files:
-                if file.endswith(".md") and not file.startswith("_"):
-                    path = Path(root) / file
-                    try:
-                        content = path.read_text(encoding="utf-8")
-                        # Extract URL from frontmatter
-                        if content.startswith("---"):
-                            parts = content.split("---", 2)
-                            if len(parts) >= 3:
-                                frontmatter = parts[1]
-                                for line in frontmatter.splitlines():
-                                    if line.startswith("url:"):
-                                        url = line.split("url:", 1)[1].strip()
-                                        # Hash the markdown content (exclude frontmatter)
-                                        md_content = parts[2] if len(parts) > 2 else content
-                                        content_hash = hashlib.md5(md_content.encode()).hexdigest()
-                                        url_to_hash[url] = content_hash
-                                        break
-                    except Exception:
-                        pass
+             save_state()
+        finally:
+            for task in (producer, checkpointer):
+                task.cancel()
+            for timer in retry_timers:
+                timer.cancel()
+            await asyncio.gather(producer, checkpointer, return_exceptions=True)
+            frontier.close()
+            if frontier.spilled:
+                log(f"Frontier spilled {frontier.spilled} URLs to disk ({len(frontier.hosts)} hosts)")
+
+        if root_stream.failed:
+            print(json.dumps(OutputModel(status="error", error=f"Failed to fetch sitemap").model_dump()))
+            return
+
+        if retry_attempts:
+            log(f"Retried {len(retry_attempts)} URLs, {len(failed_set)} still failing")
+        if ctx.breaker.trips:
+            log(f"Circuit breaker tripped {ctx.breaker.trips} times")
+        if ctx.robots:
+            ctx.robots.save()
+            log(f"robots.txt: {len(ctx.robots.entries)} hosts cached, {ctx.robots.fetched} fetched")
+        if ctx.assets:
+            ctx.assets.save()
+            asset_stats = ctx.assets.stats()
+            log(f"Assets: {asset_stats['downloaded']} downloaded, {asset_stats['cached']} cached, "
+                f"{asset_stats['shared']} shared content, {asset_stats['failed']} failed")
+        reuse = transport.stats.summary()
+        log(f"Transport: {reuse['requests']} requests over {reuse['connections']} connections "
+            f"(reuse {reuse['reuse_ratio']:.0%}, {reuse['http_versions']})")
+
+        if ctx.executor:
+            ctx.executor.shutdown()
+        if ctx.dataset:
+            await ctx.dataset.close()
+        if ctx.sqlite:
+            await ctx.sqlite.close()
+        if ctx.uploader:
+            await ctx.uploader.close()
+        ctx.validators.save()
+
+        # Finalize: page entries were recorded as they were written.
+        # They are sorted by URL on disk, so diffing and stats stream in constant memory.
+        ctx.manifest.close()
+        sorted_manifest = output_dir / MANIFEST_SORTED_FILENAME
+        new_sorted = sorted_manifest.with_name(sorted_manifest.name + '.new')
+        page_count = await asyncio.to_thread(external_sort_jsonl, ctx.manifest.records(), new_sorted)
+
+        # Phase 4.3: Diff Report (before the previous sorted manifest is replaced)
+        diff_data = None
+        if inputs.diff_with:
+            try:
+                old_pages, old_algorithm, old_root = open_manifest_pages(Path(inputs.diff_with))
+                diff_data = await asyncio.to_thread(
+                    stream_manifest_diff, old_pages, iter_sorted_manifest(new_sorted), output_dir / DIFF_FILENAME,
+                    hashes_comparable=old_algorithm == ManifestStore.HASH_ALGORITHM,
+                    patch_path=output_dir / DIFF_PATCH_FILENAME if inputs.diff_patch else None,
+                    old_root=old_root, new_root=output_dir, baseline_root=ctx.diff_baseline)
+                log(f"Diff calculated: {diff_data['stats']} -> {diff_data['output']}")
+            except Exception as e:
+                log(f"Failed to diff against manifest: {e}")
+            if ctx.diff_baseline:
+                shutil.rmtree(ctx.diff_baseline, ignore_errors=True)
+
+        os.replace(new_sorted, sorted_manifest)
+        ctx.manifest.compact(iter_sorted_manifest(sorted_manifest))
+        total_bytes = total_tokens = duplicates = 0
+        pages = {} if page_count <= MANIFEST_INLINE_PAGES else None
+        for page in iter_sorted_manifest(sorted_manifest):
+            total_bytes += page['size']
+            total_tokens += page['tokens']
+            if page.get('alias_of'):
+                duplicates += 1
+            if pages is not None:
+                pages[page.pop('url')] = page
         
         manifest = {
-            "version": "1.0",
+            "version": "1.2",
             "crawl_date": get_now_str(),
             "source_url": inputs.url,
+            "output_format": inputs.output_format.lower(),
             "statistics": {
                 "total_processed": total_processed,
                 "failed": len(failed_set),
-                "skipped": len(skipped_set)
+                "skipped": len(skipped_set),
+                "pages": page_count,
+                "total_bytes": total_bytes,
+                "total_tokens": total_tokens,
+                "duplicates": duplicates
             },
             "failed_urls": list(failed_set),
             "skipped_urls": list(skipped_set),
-            "url_content_hashes": url_to_hash
+            "hash_algorithm": ManifestStore.HASH_ALGORITHM,
+            "pages_file": MANIFEST_SORTED_FILENAME,
+            "seen_filter": processed_set.stats() if isinstance(processed_set, SeenFilter) else {"type": "set", "count": len(processed_set)},
+            "transport": transport.stats.summary()
         }
+        if ctx.assets:
+            manifest["assets"] = ctx.assets.stats()
+        if ctx.sqlite:
+            manifest["sqlite"] = ctx.sqlite.stats()
+        if pages is not None:
+            manifest["url_content_hashes"] = {url: page['hash'] for url, page in pages.items()}
+            manifest["pages"] = pages
+        else:
+            log(f"{page_count} pages: per-page entries are only in {MANIFEST_SORTED_FILENAME}")
         
         manifest_path = output_dir / "_manifest.json"
         with open(manifest_path, 'w', encoding='utf-8') as f:
             json.dump(manifest, f, indent=2)
 
-        # Phase 4.3: Diff Report
-        diff_data = None
-        if inputs.diff_with:
-            try:
-                with open(inputs.diff_with, 'r', encoding='utf-8') as f:
-                    old_manifest = json.load(f)
-                diff_data = calculate_diff(old_manifest, manifest)
-                log(f"Diff calculated: {diff_data['stats']}")
-            except Exception as e:
-                log(f"Failed to load diff manifest: {e}")
-
         # Phase 4.2: HTML Report
         if inputs.html_report:
             # Pass diff_data to report generator
@@ -1340,6 +5374,9 @@ async def async_main(inputs: InputModel):
                  # Let's skip global TOC for now or do it post-merge?
                  pass
             
+            if ctx.dataset:
+                for page in iter_dataset(ctx.dataset.directory, columns=['path', 'markdown']):
+                    full_content.append(f"\n\n---\n\n<!-- Page: {page['path']} -->\n\n{page['markdown']}")
             for root, dirs, files in os.walk(output_dir):
                 for file in files:
                     if file.endswith(".md") and not file.startswith("_"):
@@ -1352,9 +5389,12 @@ async def async_main(inputs: InputModel):
             
             (output_dir / "_merged.md").write_text("".join(full_content), encoding="utf-8")
         
-        # Phase 5.2: Archive
-        if inputs.create_archive:
-            create_archive(output_dir, inputs.create_archive, domain)
+        # Phase 5.2: Archive (pages were appended as they were written)
+        if ctx.archive:
+            if resumed:
+                # pages finished before the restart are only on disk
+                await ctx.archive.add_missing(output_dir, crawl_state_files)
+            await ctx.archive.close(output_dir, crawl_state_files)
 
         # Phase 6: llms.txt
         if inputs.ai_manifest:
@@ -1422,6 +5462,8 @@ async def async_main(inputs: InputModel):
         
         if os.path.exists(checkpoint_path):
             os.remove(checkpoint_path)
+        journal.remove()
+        seen_path.unlink(missing_ok=True)
 
 @app.command()
 def main(
@@ -1429,40 +5471,63 @@ def main(
     output: Optional[str] = typer.Option(None, "--output", "-o"),
     rate_limit: float = typer.Option(DEFAULT_RATE_LIMIT),
     batch_size: int = typer.Option(DEFAULT_BATCH_SIZE),
+    frontier_memory_mb: int = typer.Option(DEFAULT_FRONTIER_MEMORY_MB, "--frontier-memory-mb", help="Memory for queued URLs before spilling to disk"),
+    checkpoint_interval: float = typer.Option(DEFAULT_CHECKPOINT_INTERVAL_SEC, "--checkpoint-interval", help="Seconds between checkpoints"),
+    page_retries: int = typer.Option(DEFAULT_PAGE_RETRIES, "--page-retries", help="Delayed retries of a failed page"),
+    breaker_threshold: int = typer.Option(DEFAULT_BREAKER_THRESHOLD, "--breaker-threshold", help="Consecutive host failures that open its circuit"),
+    breaker_cooldown: float = typer.Option(DEFAULT_BREAKER_COOLDOWN_SEC, "--breaker-cooldown", help="Seconds to leave a failing host alone"),
     update: bool = typer.Option(False, "--update"),
     max_pages: int = typer.Option(10000),
-    concurrency: int = typer.Option(5, "--concurrency"),
+    seen_filter: str = typer.Option("bloom", "--seen-filter", help=f"Seen-URL tracking: {' or '.join(SEEN_FILTER_KINDS)}"),
+    concurrency: str = typer.Option(str(DEFAULT_CONCURRENCY), "--concurrency", help="Concurrent requests, or 'auto' to adapt to latency/errors"),
+    min_concurrency: int = typer.Option(DEFAULT_MIN_CONCURRENCY, "--min-concurrency", help="Lower bound for --concurrency auto"),
+    max_concurrency: int = typer.Option(DEFAULT_MAX_CONCURRENCY, "--max-concurrency", help="Upper bound for --concurrency auto"),
+    sitemap_concurrency: int = typer.Option(DEFAULT_SITEMAP_CONCURRENCY, "--sitemap-concurrency", help="Concurrent child sitemap fetches"),
     # Phase 1
     include_pattern: Optional[str] = typer.Option(None, "--include-pattern", help="Regex to include"),
     exclude_pattern: Optional[str] = typer.Option(None, "--exclude-pattern", help="Regex to exclude"),
     include_paths: Optional[str] = typer.Option(None, "--include-paths", help="Comma-separated paths to include"),
     exclude_paths: Optional[str] = typer.Option(None, "--exclude-paths", help="Comma-separated paths to exclude"),
     priority_min: Optional[float] = typer.Option(None, "--priority-min", help="Min priority"),
-    changefreq: Optional[str] = typer.Option(None, "--changefreq", help="Specific changefreq"),
+    changefreq: Optional[str] = typer.Option(None, "--changefreq", help="Changefreq values to include (comma-separated)"),
+    filter_dry_run: bool = typer.Option(False, "--filter-dry-run", help="Count URLs passing the filters without fetching"),
     # Phase 2
     extract_main: bool = typer.Option(False, "--extract-main", help="Use Readability for main content"),
     download_images: bool = typer.Option(False, "--download-images", help="Download images locally"),
     pdf_support: bool = typer.Option(False, "--pdf-support", help="Convert PDFs"),
+    max_page_mb: int = typer.Option(DEFAULT_MAX_PAGE_MB, "--max-page-mb", help="Skip pages larger than this (0 = no limit)"),
     content_selector: Optional[str] = typer.Option(None, "--content-selector", help="CSS for main content"),
     strip_selector: Optional[str] = typer.Option(None, "--strip-selector", help="CSS to strip"),
     download_assets: bool = typer.Option(False, "--download-assets", help="Download CSS/JS"),
+    convert_workers: Optional[int] = typer.Option(None, "--convert-workers", help="Conversion processes (default: CPU count, 0 = inline)"),
+    parser_backend: str = typer.Option("lxml", "--parser-backend", help=f"HTML parser: {', '.join(PARSER_BACKENDS)}"),
+    dedup: bool = typer.Option(False, "--dedup", help="Skip near-duplicate pages, recording them as aliases"),
+    dedup_distance: int = typer.Option(DEFAULT_DEDUP_DISTANCE, "--dedup-distance", help="Max differing SimHash bits"),
     # Phase 3
     proxy: Optional[str] = typer.Option(None, "--proxy", help="Proxy URL"),
     headers: Optional[str] = typer.Option(None, "--headers", help="Custom headers JSON"),
     respect_robots: bool = typer.Option(False, "--respect-robots", help="Respect robots.txt"),
+    robots_ttl: float = typer.Option(ROBOTS_TTL_SEC, "--robots-ttl", help="Seconds before a cached robots.txt is fetched again"),
     timeout: int = typer.Option(30, "--timeout", help="Request timeout"),
+    http2: bool = typer.Option(False, "--http2", help="Use HTTP/2 when the server supports it (needs h2)"),
+    max_connections_per_host: int = typer.Option(DEFAULT_CONNECTIONS_PER_HOST, "--max-connections-per-host", help="Requests in flight per host (0 = no cap)"),
     # Phase 4
     progress_file: str = typer.Option("_progress.json", "--progress-file", help="Progress file name"),
     html_report: bool = typer.Option(False, "--html-report", help="Generate HTML report"),
     diff_with: Optional[str] = typer.Option(None, "--diff-with", help="Path to manifest to diff"),
+    diff_patch: bool = typer.Option(False, "--diff-patch", help="Write unified diffs of changed pages"),
     notify_webhook: Optional[str] = typer.Option(None, "--notify-webhook", help="Webhook URL"),
     metrics_file: Optional[str] = typer.Option(None, "--metrics-file", help="Prometheus metrics file"),
     # Phase 5
-    output_format: str = typer.Option("markdown", "--output-format", help="Output format"),
-    create_archive: Optional[str] = typer.Option(None, "--create-archive", help="zip or tar.gz"),
+    output_format: str = typer.Option("markdown", "--output-format", help="markdown, json, html, text, jsonl or parquet"),
+    shard_size_mb: int = typer.Option(DEFAULT_SHARD_SIZE_MB, "--shard-size-mb", help="Rotate jsonl/parquet shards at this size"),
+    create_archive: Optional[str] = typer.Option(None, "--create-archive", help="zip, tar.gz or tar.zst"),
     sqlite_db: Optional[str] = typer.Option(None, "--sqlite-db", help="SQLite DB path"),
+    sqlite_fts: bool = typer.Option(False, "--sqlite-fts", help="Full-text index (FTS5) in the SQLite DB"),
     s3_bucket: Optional[str] = typer.Option(None, "--s3-bucket", help="S3 bucket"),
     s3_prefix: Optional[str] = typer.Option(None, "--s3-prefix", help="S3 prefix"),
+    s3_endpoint_url: Optional[str] = typer.Option(None, "--s3-endpoint-url", help="S3-compatible endpoint (e.g. MinIO)"),
+    s3_concurrency: int = typer.Option(DEFAULT_S3_CONCURRENCY, "--s3-concurrency", help="Concurrent S3 uploads"),
     single_file: bool = typer.Option(False, "--single-file", help="Merge into one file"),
     # Phase 6
     summarize: bool = typer.Option(False, "--summarize", help="AI summary"),
@@ -1479,13 +5544,24 @@ def main(
         return
         
     try:
+        adaptive_concurrency = concurrency.strip().lower() == "auto"
         inputs = InputModel(
             url=url, 
             rate_limit=rate_limit, 
             batch_size=batch_size, 
+            frontier_memory_mb=frontier_memory_mb,
+            checkpoint_interval=checkpoint_interval,
+            page_retries=page_retries,
+            breaker_threshold=breaker_threshold,
+            breaker_cooldown=breaker_cooldown,
             update=update, 
             max_pages=max_pages,
-            concurrency=concurrency,
+            seen_filter=seen_filter,
+            concurrency=DEFAULT_CONCURRENCY if adaptive_concurrency else int(concurrency),
+            adaptive_concurrency=adaptive_concurrency,
+            min_concurrency=min_concurrency,
+            max_concurrency=max_concurrency,
+            sitemap_concurrency=sitemap_concurrency,
             output_dir=output,
             include_pattern=include_pattern,
             exclude_pattern=exclude_pattern,
@@ -1493,26 +5569,40 @@ def main(
             exclude_paths=exclude_paths,
             priority_min=priority_min,
             changefreq=changefreq,
+            filter_dry_run=filter_dry_run,
             extract_main=extract_main,
             download_images=download_images,
             pdf_support=pdf_support,
+            max_page_mb=max_page_mb,
             content_selector=content_selector,
             strip_selector=strip_selector,
             download_assets=download_assets,
+            convert_workers=convert_workers,
+            parser_backend=parser_backend,
+            dedup=dedup,
+            dedup_distance=dedup_distance,
             proxy=proxy,
             headers=headers,
             respect_robots=respect_robots,
+            robots_ttl=robots_ttl,
             timeout=timeout,
+            http2=http2,
+            max_connections_per_host=max_connections_per_host,
             progress_file=progress_file,
             html_report=html_report,
             diff_with=diff_with,
+            diff_patch=diff_patch,
             notify_webhook=notify_webhook,
             metrics_file=metrics_file,
             output_format=output_format,
+            shard_size_mb=shard_size_mb,
             create_archive=create_archive,
             sqlite_db=sqlite_db,
+            sqlite_fts=sqlite_fts,
             s3_bucket=s3_bucket,
             s3_prefix=s3_prefix,
+            s3_endpoint_url=s3_endpoint_url,
+            s3_concurrency=s3_concurrency,
             single_file=single_file,
             summarize=summarize,
             ai_api_key=ai_api_key,
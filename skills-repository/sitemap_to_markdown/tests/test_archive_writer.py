@@ -0,0 +1,76 @@
+import sys
+import tarfile
+import zipfile
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+import sitemap_to_markdown as stm
+
+
+def _names(path: Path, archive_type: str):
+    if archive_type == "zip":
+        with zipfile.ZipFile(path) as z:
+            return sorted(z.namelist())
+    if archive_type == "tar.zst":
+        import zstandard
+        with open(path, "rb") as raw, zstandard.ZstdDecompressor().stream_reader(raw) as reader:
+            with tarfile.open(fileobj=reader, mode="r|") as tar:
+                return sorted(member.name for member in tar)
+    with tarfile.open(path) as tar:
+        return sorted(tar.getnames())
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("archive_type", [
+    "zip",
+    "tar.gz",
+    pytest.param("tar.zst", marks=pytest.mark.skipif(stm.zstandard is None, reason="zstandard not installed")),
+])
+async def test_archive_is_built_incrementally(tmp_path, archive_type):
+    output_dir = tmp_path / "site"
+    output_dir.mkdir()
+    (output_dir / "_manifest.json").write_text("{}")
+    (output_dir / "checkpoint.json").write_text("{}")
+    archive_path = tmp_path / f"site{stm.ARCHIVE_SUFFIXES[archive_type]}"
+
+    writer = stm.ArchiveWriter(archive_path, archive_type, "site")
+    writer.start()
+    await writer.add(Path("docs/a.md"), "# A")
+    await writer.add(Path("docs/b.md"), "# B")
+    await writer.add(Path("docs/a.md"), "# A again")  # first version wins
+    assert not archive_path.exists()  # only published once complete
+    await writer.close(output_dir, exclude={"checkpoint.json"})
+
+    assert archive_path.exists()
+    assert not writer.partial_path.exists()
+    assert _names(archive_path, archive_type) == ["site/_manifest.json", "site/docs/a.md", "site/docs/b.md"]
+
+
+@pytest.mark.asyncio
+async def test_add_missing_picks_up_pages_from_an_earlier_run(tmp_path):
+    output_dir = tmp_path / "site"
+    (output_dir / "docs").mkdir(parents=True)
+    (output_dir / "docs" / "old.md").write_text("# Old")
+    (output_dir / "_journal").mkdir()
+    (output_dir / "_journal" / "segment-000001.jsonl").write_text("")
+
+    writer = stm.ArchiveWriter(tmp_path / "site.zip", "zip", "site")
+    writer.start()
+    await writer.add(Path("docs/new.md"), "# New")
+    await writer.add_missing(output_dir, exclude={"_journal"})
+    await writer.close()
+
+    assert _names(tmp_path / "site.zip", "zip") == ["site/docs/new.md", "site/docs/old.md"]
+
+
+@pytest.mark.asyncio
+async def test_abort_discards_partial_archive(tmp_path):
+    writer = stm.ArchiveWriter(tmp_path / "site.tar.gz", "tar.gz", "site")
+    writer.start()
+    await writer.add(Path("a.md"), "# A")
+    await writer.abort()
+
+    assert not writer.partial_path.exists()
+    assert not (tmp_path / "site.tar.gz").exists()
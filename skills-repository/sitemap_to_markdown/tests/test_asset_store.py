@@ -0,0 +1,137 @@
+import asyncio
+import sys
+from pathlib import Path
+from unittest.mock import Mock
+
+import httpx
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+import sitemap_to_markdown as stm
+
+LOGO = b"\x89PNG\r\n\x1a\n" + b"logo" * 100
+
+PAGE = """<html><head><title>Guide</title><link rel="stylesheet" href="/css/site.css">
+<script src="https://cdn.ex.com/app.js?v=1&amp;x=2"></script></head>
+<body><nav><img src="/nav.png"></nav><main><h1>Guide</h1><p><img src="/img/logo.png" alt="Logo">
+<img src="data:image/gif;base64,R0lGOD"></p></main></body></html>"""
+
+
+@pytest.mark.parametrize("backend", ["lxml", "bs4"])
+def test_convert_document_collects_asset_references(backend):
+    # test_mapping.py swaps bs4 for a mock in sys.modules, which bs4's lazy imports then pick up
+    if backend == "bs4" and (isinstance(sys.modules.get("bs4"), Mock) or isinstance(stm.BeautifulSoup, Mock)):
+        pytest.skip("bs4 is mocked by another test module")
+    options = stm.ConversionOptions(parser_backend=backend, content_selector="main",
+                                    download_images=True, download_assets=True)
+    result = stm.convert_document("https://ex.com/docs/guide", PAGE, "text/html", options)
+
+    assert result["assets"] == [
+        ("/css/site.css", "https://ex.com/css/site.css"),
+        ("https://cdn.ex.com/app.js?v=1&x=2", "https://cdn.ex.com/app.js?v=1&x=2"),
+        ("/img/logo.png", "https://ex.com/img/logo.png"),  # images only from the selected content
+    ]
+    assert "assets" not in stm.convert_document("https://ex.com/", PAGE, "text/html", stm.ConversionOptions())
+
+
+def _client(requests):
+    def handler(request):
+        requests.append(str(request.url))
+        if request.url.path.endswith("missing.png"):
+            return httpx.Response(404)
+        return httpx.Response(200, content=LOGO, headers={"Content-Type": "image/png"})
+    return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+
+@pytest.mark.asyncio
+async def test_assets_are_stored_once_by_content(tmp_path, monkeypatch):
+    monkeypatch.setattr(stm, "exponential_backoff", lambda retry, *args: 0)
+    requests = []
+    store = stm.AssetStore(tmp_path)
+    urls = ["https://ex.com/logo.png", "https://cdn.ex.com/logo-copy"]
+    async with _client(requests) as client:
+        paths = await asyncio.gather(*(store.fetch(client, url) for url in urls * 5))
+        assert await store.fetch(client, "https://ex.com/missing.png") is None
+
+    assert sorted(set(requests)) == sorted(urls + ["https://ex.com/missing.png"])
+    assert all(requests.count(url) == 1 for url in urls)  # one download per URL
+    # the same bytes behind two URLs are stored once; the extension comes from the URL or the Content-Type
+    digest = stm.hashlib.sha256(LOGO).hexdigest()
+    assert set(paths) == {f"_assets/{digest[:2]}/{digest}.png"}
+    assert (tmp_path / paths[0]).read_bytes() == LOGO
+    assert store.stats() == {"downloaded": 1, "cached": 0, "shared": 1, "failed": 1, "files": 1}
+    assert len(list((tmp_path / stm.AssetStore.DIRNAME).rglob("*.*"))) == 1
+
+
+@pytest.mark.asyncio
+async def test_rerun_reuses_cached_assets(tmp_path):
+    requests = []
+    store = stm.AssetStore(tmp_path)
+    async with _client(requests) as client:
+        first = await store.fetch(client, "https://ex.com/logo.png")
+    store.save()
+
+    reloaded = stm.AssetStore.load(tmp_path)
+    async with _client(requests) as client:
+        assert await reloaded.fetch(client, "https://ex.com/logo.png") == first
+    assert len(requests) == 1 and reloaded.cached == 1
+
+
+@pytest.mark.asyncio
+async def test_failed_downloads_are_retried_and_finished_ones_forgotten(tmp_path):
+    attempts = []
+
+    def handler(request):
+        attempts.append(str(request.url))
+        if len(attempts) == 1:
+            return httpx.Response(404)
+        return httpx.Response(200, content=LOGO, headers={"Content-Type": "image/png"})
+
+    store = stm.AssetStore(tmp_path)
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        assert await store.fetch(client, "https://ex.com/logo.png") is None
+        assert not store._tasks
+        path = await store.fetch(client, "https://ex.com/logo.png")  # a later page tries again
+        assert path is not None and not store._tasks
+        assert await store.fetch(client, "https://ex.com/logo.png") == path  # from entries
+
+    assert len(attempts) == 2
+    assert store.stats() == {"downloaded": 1, "cached": 0, "shared": 0, "failed": 1, "files": 1}
+
+
+@pytest.mark.asyncio
+async def test_load_drops_entries_whose_files_are_gone(tmp_path):
+    requests = []
+    store = stm.AssetStore(tmp_path)
+    async with _client(requests) as client:
+        kept = await store.fetch(client, "https://ex.com/logo.png")
+        await store.fetch(client, "https://ex.com/other.gif")
+    store.entries["https://ex.com/gone.png"] = "_assets/00/deleted.png"
+    store.dirty = True
+    store.save()
+
+    reloaded = stm.AssetStore.load(tmp_path)
+    assert set(reloaded.entries) == {"https://ex.com/logo.png", "https://ex.com/other.gif"}
+    assert reloaded.dirty
+    async with _client(requests) as client:
+        assert await reloaded.fetch(client, "https://ex.com/logo.png") == kept
+        assert await reloaded.fetch(client, "https://ex.com/logo.png") == kept
+    assert len(requests) == 2 and reloaded.cached == 1
+
+
+@pytest.mark.asyncio
+async def test_process_url_rewrites_links_to_local_assets(tmp_path):
+    def handler(request):
+        if request.url.path == "/docs/guide":
+            return httpx.Response(200, text=PAGE, headers={"Content-Type": "text/html"})
+        return httpx.Response(200, content=LOGO, headers={"Content-Type": "image/png"})
+
+    ctx = stm.CrawlContext(assets=stm.AssetStore(tmp_path))
+    inputs = stm.InputModel(url="https://ex.com", download_images=True, content_selector="main")
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        assert await stm.process_url(client, "https://ex.com/docs/guide", tmp_path, inputs, ctx) == "success"
+
+    page = (tmp_path / "docs" / "guide.md").read_text()
+    local = ctx.assets.entries["https://ex.com/img/logo.png"]
+    assert f"![Logo](../{local})" in page
+    assert (tmp_path / "docs" / f"../{local}").resolve().read_bytes() == LOGO
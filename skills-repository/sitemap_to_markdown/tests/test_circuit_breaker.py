@@ -0,0 +1,98 @@
+import sys
+import time
+from pathlib import Path
+
+import httpx
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+import sitemap_to_markdown as stm
+
+
+def test_circuit_opens_and_probe_closes_it():
+    breaker = stm.HostCircuitBreaker(threshold=3, cooldown=0.05)
+    url = "https://ex.com/a"
+
+    for _ in range(2):
+        breaker.record(url, False)
+    breaker.record(url, True)  # a success resets the count
+    for _ in range(3):
+        breaker.record(url, False)
+    assert breaker.is_open(url) and not breaker.allow(url)
+    assert 0 < breaker.remaining(url) <= 0.05
+    assert breaker.allow("https://other.org/")
+
+    time.sleep(0.06)
+    assert breaker.allow(url)  # the probe
+    assert not breaker.allow(url)  # only one probe while half-open
+
+    breaker.record(url, True)
+    assert breaker.allow(url) and not breaker.is_open(url) and breaker.trips == 1
+
+
+def test_failed_probe_doubles_the_cooldown():
+    breaker = stm.HostCircuitBreaker(threshold=1, cooldown=0.05)
+    breaker.record("https://ex.com/a", False)
+    time.sleep(0.06)
+    assert breaker.allow("https://ex.com/b")
+    breaker.record("https://ex.com/b", False)
+
+    assert breaker.trips == 2
+    assert breaker.remaining("https://ex.com/a") > 0.05
+    assert breaker._hosts["ex.com"].cooldown == pytest.approx(0.1)
+    assert not breaker.exhausted("https://ex.com/a")
+    breaker._hosts["ex.com"].trips = stm.BREAKER_MAX_TRIPS
+    assert breaker.exhausted("https://ex.com/a")
+
+
+@pytest.mark.asyncio
+async def test_fetch_fails_fast_while_the_circuit_is_open(monkeypatch):
+    monkeypatch.setattr(stm, "exponential_backoff", lambda retry, *args: 0)
+    requests = []
+
+    def handler(request):
+        requests.append(request.url.path)
+        return httpx.Response(503 if request.url.host == "down.com" else 404)
+
+    ctx = stm.CrawlContext(breaker=stm.HostCircuitBreaker(threshold=2, cooldown=60))
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        assert await stm.fetch_with_retry(client, "https://down.com/a", 0, ctx=ctx) is None
+        assert requests == ["/a", "/a"]  # the third attempt was never sent
+        assert await stm.fetch_with_retry(client, "https://down.com/b", 0, ctx=ctx) is None
+        assert requests == ["/a", "/a"]
+
+        # 4xx means the host is up, and asking again will not help
+        with pytest.raises(stm.FetchClientError, match="404"):
+            await stm.fetch_with_retry(client, "https://up.com/x", 0, ctx=ctx)
+        assert requests == ["/a", "/a", "/x"]
+        assert not ctx.breaker.is_open("https://up.com/x")
+
+
+def test_half_open_pages_wait_for_the_probe():
+    breaker = stm.HostCircuitBreaker(threshold=1, cooldown=0.05)
+    url = "https://ex.com/a"
+    breaker.record(url, False)
+    assert 0 < breaker.retry_after(url) <= 0.05
+
+    time.sleep(0.06)
+    assert breaker.retry_after(url) == 0  # the next page goes through as the probe
+    assert breaker.allow(url)
+    assert breaker.retry_after(url) == pytest.approx(0.05)  # the others wait for it to report
+    breaker.record(url, True)
+    assert breaker.retry_after(url) == 0
+
+
+@pytest.mark.asyncio
+async def test_process_url_tells_deferred_from_failed(tmp_path, monkeypatch):
+    monkeypatch.setattr(stm, "exponential_backoff", lambda retry, *args: 0)
+
+    def handler(request):
+        return httpx.Response(503 if request.url.host == "down.com" else 404)
+
+    ctx = stm.CrawlContext(breaker=stm.HostCircuitBreaker(threshold=1, cooldown=60))
+    inputs = stm.InputModel(url="https://up.com")
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        assert await stm.process_url(client, "https://up.com/gone", tmp_path, inputs, ctx) == "failed"
+        assert await stm.process_url(client, "https://down.com/a", tmp_path, inputs, ctx) == "deferred"
+        ctx.breaker = stm.HostCircuitBreaker(threshold=10)
+        assert await stm.process_url(client, "https://down.com/a", tmp_path, inputs, ctx) == "unavailable"
@@ -0,0 +1,53 @@
+import sys
+from pathlib import Path
+
+import httpx
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+import sitemap_to_markdown as stm
+
+PAGE = "<html><head><title>Doc</title></head><body><h1>Hello</h1></body></html>"
+
+
+def test_validator_store_round_trip(tmp_path):
+    store = stm.ValidatorStore(tmp_path / stm.ValidatorStore.FILENAME)
+    store.record("https://ex.com/a", {"ETag": '"v1"', "Last-Modified": "Mon, 01 Jan 2026 00:00:00 GMT"},
+                 Path("a.md"), "markdown")
+    store.save()
+
+    loaded = stm.ValidatorStore.load(tmp_path / stm.ValidatorStore.FILENAME)
+    # no headers while the previous output is missing
+    assert loaded.conditional_headers("https://ex.com/a", tmp_path, "markdown") == {}
+
+    (tmp_path / "a.md").write_text("cached")
+    assert loaded.conditional_headers("https://ex.com/a", tmp_path, "markdown") == {
+        "If-None-Match": '"v1"',
+        "If-Modified-Since": "Mon, 01 Jan 2026 00:00:00 GMT",
+    }
+    # a different output format needs a full fetch
+    assert loaded.conditional_headers("https://ex.com/a", tmp_path, "json") == {}
+
+
+@pytest.mark.asyncio
+async def test_update_revalidates_and_skips_not_modified(tmp_path):
+    seen = []
+
+    def handler(request):
+        seen.append(request.headers.get("If-None-Match"))
+        if request.headers.get("If-None-Match") == '"v1"':
+            return httpx.Response(304)
+        return httpx.Response(200, text=PAGE, headers={"Content-Type": "text/html", "ETag": '"v1"'})
+
+    ctx = stm.CrawlContext(validators=stm.ValidatorStore())
+    inputs = stm.InputModel(url="https://ex.com", update=True)
+
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        assert await stm.process_url(client, "https://ex.com/docs/a", tmp_path, inputs, ctx) == "success"
+        saved = tmp_path / "docs" / "a.md"
+        saved.write_text("untouched")
+        assert await stm.process_url(client, "https://ex.com/docs/a", tmp_path, inputs, ctx) == "skipped"
+
+    assert seen == [None, '"v1"']
+    assert saved.read_text() == "untouched"
+    assert ctx.validators.entries["https://ex.com/docs/a"]["path"] == "docs/a.md"
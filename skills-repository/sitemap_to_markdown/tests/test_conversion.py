@@ -0,0 +1,141 @@
+import json
+import multiprocessing
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from unittest.mock import patch
+
+import httpx
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+import sitemap_to_markdown as stm
+
+HTML = "<html><head><title>Doc</title></head><body><nav>menu</nav><main><h1>Hello</h1><p>World</p></main></body></html>"
+
+
+def test_convert_document_markdown():
+    options = stm.ConversionOptions(strip_selector="nav")
+    result = stm.convert_document("https://ex.com/a", HTML, "text/html", options)
+
+    assert result["suffix"] == ".md"
+    assert result["content"].startswith("---\nurl: https://ex.com/a\n")
+    assert "# Hello" in result["markdown"]
+    assert "menu" not in result["markdown"]
+
+
+def test_convert_document_json():
+    options = stm.ConversionOptions(output_format="json")
+    result = stm.convert_document("https://ex.com/a", HTML, "text/html", options)
+
+    assert result["suffix"] == ".json"
+    data = json.loads(result["content"])
+    assert data["title"] == "Doc"
+    assert "date" in data["metadata"]
+
+
+def test_conversion_options_from_inputs():
+    inputs = stm.InputModel(url="https://ex.com", output_format="text", content_selector="main")
+    options = stm.ConversionOptions.from_inputs(inputs)
+
+    assert options.output_format == "text"
+    assert options.content_selector == "main"
+    with pytest.raises(ValueError, match="parser_backend"):
+        stm.InputModel(url="https://ex.com", parser_backend="html5lib")
+
+
+@pytest.mark.asyncio
+async def test_process_url_converts_in_process_pool(tmp_path):
+    """Conversion results from worker processes are written by the event loop"""
+    inputs = stm.InputModel(url="https://ex.com", content_selector="main")
+    response = httpx.Response(200, text=HTML, headers={"Content-Type": "text/html"},
+                              request=httpx.Request("GET", "https://ex.com/docs/a"))
+    executor = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"))
+    try:
+        with patch.object(stm, "fetch_with_retry", return_value=response):
+            status = await stm.process_url(None, "https://ex.com/docs/a", tmp_path, inputs,
+                                           ctx=stm.CrawlContext(executor=executor))
+    finally:
+        executor.shutdown()
+
+    assert status == "success"
+    content = (tmp_path / "docs" / "a.md").read_text()
+    assert "# Hello" in content
+    assert "menu" not in content
+
+
+RICH_HTML = (
+    "<html><head><title>Rich</title></head><body><nav><a href='/'>Home</a></nav><main>"
+    "<h2>Intro</h2><p>Some <strong>bold</strong> and <a href='https://ex.com/x'>a link</a>.</p>"
+    "<ul><li>one</li><li>two<ul><li>nested</li></ul></li></ul>"
+    "<blockquote><p>quoted</p></blockquote>"
+    "<pre><code class='language-py'>def f():\n    return 1\n</code></pre>"
+    "<table><tr><th>A</th><th>B</th></tr><tr><td>1</td><td>2</td></tr></table>"
+    "</main><script>var x = 1;</script></body></html>"
+)
+
+
+def test_markdown_renderer_block_structure():
+    markdown = stm.tree_to_markdown(stm.parse_html(RICH_HTML))
+
+    assert "## Intro" in markdown
+    assert "Some **bold** and [a link](https://ex.com/x)." in markdown
+    assert "- one\n- two\n  - nested" in markdown
+    assert "> quoted" in markdown
+    assert "```py\ndef f():\n    return 1\n```" in markdown
+    assert "| A | B |\n|---|---|\n| 1 | 2 |" in markdown
+    assert "var x" not in markdown
+
+
+def test_markdown_renderer_escapes_block_markers():
+    html = "<p>1. not a list</p><p># not a heading</p><p>* star</p><p>- dash</p><ul><li>2. item</li></ul><p>**kept** a_b 3. x</p>"
+    markdown = stm.tree_to_markdown(stm.parse_html(html))
+
+    assert markdown.split("\n\n")[:4] == ["1\\. not a list", "\\# not a heading", "\\* star", "\\- dash"]
+    assert "- 2\\. item" in markdown
+    assert "**kept** a_b 3. x" in markdown  # only line-leading markers
+
+
+@pytest.mark.parametrize("backend", [
+    "lxml",
+    pytest.param("selectolax", marks=pytest.mark.skipif(stm.SelectolaxParser is None, reason="selectolax not installed")),
+])
+def test_parse_once_backends_share_the_pipeline(backend):
+    options = stm.ConversionOptions(parser_backend=backend, strip_selector="nav", content_selector="main")
+    result = stm.convert_document("https://ex.com/a", RICH_HTML, "text/html", options)
+
+    assert result["markdown"].startswith("## Intro")
+    assert "Home" not in result["markdown"]
+
+
+def test_xhtml_with_xml_declaration():
+    xhtml = '<?xml version="1.0" encoding="utf-8"?>\n<html xmlns="http://www.w3.org/1999/xhtml"><body><h1>Hi</h1></body></html>'
+    assert isinstance(stm.parse_html(xhtml), stm.LxmlTree)
+    assert "# Hi" in stm.convert_document("https://ex.com/a", xhtml, "application/xhtml+xml", stm.ConversionOptions())["markdown"]
+
+
+def test_unparseable_markup_falls_back_to_bs4():
+    assert stm.parse_html("  <!-- nothing here -->  ") is None
+    result = stm.convert_document("https://ex.com/a", "<!-- nothing here -->", "text/html", stm.ConversionOptions())
+    assert result["suffix"] == ".md" and not result["markdown"].strip()
+
+
+def test_bs4_backend_uses_html2text():
+    options = stm.ConversionOptions(parser_backend="bs4")
+    result = stm.convert_document("https://ex.com/a", HTML, "text/html", options)
+
+    assert "# Hello" in result["markdown"]
+
+
+def test_tree_output_formats():
+    """JSON/HTML/text renderers read the same parsed tree"""
+    data = json.loads(stm.convert_document("u", RICH_HTML, "text/html", stm.ConversionOptions(output_format="json"))["content"])
+    assert data["title"] == "Rich"
+    assert "var x" not in data["text"]
+
+    html = stm.convert_document("u", RICH_HTML, "text/html", stm.ConversionOptions(output_format="html"))["content"]
+    assert "<a href='#intro'>Intro</a>" in html
+    assert 'id="intro"' in html
+
+    text = stm.convert_document("u", RICH_HTML, "text/html", stm.ConversionOptions(output_format="text"))["content"]
+    assert "quoted" in text and "<" not in text
@@ -0,0 +1,83 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+import sitemap_to_markdown as stm
+
+
+def _records(count, start=0):
+    return [stm.dataset_record(f"https://ex.com/{i}", f"{i}.md", f"Page {i}", f"# Page {i}\n\n" + "text " * 50,
+                               lastmod="2026-01-01", tokens=i)
+            for i in range(start, start + count)]
+
+
+async def _write(directory, output_format, records, **kwargs):
+    durable = []
+    writer = stm.DatasetWriter(directory, output_format, on_durable=durable.extend, **kwargs)
+    await writer.start()
+    for record in records:
+        await writer.add(record)
+    await writer.close()
+    return writer, durable
+
+
+@pytest.mark.asyncio
+async def test_jsonl_shards_rotate_and_stream_back(tmp_path):
+    writer, durable = await _write(tmp_path, "jsonl", _records(30), shard_bytes=2000, flush_interval=0)
+
+    assert len(writer.shards) > 1
+    assert not list(tmp_path.glob("*.partial"))
+    assert sorted(durable) == sorted(f"https://ex.com/{i}" for i in range(30))
+    rows = list(stm.iter_dataset(tmp_path))
+    assert [row["url"] for row in rows] == [f"https://ex.com/{i}" for i in range(30)]
+    assert list(rows[7]) == [name for name, _ in stm.DATASET_SCHEMA]
+    assert rows[7]["tokens"] == 7 and rows[7]["lastmod"] == "2026-01-01"
+    assert list(stm.iter_dataset(writer.shards[0], columns=["title"]))[0] == {"title": "Page 0"}
+
+
+@pytest.mark.asyncio
+async def test_jsonl_falls_back_to_gzip(tmp_path, monkeypatch):
+    monkeypatch.setattr(stm, "zstandard", None)
+    writer, _ = await _write(tmp_path, "jsonl", _records(3))
+
+    assert [shard.name for shard in writer.shards] == ["part-000001.jsonl.gz"]
+    assert len(list(stm.iter_dataset(tmp_path))) == 3
+
+
+@pytest.mark.asyncio
+async def test_partial_shard_is_salvaged_on_resume(tmp_path):
+    crashed = stm.DatasetWriter(tmp_path, "jsonl")
+    crashed._write_batch(_records(5))  # flushed, but the shard is never finished
+    assert list(tmp_path.glob("*.partial"))
+
+    writer, _ = await _write(tmp_path, "jsonl", _records(2, start=5))
+
+    assert writer.recovered == [f"https://ex.com/{i}" for i in range(5)]
+    assert not list(tmp_path.glob("*.partial"))
+    assert len(list(stm.iter_dataset(tmp_path))) == 7
+
+
+@pytest.mark.asyncio
+async def test_fresh_crawl_replaces_previous_shards(tmp_path):
+    await _write(tmp_path, "jsonl", _records(4))
+    durable = []
+    writer = stm.DatasetWriter(tmp_path, "jsonl", on_durable=durable.extend)
+    await writer.start(clear=True)
+    await writer.add(_records(1, start=9)[0])
+    await writer.close()
+
+    assert [row["url"] for row in stm.iter_dataset(tmp_path)] == ["https://ex.com/9"]
+
+
+@pytest.mark.asyncio
+async def test_parquet_shards(tmp_path):
+    pytest.importorskip("pyarrow")
+    writer, durable = await _write(tmp_path, "parquet", _records(12), shard_bytes=1500, flush_interval=0)
+
+    assert all(shard.suffix == ".parquet" for shard in writer.shards) and len(writer.shards) > 1
+    # Parquet pages only count as durable once their shard is closed
+    assert len(durable) == 12
+    assert [row["url"] for row in stm.iter_dataset(tmp_path, columns=["url"])][-1] == "https://ex.com/11"
+    assert list(stm.iter_dataset(tmp_path))[3]["title"] == "Page 3"
@@ -0,0 +1,107 @@
+import random
+import sys
+from pathlib import Path
+
+import httpx
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+import sitemap_to_markdown as stm
+
+VOCAB = [f"word{i}" for i in range(5000)]
+
+
+def _article(seed, words=400):
+    rng = random.Random(seed)
+    return " ".join(rng.choice(VOCAB) for _ in range(words))
+
+
+def test_simhash_separates_near_and_unrelated_pages():
+    text = _article(1)
+    variant = text + " printed from example com"
+    other = _article(2)
+
+    assert (stm.simhash(text) ^ stm.simhash(variant)).bit_count() <= stm.DEFAULT_DEDUP_DISTANCE
+    assert (stm.simhash(text) ^ stm.simhash(other)).bit_count() > 16
+    assert stm.simhash("too short to compare") is None
+
+
+def test_index_finds_signatures_within_distance():
+    index = stm.SimHashIndex(max_distance=3)
+    signature = random.Random(3).getrandbits(64)
+    index.add(signature, "https://ex.com/a")
+
+    # three flipped bits, each in a different band
+    near = signature ^ (1 << 2) ^ (1 << 20) ^ (1 << 40)
+    assert index.find(near) == "https://ex.com/a"
+    assert index.find(near ^ (1 << 60)) is None
+    # a page never duplicates itself (re-fetched under --update)
+    assert index.find(near, "https://ex.com/a") is None
+
+    index.add(~signature & (2**64 - 1), "https://ex.com/c")
+    assert len(index) == 2
+
+    # a page indexed again (re-fetched, or retried) keeps a single entry with its new signature
+    index.add(signature, "https://ex.com/a")
+    index.add(near ^ (1 << 60), "https://ex.com/a")
+    assert len(index) == 2
+    assert index.find(signature) is None
+    assert index.find(near ^ (1 << 60)) == "https://ex.com/a"
+
+
+@pytest.mark.asyncio
+async def test_near_duplicates_are_recorded_as_aliases(tmp_path):
+    article = _article(4)
+    pages = {
+        "/a": f"<html><body><nav>Home</nav><p>{article}</p></body></html>",
+        "/a/print": f"<html><body><p>{article}</p><p>Printed copy</p></body></html>",
+    }
+
+    def handler(request):
+        return httpx.Response(200, text=pages[request.url.path], headers={"Content-Type": "text/html"})
+
+    manifest = stm.ManifestStore(tmp_path / stm.ManifestStore.FILENAME)
+    ctx = stm.CrawlContext(manifest=manifest, dedup=stm.SimHashIndex())
+    inputs = stm.InputModel(url="https://ex.com", dedup=True)
+
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        assert await stm.process_url(client, "https://ex.com/a", tmp_path, inputs, ctx) == "success"
+        assert await stm.process_url(client, "https://ex.com/a/print", tmp_path, inputs, ctx) == "duplicate"
+
+    entries = manifest.entries()
+    assert entries["https://ex.com/a/print"]["alias_of"] == "https://ex.com/a"
+    assert entries["https://ex.com/a/print"]["path"] is None
+    assert not (tmp_path / "a" / "print.md").exists()
+
+
+@pytest.mark.asyncio
+async def test_page_that_fails_to_write_is_not_an_original(tmp_path, monkeypatch):
+    article = _article(5)
+    pages = {
+        "/a": f"<html><body><p>{article}</p></body></html>",
+        "/b": f"<html><body><p>{article}</p><p>Printed copy</p></body></html>",
+    }
+
+    def handler(request):
+        return httpx.Response(200, text=pages[request.url.path], headers={"Content-Type": "text/html"})
+
+    manifest = stm.ManifestStore(tmp_path / stm.ManifestStore.FILENAME)
+    ctx = stm.CrawlContext(manifest=manifest, dedup=stm.SimHashIndex())
+    inputs = stm.InputModel(url="https://ex.com", dedup=True)
+    real_open = stm.aiofiles.open
+
+    def failing_open(path, *args, **kwargs):
+        if Path(path).name == "a.md":
+            raise OSError("disk full")
+        return real_open(path, *args, **kwargs)
+
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        monkeypatch.setattr(stm.aiofiles, "open", failing_open)
+        assert await stm.process_url(client, "https://ex.com/a", tmp_path, inputs, ctx) == "failed"
+        assert len(ctx.dedup) == 0
+        assert await stm.process_url(client, "https://ex.com/b", tmp_path, inputs, ctx) == "success"
+
+    entries = manifest.entries()
+    assert entries["https://ex.com/b"].get("alias_of") is None  # written, not aliased to the missing /a
+    assert (tmp_path / "b.md").exists()
+    assert ctx.dedup.find(stm.simhash(article)) == "https://ex.com/b"
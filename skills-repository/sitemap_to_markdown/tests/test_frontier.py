@@ -0,0 +1,74 @@
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+import sitemap_to_markdown as stm
+
+
+def _entries(count):
+    return [{"url": f"https://{'ab'[i % 2]}.ex.com/docs/{i}?q=1", "meta": {"lastmod": f"2026-01-{i % 28 + 1:02d}"}}
+            for i in range(count)]
+
+
+@pytest.mark.asyncio
+async def test_entries_round_trip_with_interned_hosts(tmp_path):
+    frontier = stm.Frontier(tmp_path / stm.Frontier.DIRNAME, chunk_entries=4)
+    entries = _entries(10) + [{"url": "https://ex.com", "meta": {"priority": "0.8", "changefreq": "daily"}}]
+    for entry in entries:
+        await frontier.put(entry)
+    await frontier.put(None)
+
+    assert len(frontier) == 11
+    assert frontier.hosts == ["https://a.ex.com", "https://b.ex.com", "https://ex.com"]
+    assert [await frontier.get() for _ in entries] == entries
+    assert await frontier.get() is None
+    assert not frontier.spilled
+
+
+@pytest.mark.asyncio
+async def test_spills_past_the_memory_budget_in_order(tmp_path):
+    spill_dir = tmp_path / stm.Frontier.DIRNAME
+    frontier = stm.Frontier(spill_dir, memory_bytes=400, chunk_entries=3)
+    entries = _entries(200)
+    for entry in entries[:150]:
+        frontier.put_nowait(entry)
+
+    assert frontier.spilled > 100
+    assert len(list(spill_dir.iterdir())) > 1
+    assert frontier.peak_memory < 600
+
+    got = [await frontier.get() for _ in range(120)]
+    for entry in entries[150:]:  # arrives while spilled segments are still queued
+        frontier.put_nowait(entry)
+    frontier.put_nowait(None)
+    while (entry := await frontier.get()) is not None:
+        got.append(entry)
+
+    assert got == entries
+    frontier.close()
+    assert not spill_dir.exists()
+
+
+@pytest.mark.asyncio
+async def test_worker_pool_drains_the_frontier(tmp_path):
+    frontier = stm.Frontier(tmp_path / stm.Frontier.DIRNAME, memory_bytes=256)
+    seen = []
+
+    async def handler(entry):
+        seen.append(entry["url"])
+        await asyncio.sleep(0)
+
+    async def produce():
+        for entry in _entries(50):
+            await frontier.put(entry)
+            await asyncio.sleep(0)
+        await frontier.put(None)
+
+    producer = asyncio.create_task(produce())
+    await stm.WorkerPool(frontier, handler, 4).run()
+    await producer
+
+    assert sorted(seen) == sorted(entry["url"] for entry in _entries(50))
@@ -0,0 +1,64 @@
+import json
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+import sitemap_to_markdown as stm
+
+
+def test_journal_replay_latest_status_wins(tmp_path):
+    journal = stm.CrawlJournal(tmp_path / "_journal")
+    journal.append("https://ex.com/a", "failed")
+    journal.append("https://ex.com/b", "skipped")
+    journal.append("https://ex.com/a", "success")
+    journal.close()
+
+    # A crash mid-write leaves a torn last line
+    segment = next((tmp_path / "_journal").glob("segment-*.jsonl"))
+    with open(segment, "a", encoding="utf-8") as f:
+        f.write('{"u": "https://ex.com/c", "s": "succ')
+
+    reopened = stm.CrawlJournal(tmp_path / "_journal")
+    assert reopened.replay() == {"https://ex.com/a": "success", "https://ex.com/b": "skipped"}
+
+
+def test_journal_rotates_and_compacts(tmp_path, monkeypatch):
+    fsynced = []
+    fsync = stm.os.fsync
+    monkeypatch.setattr(stm.os, "fsync", lambda fd: (fsynced.append(fd), fsync(fd)))
+    journal = stm.CrawlJournal(tmp_path / "_journal", segment_records=2, max_segments=2)
+    for i in range(7):
+        journal.append(f"https://ex.com/{i % 3}", "success" if i % 2 else "failed")
+    assert journal.segment_count == 4
+    assert len(fsynced) == 3  # each full segment, not each record
+
+    expected = journal.replay()
+    journal.sync()  # over max_segments: compacts
+    assert journal.segment_count == 1
+    assert journal.replay() == expected
+
+    # appends after compaction land in a newer segment and still win on replay
+    journal.append("https://ex.com/0", "skipped")
+    journal.close()
+    assert stm.CrawlJournal(tmp_path / "_journal").replay()["https://ex.com/0"] == "skipped"
+
+
+def test_journal_remove(tmp_path):
+    journal = stm.CrawlJournal(tmp_path / "_journal")
+    journal.append("https://ex.com/a", "success")
+    journal.remove()
+    assert not (tmp_path / "_journal").exists()
+
+
+def test_load_pre_journal_checkpoint(tmp_path):
+    """Version 2 checkpoints kept URL lists; they still load for resume"""
+    path = tmp_path / "checkpoint.json"
+    path.write_text(json.dumps({
+        "version": 2, "started_at": "2026-01-01T00:00:00", "last_updated": "2026-01-01T00:00:00",
+        "source_url": "https://ex.com", "sitemap_type": "single",
+        "processed_urls": ["https://ex.com/a"], "failed_urls": [], "skipped_urls": [], "total_processed": 1,
+    }))
+
+    checkpoint = stm.load_checkpoint(str(path))
+    assert checkpoint.processed_urls == ["https://ex.com/a"]
+    assert stm.Checkpoint(started_at="", last_updated="", source_url="", sitemap_type="single").version == 3
@@ -0,0 +1,90 @@
+import gzip
+import json
+import sys
+from pathlib import Path
+
+import httpx
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+import sitemap_to_markdown as stm
+
+
+def _page(url, content_hash, path=None):
+    return {"url": url, "path": path or url.rsplit("/", 1)[1] + ".md", "hash": content_hash, "size": 1, "tokens": 0}
+
+
+def test_external_sort_keeps_last_record_per_url(tmp_path):
+    records = [_page(f"https://ex.com/{i % 7}", f"h{i}") for i in range(30)]
+    out_path = tmp_path / stm.MANIFEST_SORTED_FILENAME
+
+    count = stm.external_sort_jsonl(iter(records), out_path, chunk_records=4)  # 8 runs
+
+    pages = list(stm.iter_sorted_manifest(out_path))
+    assert count == 7
+    assert [page["url"] for page in pages] == sorted(f"https://ex.com/{i}" for i in range(7))
+    assert pages[0]["hash"] == "h28"  # https://ex.com/0 was last written at i=28
+    assert not [p for p in tmp_path.iterdir() if p.name != out_path.name]
+
+
+def test_stream_diff_writes_change_records_and_patches(tmp_path):
+    old_root, new_root = tmp_path / "old", tmp_path / "new"
+    for root, body in ((old_root, "line\nold\n"), (new_root, "line\nnew\n")):
+        root.mkdir()
+        (root / "b.md").write_text(f"---\nurl: https://ex.com/b\ndate: {root.name}\n---\n\n{body}")
+    old = [_page("https://ex.com/a", "1"), _page("https://ex.com/b", "2"), _page("https://ex.com/c", "3")]
+    new = [_page("https://ex.com/b", "9"), _page("https://ex.com/c", "3"), _page("https://ex.com/d", "4")]
+
+    diff = stm.stream_manifest_diff(iter(old), iter(new), tmp_path / "diff.jsonl", patch_path=tmp_path / "diff.patch.gz",
+                                    old_root=old_root, new_root=new_root)
+
+    records = [json.loads(line) for line in (tmp_path / "diff.jsonl").read_text().splitlines()]
+    assert [(r["url"], r["change"]) for r in records] == [
+        ("https://ex.com/a", "removed"), ("https://ex.com/b", "changed"), ("https://ex.com/d", "added")]
+    assert diff["stats"] == {"added_count": 1, "removed_count": 1, "changed_count": 1, "unchanged_count": 1,
+                             "patched_count": 1}
+    patch = gzip.open(tmp_path / "diff.patch.gz", "rt").read()
+    assert "-old\n+new\n" in patch
+    assert "date:" not in patch  # frontmatter is not part of the page diff
+
+
+@pytest.mark.asyncio
+async def test_in_place_recrawl_patches_against_the_baseline_copy(tmp_path):
+    body = {"text": "<html><body><main><p>first version</p></main></body></html>"}
+
+    def handler(request):
+        return httpx.Response(200, text=body["text"], headers={"Content-Type": "text/html"})
+
+    inputs = stm.InputModel(url="https://ex.com")
+    url = "https://ex.com/b"
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        ctx = stm.CrawlContext(manifest=stm.ManifestStore(tmp_path / "old.jsonl"))
+        assert await stm.process_url(client, url, tmp_path, inputs, ctx) == "success"
+        old = list(ctx.manifest.records())
+
+        body["text"] = body["text"].replace("first", "second")
+        ctx = stm.CrawlContext(manifest=stm.ManifestStore(tmp_path / "new.jsonl"),
+                               diff_baseline=tmp_path / stm.DIFF_BASELINE_DIRNAME)
+        assert await stm.process_url(client, url, tmp_path, inputs, ctx) == "success"
+        new = list(ctx.manifest.records())
+
+    assert old[0]["path"] == new[0]["path"]  # overwritten in place
+    diff = stm.stream_manifest_diff(iter(old), iter(new), tmp_path / "diff.jsonl", patch_path=tmp_path / "diff.patch.gz",
+                                    old_root=tmp_path, new_root=tmp_path, baseline_root=ctx.diff_baseline)
+    assert diff["stats"]["changed_count"] == diff["stats"]["patched_count"] == 1
+    patch = gzip.open(tmp_path / "diff.patch.gz", "rt").read()
+    assert "-first version\n+second version\n" in patch
+
+
+def test_open_manifest_pages_reads_legacy_manifests(tmp_path):
+    path = tmp_path / "_manifest.json"
+    path.write_text(json.dumps({"url_content_hashes": {"https://ex.com/b": "x", "https://ex.com/a": "y"}}))
+
+    pages, algorithm, root = stm.open_manifest_pages(path)
+    assert [page["url"] for page in pages] == ["https://ex.com/a", "https://ex.com/b"]
+    assert (algorithm, root) == ("md5", tmp_path)
+
+    stm.external_sort_jsonl(iter([_page("https://ex.com/z", "1")]), tmp_path / stm.MANIFEST_SORTED_FILENAME)
+    path.write_text(json.dumps({"hash_algorithm": "sha256", "pages_file": stm.MANIFEST_SORTED_FILENAME}))
+    pages, algorithm, _ = stm.open_manifest_pages(path)
+    assert [page["url"] for page in pages] == ["https://ex.com/z"] and algorithm == "sha256"
@@ -0,0 +1,51 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+import sitemap_to_markdown as stm
+
+
+def test_manifest_store_latest_entry_wins(tmp_path):
+    path = tmp_path / stm.ManifestStore.FILENAME
+    store = stm.ManifestStore(path)
+    store.record("https://ex.com/a", "a.json", "h1", 10, 3)
+    store.record("https://ex.com/b", "b.json", "h2", 20)
+    store.record("https://ex.com/a", "a.json", "h3", 12, 4)
+    store.close()
+
+    # A crash mid-write leaves a torn last line; the next run starts a new one
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('{"url": "https://ex.com/c", "pa')
+    store = stm.ManifestStore(path)
+    store.record("https://ex.com/d", "d.json", "h4", 5)
+
+    pages = store.entries()
+    assert pages["https://ex.com/a"] == {"path": "a.json", "hash": "h3", "size": 12, "tokens": 4}
+    assert sorted(pages) == ["https://ex.com/a", "https://ex.com/b", "https://ex.com/d"]
+
+    store.compact(pages)
+    assert len(path.read_text().splitlines()) == 3
+    assert stm.ManifestStore(path).entries() == pages
+
+
+def test_diff_ignores_hashes_from_older_manifests():
+    old = {"url_content_hashes": {"https://ex.com/a": "md5hash", "https://ex.com/b": "md5hash"}}
+    new = {"hash_algorithm": "sha256", "url_content_hashes": {"https://ex.com/a": "sha", "https://ex.com/c": "sha"}}
+
+    diff = stm.calculate_diff(old, new)
+    assert (diff["added"], diff["removed"], diff["changed"]) == (["https://ex.com/c"], ["https://ex.com/b"], [])
+
+    new_old = {**old, "hash_algorithm": "sha256"}
+    assert stm.calculate_diff(new_old, new)["changed"] == ["https://ex.com/a"]
+
+
+def test_llms_txt_lists_manifest_pages(tmp_path):
+    manifest = {
+        "source_url": "http://x.com",
+        "crawl_date": "2026",
+        "pages": {"http://x.com/b": {"path": "b.html"}, "http://x.com/a": {"path": "docs/a.html"}},
+    }
+    stm.generate_llms_txt(tmp_path, manifest)
+
+    lines = (tmp_path / "llms.txt").read_text().splitlines()
+    assert lines[-2:] == ["- [b.html](b.html)", "- [docs/a.html](docs/a.html)"]
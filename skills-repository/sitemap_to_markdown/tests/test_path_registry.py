@@ -0,0 +1,114 @@
+import itertools
+import sys
+from pathlib import Path
+
+import httpx
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+import sitemap_to_markdown as stm
+
+
+def test_collisions_are_resolved_in_memory(tmp_path):
+    registry = stm.PathRegistry(tmp_path)
+
+    assert registry.claim("https://ex.com/docs", Path("docs.md")) == Path("docs.md")
+    assert registry.claim("https://ex.com/docs", Path("docs.md")) == Path("docs.md")  # same URL, same file
+    assert registry.claim("https://ex.com/a/b", Path("a/b.md")) == Path("a/b.md")
+
+    # another URL mapping to the same file, a file where a directory is needed, and the reverse
+    other = registry.claim("https://ex.com/docs?v=2", Path("docs.md"))
+    assert other.parent == Path(".") and other != Path("docs.md")
+    blocked = registry.claim("https://ex.com/docs.md/x", Path("docs.md/x.md"))
+    assert blocked.parts[0] != "docs.md"
+    renamed = registry.claim("https://ex.com/a", Path("a"))
+    assert renamed.name.startswith("a_alt_")
+
+    assert registry.collisions == 3
+    assert not any(tmp_path.iterdir())  # nothing touched the filesystem
+    # deterministic: a rebuilt registry makes the same choices
+    assert stm.PathRegistry(tmp_path).claim("https://ex.com/a", Path("a")) == Path("a")
+    replay = stm.PathRegistry(tmp_path)
+    replay.claim("https://ex.com/a/b", Path("a/b.md"))
+    assert replay.claim("https://ex.com/a", Path("a")) == renamed
+
+
+
+def test_contested_names_do_not_depend_on_claim_order(tmp_path):
+    wanted = {
+        "https://ex.com/docs.html": Path("docs.md"),
+        "https://ex.com/docs": Path("docs.md"),
+        "https://ex.com/docs.md": Path("docs.md"),
+        "https://ex.com/a_b": Path("a_b.md"),
+        "https://ex.com/a:b": Path("a_b.md"),
+        "https://ex.com/a": Path("a.md"),
+        "https://ex.com/a.md/b": Path("a.md/b.md"),
+    }
+    outcomes = []
+    for order in itertools.islice(itertools.permutations(wanted), 0, None, 97):
+        registry = stm.PathRegistry(tmp_path)
+        for url in reversed(order):  # as the sitemap streams in
+            registry.reserve(url, wanted[url])
+        outcomes.append({url: registry.claim(url, wanted[url]) for url in order})
+
+    assert len(outcomes) > 50 and all(outcome == outcomes[0] for outcome in outcomes)
+    paths = outcomes[0]
+    assert paths["https://ex.com/docs.md"] == Path("docs.md")  # the URL whose own path it is
+    assert paths["https://ex.com/a:b"] == Path("a_b.md")  # else the smallest URL
+    assert paths["https://ex.com/a.md/b"] == Path("a.md/b.md")  # a directory wins over a file
+    assert paths["https://ex.com/a"].name.startswith("a_alt_")
+    # every renamed URL is suffixed from its own digest alone
+    digest = stm.hashlib.md5(b"https://ex.com/docs").hexdigest()[:8]
+    assert paths["https://ex.com/docs"] == Path(f"docs_{digest}.md")
+
+    # a URL reserved after a worse one was written cannot take the name back
+    registry = stm.PathRegistry(tmp_path)
+    assert registry.claim("https://ex.com/docs", Path("docs.md")) == Path("docs.md")
+    assert registry.claim("https://ex.com/docs.md", Path("docs.md")) != Path("docs.md")
+
+
+def test_registry_is_rebuilt_from_manifest_paths(tmp_path):
+    registry = stm.PathRegistry(tmp_path)
+    registry.add("https://ex.com/docs", "docs.md")
+    registry.add("https://ex.com/guide/", "guide/index.md")
+
+    assert registry.lookup("https://ex.com/guide/") == Path("guide/index.md")
+    assert registry.claim("https://ex.com/docs", Path("docs.md")) == Path("docs.md")
+    assert registry.claim("https://ex.com/DOCS", Path("docs.md")) != Path("docs.md")
+    assert registry.claim("https://ex.com/guide", Path("guide")).name.startswith("guide_alt_")
+
+
+def test_directories_are_created_once(tmp_path, monkeypatch):
+    registry = stm.PathRegistry(tmp_path)
+    calls = []
+    mkdir = Path.mkdir
+    monkeypatch.setattr(Path, "mkdir", lambda self, *a, **k: (calls.append(self), mkdir(self, *a, **k)))
+
+    registry.ensure_dir(Path("a/b/c"))
+    assert calls[0] == tmp_path / "a/b/c" and (tmp_path / "a/b/c").is_dir()
+    calls.clear()
+    for _ in range(3):
+        registry.ensure_dir(Path("a/b/c"))
+    registry.ensure_dir(Path("a/b"))
+    registry.ensure_dir(Path("."))
+
+    assert calls == []
+
+
+@pytest.mark.asyncio
+async def test_process_url_writes_through_the_registry(tmp_path):
+    def handler(request):
+        return httpx.Response(200, text="<html><body><p>Hello</p></body></html>", headers={"Content-Type": "text/html"})
+
+    manifest = stm.ManifestStore(tmp_path / stm.ManifestStore.FILENAME)
+    ctx = stm.CrawlContext(manifest=manifest, paths=stm.PathRegistry(tmp_path))
+    inputs = stm.InputModel(url="https://ex.com")
+
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        for url in ("https://ex.com/a", "https://ex.com/a?page=2", "https://ex.com/a.md/b"):
+            assert await stm.process_url(client, url, tmp_path, inputs, ctx) == "success"
+
+    paths = {url: entry["path"] for url, entry in manifest.entries().items()}
+    assert paths["https://ex.com/a"] == "a.md"
+    assert len(set(paths.values())) == 3
+    assert all((tmp_path / path).is_file() for path in paths.values())
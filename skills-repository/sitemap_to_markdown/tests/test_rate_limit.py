@@ -0,0 +1,75 @@
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+import httpx
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+import sitemap_to_markdown as stm
+
+
+async def _timed_acquires(limiter, urls):
+    start = time.monotonic()
+    stamps = []
+
+    async def one(url):
+        await limiter.acquire(url)
+        stamps.append((url, time.monotonic() - start))
+
+    await asyncio.gather(*[one(u) for u in urls])
+    return stamps
+
+
+@pytest.mark.asyncio
+async def test_limiter_paces_each_host_independently():
+    limiter = stm.HostRateLimiter(rate=20)  # 50ms between requests per host
+    urls = ["http://a.com/1", "http://a.com/2", "http://a.com/3", "http://b.com/1", "http://b.com/2", "http://b.com/3"]
+    stamps = await _timed_acquires(limiter, urls)
+
+    a_times = sorted(t for u, t in stamps if "a.com" in u)
+    b_times = sorted(t for u, t in stamps if "b.com" in u)
+    # Exact spacing within a host, no interference between hosts
+    assert a_times[2] == pytest.approx(0.1, abs=0.03)
+    assert b_times[2] == pytest.approx(0.1, abs=0.03)
+    assert a_times[1] - a_times[0] >= 0.045
+
+
+@pytest.mark.asyncio
+async def test_limiter_pause_and_crawl_delay():
+    limiter = stm.HostRateLimiter(rate=0)  # unlimited unless told otherwise
+    stamps = await _timed_acquires(limiter, ["http://a.com/1", "http://a.com/2"])
+    assert max(t for _, t in stamps) < 0.02
+
+    limiter.pause("http://a.com/x", 0.1)
+    stamps = await _timed_acquires(limiter, ["http://a.com/3", "http://b.com/1"])
+    times = dict(stamps)
+    assert times["http://a.com/3"] >= 0.09
+    assert times["http://b.com/1"] < 0.02
+
+    limiter.set_crawl_delay("c.com", 0.5)
+    assert limiter.host_rate("c.com") == 2.0
+    assert limiter.host_rate("a.com") == 0
+
+
+def test_parse_retry_after():
+    assert stm.parse_retry_after("120") == 120.0
+    assert stm.parse_retry_after(None) is None
+    assert stm.parse_retry_after("garbage") is None
+    assert stm.parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0
+
+
+@pytest.mark.asyncio
+async def test_fetch_with_retry_pauses_host_on_retry_after():
+    responses = iter([httpx.Response(429, headers={"Retry-After": "0.1"}), httpx.Response(200, text="ok")])
+    transport = httpx.MockTransport(lambda request: next(responses))
+    ctx = stm.CrawlContext(limiter=stm.HostRateLimiter(rate=0))
+
+    async with httpx.AsyncClient(transport=transport) as client:
+        start = time.monotonic()
+        response = await stm.fetch_with_retry(client, "http://a.com/page", 0, ctx=ctx)
+        elapsed = time.monotonic() - start
+
+    assert response.status_code == 200
+    assert elapsed >= 0.09
@@ -0,0 +1,101 @@
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+import httpx
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+import sitemap_to_markdown as stm
+
+ROBOTS = {
+    "ex.com": "User-agent: *\nDisallow: /private\nCrawl-delay: 2\n",
+    "cdn.ex.com": "User-agent: *\nDisallow: /\n",
+    "slow.org": "User-agent: *\nRequest-rate: 1/5\n",
+}
+
+
+def _client(fetches, status=None):
+    async def handler(request):
+        fetches.append(request.url.host)
+        await asyncio.sleep(0.01)
+        if status:
+            return httpx.Response(status)
+        if request.url.host in ROBOTS:
+            return httpx.Response(200, text=ROBOTS[request.url.host])
+        return httpx.Response(404)
+    return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+
+@pytest.mark.asyncio
+async def test_one_fetch_per_host_across_workers():
+    fetches = []
+    robots = stm.RobotsCache()
+    urls = ["https://ex.com/a", "https://ex.com/private/b", "https://cdn.ex.com/img.png", "https://other.org/x"]
+    async with _client(fetches) as client:
+        results = await asyncio.gather(*(robots.allowed(client, url) for url in urls * 25))
+
+    assert sorted(fetches) == ["cdn.ex.com", "ex.com", "other.org"]
+    assert results[:4] == [True, False, False, True]  # other.org has no robots.txt
+    assert robots.key("HTTPS://Ex.com:443/a") == "https://ex.com:443"
+
+
+@pytest.mark.asyncio
+async def test_crawl_delay_and_request_rate_pace_the_host():
+    ctx = stm.CrawlContext(limiter=stm.HostRateLimiter(10))
+    robots = stm.RobotsCache()
+    async with _client([]) as client:
+        await robots.rules(client, "https://ex.com/", ctx)
+        await robots.rules(client, "https://slow.org/", ctx)
+
+    assert robots.crawl_delay("https://ex.com/x") == 2
+    assert ctx.limiter.host_rate("ex.com") == 0.5
+    assert ctx.limiter.host_rate("slow.org") == pytest.approx(0.2)
+
+
+@pytest.mark.asyncio
+async def test_cache_is_persisted_and_refreshed_after_the_ttl(tmp_path):
+    path = tmp_path / stm.RobotsCache.FILENAME
+    fetches = []
+    robots = stm.RobotsCache(path)
+    async with _client(fetches) as client:
+        await robots.allowed(client, "https://ex.com/a")
+    async with _client(fetches, status=503) as client:
+        # RFC 9309: an unreachable robots.txt disallows the host until it is fetched again
+        assert not await robots.allowed(client, "https://down.net/a")
+        assert 0 < robots.retry_after("https://down.net/a") <= stm.ROBOTS_ERROR_TTL_SEC
+        assert robots.retry_after("https://ex.com/a") is None
+    robots.save()
+
+    reloaded = stm.RobotsCache.load(path)
+    async with _client(fetches) as client:
+        assert not await reloaded.allowed(client, "https://ex.com/private")
+        assert fetches == ["ex.com", "down.net"]
+
+        reloaded.entries["https://down.net"]["fetched_at"] -= stm.ROBOTS_ERROR_TTL_SEC
+        reloaded.entries["https://ex.com"]["fetched_at"] = time.time() - stm.ROBOTS_TTL_SEC
+        await reloaded.allowed(client, "https://down.net/a")
+        await reloaded.allowed(client, "https://ex.com/a")
+    assert fetches == ["ex.com", "down.net", "down.net", "ex.com"]
+
+
+@pytest.mark.asyncio
+async def test_robots_body_is_capped_while_streaming(monkeypatch):
+    monkeypatch.setattr(stm, "ROBOTS_MAX_BYTES", 1000)
+    sent = []
+
+    async def body():
+        yield b"User-agent: *\nDisallow: /private\n"
+        for _ in range(100):
+            sent.append(1)
+            yield b"# " + b"x" * 97 + b"\n"
+
+    def handler(request):
+        return httpx.Response(200, content=body())
+
+    robots = stm.RobotsCache()
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        assert not await robots.allowed(client, "https://big.com/private/a")
+    assert len(robots.entries["https://big.com"]["text"]) == 1000
+    assert len(sent) < 100  # the rest of the body was never read
@@ -0,0 +1,105 @@
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+import sitemap_to_markdown as stm
+
+
+class SlowStore:
+    """In-memory object store with the two S3 calls the uploader uses"""
+
+    def __init__(self, delay=0.05, fail_first=0):
+        self.objects = {}
+        self.delay = delay
+        self.fail_first = fail_first
+        self.in_flight = 0
+        self.peak = 0
+        self.lock = threading.Lock()
+
+    def head_object(self, Bucket, Key):
+        if Key not in self.objects:
+            raise stm.ClientError({"Error": {"Code": "404"}}, "HeadObject")
+        return {"Metadata": self.objects[Key]}
+
+    def upload_file(self, filename, bucket, key, ExtraArgs=None):
+        with self.lock:
+            if self.fail_first:
+                self.fail_first -= 1
+                raise stm.ClientError({"Error": {"Code": "500"}}, "PutObject")
+            self.in_flight += 1
+            self.peak = max(self.peak, self.in_flight)
+        time.sleep(self.delay)
+        with self.lock:
+            self.in_flight -= 1
+            self.objects[key] = ExtraArgs["Metadata"]
+
+
+def _files(tmp_path, count):
+    paths = []
+    for i in range(count):
+        path = tmp_path / f"page{i}.md"
+        path.write_text(f"page {i}")
+        paths.append(path)
+    return paths
+
+
+@pytest.mark.asyncio
+async def test_uploads_run_concurrently_and_skip_unchanged(tmp_path):
+    store = SlowStore()
+    paths = _files(tmp_path, 16)
+
+    uploader = stm.S3Uploader("bucket", "docs", concurrency=8, client=store)
+    uploader.start()
+    started = time.monotonic()
+    for path in paths:
+        await uploader.submit(path, Path(path.name))
+    await uploader.close()
+
+    assert uploader.uploaded == 16
+    assert store.peak == 8
+    assert time.monotonic() - started < 16 * store.delay / 2
+    assert "docs/page3.md" in store.objects
+
+    again = stm.S3Uploader("bucket", "docs", concurrency=8, client=store)
+    again.start()
+    for path in paths:
+        await again.submit(path, Path(path.name))
+    await again.close()
+    assert (again.uploaded, again.unchanged) == (0, 16)
+
+
+@pytest.mark.asyncio
+async def test_failed_uploads_are_retried(tmp_path, monkeypatch):
+    monkeypatch.setattr(stm, "exponential_backoff", lambda retry: 0)
+    store = SlowStore(delay=0, fail_first=2)
+
+    uploader = stm.S3Uploader("bucket", None, concurrency=1, client=store)
+    uploader.start()
+    await uploader.submit(_files(tmp_path, 1)[0], Path("page0.md"), content_hash="abc")
+    await uploader.close()
+
+    assert uploader.uploaded == 1 and not uploader.failed
+    assert store.objects["page0.md"] == {"sha256": "abc"}
+
+
+@pytest.mark.asyncio
+async def test_upload_to_s3_compatible_store(tmp_path, monkeypatch):
+    moto = pytest.importorskip("moto")
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "test")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "test")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+
+    with moto.mock_aws():
+        stm.boto3.client("s3").create_bucket(Bucket="crawl")
+        uploader = stm.S3Uploader("crawl", "site", concurrency=2)
+        uploader.start()
+        for path in _files(tmp_path, 3):
+            await uploader.submit(path, Path("docs") / path.name)
+        await uploader.close()
+
+        head = stm.boto3.client("s3").head_object(Bucket="crawl", Key="site/docs/page1.md")
+        assert len(head["Metadata"]["sha256"]) == 64
@@ -0,0 +1,125 @@
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+import sitemap_to_markdown as stm
+
+
+@pytest.mark.asyncio
+async def test_worker_pool_keeps_draining_while_one_entry_is_slow():
+    """A slow entry occupies one worker only; the others keep refilling from the queue"""
+    queue = asyncio.Queue()
+    done = []
+    slow_finished = asyncio.Event()
+
+    async def handler(entry):
+        if entry == "slow":
+            await asyncio.sleep(0.2)
+            slow_finished.set()
+        else:
+            await asyncio.sleep(0.001)
+            # Fast entries must complete while the slow one is still in flight
+            assert not slow_finished.is_set()
+        done.append(entry)
+
+    for entry in ["slow"] + [f"fast-{i}" for i in range(20)] + [None]:
+        queue.put_nowait(entry)
+
+    pool = stm.WorkerPool(queue, handler, size=2)
+    await pool.run()
+
+    assert len(done) == 21
+    assert done[-1] == "slow"
+    assert pool.completed == 21
+    assert pool.active == 0
+
+
+@pytest.mark.asyncio
+async def test_worker_pool_survives_handler_errors():
+    queue = asyncio.Queue()
+    done = []
+
+    async def handler(entry):
+        if entry == 1:
+            raise RuntimeError("boom")
+        done.append(entry)
+
+    for entry in [1, 2, 3, None]:
+        queue.put_nowait(entry)
+
+    await stm.WorkerPool(queue, handler, size=3).run()
+    assert sorted(done) == [2, 3]
+
+
+def test_adaptive_concurrency_aimd():
+    controller = stm.AdaptiveConcurrency(initial=4, min_limit=2, max_limit=6, window=10)
+
+    for _ in range(10):
+        controller.record("http://a.com/x", 0.1)
+    assert controller.limit == 5  # additive increase
+
+    for _ in range(30):
+        controller.record("http://a.com/x", 0.1)
+    assert controller.limit == 6  # capped at max
+
+    for _ in range(9):
+        controller.record("http://a.com/x", 0.1)
+    controller.record("http://a.com/x", 0.1, "throttled")
+    assert controller.limit == 3  # multiplicative decrease
+
+    for _ in range(10):
+        controller.record("http://a.com/x", 0.1, "timeout")
+    assert controller.limit == 2  # floored at min
+
+    host = controller.hosts["a.com"]
+    assert host["throttled"] == 1 and host["timeouts"] == 10
+    assert [limit for _, limit in controller.history] == [4, 5, 6, 3, 2]
+
+
+def test_adaptive_concurrency_backs_off_on_latency_inflation():
+    controller = stm.AdaptiveConcurrency(initial=10, window=10)
+    for _ in range(10):
+        controller.record("http://a.com/x", 0.1)
+    assert controller.limit == 11
+    for _ in range(10):
+        controller.record("http://a.com/x", 1.0)
+    assert controller.limit == 10
+
+
+@pytest.mark.asyncio
+async def test_adaptive_concurrency_gates_in_flight_work():
+    controller = stm.AdaptiveConcurrency(initial=2, min_limit=1, max_limit=2)
+    peak = 0
+
+    async def job():
+        nonlocal peak
+        async with controller.slot():
+            peak = max(peak, controller.in_flight)
+            await asyncio.sleep(0.01)
+
+    await asyncio.gather(*[job() for _ in range(8)])
+    assert peak == 2
+    assert controller.in_flight == 0
+
+
+@pytest.mark.asyncio
+async def test_raised_limit_admits_waiters_at_once():
+    controller = stm.AdaptiveConcurrency(initial=1, min_limit=1, max_limit=4, window=1)
+    await controller.acquire()
+    waiters = [asyncio.create_task(controller.acquire()) for _ in range(2)]
+    await asyncio.sleep(0)
+    assert controller.in_flight == 1 and not any(w.done() for w in waiters)
+
+    controller.record("http://a.com/x", 0.1)  # the limit grows to 2 with a slot still held
+    await asyncio.sleep(0)
+    assert controller.limit == 2 and controller.in_flight == 2
+    assert [w.done() for w in waiters] == [True, False]  # first come, first served
+
+    waiters[1].cancel()
+    await asyncio.gather(waiters[1], return_exceptions=True)
+    for _ in range(2):
+        await controller.release()
+    assert controller.in_flight == 0 and not controller._waiters
@@ -0,0 +1,54 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+import sitemap_to_markdown as stm
+
+
+def test_seen_filter_grows_past_initial_capacity():
+    seen = stm.SeenFilter(initial_capacity=100, error_rate=0.01)
+    urls = [f"https://ex.com/page/{i}" for i in range(2000)]
+    for url in urls:
+        seen.add(url)
+
+    assert all(url in seen for url in urls)  # no false negatives
+    assert len(seen.slices) > 1
+    assert seen.capacity >= len(seen)
+    false_positives = sum(f"https://other.com/{i}" in seen for i in range(5000))
+    assert false_positives / 5000 < 0.02
+    assert seen.estimated_false_positive_rate() < 0.01
+
+
+def test_seen_filter_dump_and_mmap_load(tmp_path):
+    path = tmp_path / stm.SeenFilter.FILENAME
+    seen = stm.SeenFilter(initial_capacity=50)
+    for i in range(300):
+        seen.add(f"https://ex.com/{i}")
+    seen.dump(path)
+
+    loaded = stm.SeenFilter.load(path)
+    assert len(loaded) == len(seen)
+    assert all(f"https://ex.com/{i}" in loaded for i in range(300))
+
+    # copy-on-write: adding to the mapped filter does not modify the dump
+    loaded.add("https://ex.com/new")
+    assert "https://ex.com/new" in loaded
+    assert "https://ex.com/new" not in stm.SeenFilter.load(path)
+
+
+def test_seen_filter_stats():
+    seen = stm.SeenFilter(initial_capacity=10)
+    seen.add("https://ex.com/a")
+    stats = seen.stats()
+
+    assert stats["count"] == 1
+    assert stats["target_false_positive_rate"] == stm.DEFAULT_SEEN_ERROR_RATE
+    assert 0 <= stats["estimated_false_positive_rate"] < stm.DEFAULT_SEEN_ERROR_RATE
+
+
+def test_seen_filter_option_is_validated():
+    assert stm.InputModel(url="https://ex.com", seen_filter="set").seen_filter == "set"
+    with pytest.raises(ValueError, match="seen_filter"):
+        stm.InputModel(url="https://ex.com", seen_filter="exact")
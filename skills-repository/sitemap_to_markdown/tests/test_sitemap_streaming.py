@@ -0,0 +1,141 @@
+import asyncio
+import gzip
+import sys
+from pathlib import Path
+
+import httpx
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+import sitemap_to_markdown as stm
+
+FIXTURES = Path(__file__).parent / "fixtures"
+
+
+def test_parser_handles_gzip_fed_byte_by_byte():
+    """Gzipped sitemaps are detected and parsed incrementally, whatever the chunking"""
+    data = gzip.compress((FIXTURES / "sample_sitemap.xml").read_bytes())
+    parser = stm.SitemapStreamParser()
+    entries = []
+    for i in range(len(data)):
+        entries.extend(parser.feed(data[i:i + 1]))
+    entries.extend(parser.close())
+
+    assert len(entries) == 10
+    assert entries[0] == ("url", "https://example.com/", {"lastmod": "2026-01-01", "changefreq": "daily", "priority": "1.0"})
+    assert not parser.is_index
+
+
+def test_parser_detects_sitemap_index():
+    parser = stm.SitemapStreamParser()
+    entries = parser.feed((FIXTURES / "sample_sitemap_index.xml").read_bytes()) + parser.close()
+
+    assert parser.is_index
+    assert [kind for kind, _, _ in entries] == ["sitemap", "sitemap"]
+
+
+def test_parser_ignores_extension_namespaces():
+    """image:loc inside a <url> must not replace the page location"""
+    xml = (
+        '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9" '
+        'xmlns:image="http://www.google.com/schemas/sitemap-image/1.1">'
+        '<url><loc>https://example.com/page</loc>'
+        '<image:image><image:loc>https://cdn.example.com/a.png</image:loc></image:image></url>'
+        '</urlset>'
+    )
+    assert list(stm.stream_sitemap_urls(xml)) == [("https://example.com/page", {})]
+
+
+@pytest.mark.asyncio
+async def test_sitemap_stream_over_http():
+    data = gzip.compress((FIXTURES / "sample_sitemap.xml").read_bytes())
+    transport = httpx.MockTransport(lambda request: httpx.Response(200, content=data))
+
+    async with httpx.AsyncClient(transport=transport) as client:
+        stream = stm.SitemapStream(client, "https://example.com/sitemap.xml.gz")
+        urls = [loc async for kind, loc, meta in stream]
+
+    assert len(urls) == 10
+    assert stream.count == 10
+    assert not stream.failed
+
+
+@pytest.mark.asyncio
+async def test_sitemap_stream_reports_failure(monkeypatch):
+    monkeypatch.setattr(stm, "exponential_backoff", lambda retry: 0)
+    transport = httpx.MockTransport(lambda request: httpx.Response(500))
+
+    async with httpx.AsyncClient(transport=transport) as client:
+        stream = stm.SitemapStream(client, "https://example.com/sitemap.xml")
+        urls = [loc async for kind, loc, meta in stream]
+
+    assert urls == []
+    assert stream.failed
+
+
+def _index(*locs):
+    body = "".join(f"<sitemap><loc>{loc}</loc></sitemap>" for loc in locs)
+    return f'<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">{body}</sitemapindex>'
+
+
+def _urlset(*locs):
+    body = "".join(f"<url><loc>{loc}</loc></url>" for loc in locs)
+    return f'<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">{body}</urlset>'
+
+
+@pytest.mark.asyncio
+async def test_fanout_recurses_with_cycle_detection_and_bounded_parallelism():
+    docs = {
+        "https://ex.com/a.xml": _urlset("https://ex.com/1", "https://ex.com/2"),
+        "https://ex.com/nested.xml": _index("https://ex.com/b.xml", "https://ex.com/nested.xml", "https://ex.com/a.xml"),
+        "https://ex.com/b.xml": _urlset("https://ex.com/3"),
+    }
+    fetches = []
+    in_flight = 0
+    peak = 0
+
+    async def handler(request):
+        nonlocal in_flight, peak
+        fetches.append(str(request.url))
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        return httpx.Response(200, text=docs[str(request.url)])
+
+    found = []
+
+    async def on_url(loc, meta):
+        found.append(loc)
+        return True
+
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        fanout = stm.SitemapFanout(client, on_url, concurrency=1)
+        fanout.add("https://ex.com/a.xml")
+        fanout.add("https://ex.com/nested.xml")
+        await fanout.join()
+        await fanout.close()
+
+    assert sorted(found) == ["https://ex.com/1", "https://ex.com/2", "https://ex.com/3"]
+    assert sorted(fetches) == sorted(docs)  # each sitemap fetched exactly once
+    assert peak == 1
+    assert fanout.expanded == 3
+
+
+@pytest.mark.asyncio
+async def test_fanout_stops_when_consumer_declines():
+    transport = httpx.MockTransport(lambda request: httpx.Response(200, text=_urlset("https://ex.com/1", "https://ex.com/2")))
+    found = []
+
+    async def on_url(loc, meta):
+        found.append(loc)
+        return False
+
+    async with httpx.AsyncClient(transport=transport) as client:
+        fanout = stm.SitemapFanout(client, on_url)
+        fanout.add("https://ex.com/a.xml")
+        await fanout.join()
+        await fanout.close()
+
+    assert found == ["https://ex.com/1"]
+    assert fanout.stopped
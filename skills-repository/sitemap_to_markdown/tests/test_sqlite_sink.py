@@ -0,0 +1,99 @@
+import sqlite3
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+import sitemap_to_markdown as stm
+
+
+@pytest.mark.asyncio
+async def test_sink_batches_rows_and_indexes_them(tmp_path):
+    db_path = tmp_path / "pages.db"
+    sink = stm.SQLiteSink(db_path, fts=True, batch_rows=3, flush_interval=10)
+    await sink.start()
+    for i in range(7):
+        await sink.submit(f"https://ex.com/{i}", "success", f"# Page {i}\n\nabout widget{i}", f"Page {i}",
+                          f"{i}.md", fetch_ms=5.0, convert_ms=1.0)
+    await sink.close()
+
+    assert sink.written == 7
+    assert sink.commits == 3  # 3 + 3 + final flush of 1
+
+    conn = sqlite3.connect(db_path)
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    row = conn.execute("SELECT url, status, title, hash, path FROM pages WHERE url = 'https://ex.com/4'").fetchone()
+    assert row[1:3] == ("success", "Page 4")
+    assert len(row[3]) == 64
+    assert conn.execute("SELECT url FROM pages_fts WHERE pages_fts MATCH 'widget5'").fetchall() == [("https://ex.com/5",)]
+    conn.close()
+
+
+@pytest.mark.asyncio
+async def test_failed_refetch_keeps_last_content(tmp_path):
+    db_path = tmp_path / "pages.db"
+    sink = stm.SQLiteSink(db_path, fts=True)
+    await sink.start()
+    await sink.submit("https://ex.com/a", "success", "old content", "A")
+    await sink.submit("https://ex.com/a", "failed", fetch_ms=30000.0)
+    await sink.close()
+
+    conn = sqlite3.connect(db_path)
+    assert conn.execute("SELECT content, status, title FROM pages").fetchone() == ("old content", "failed", "A")
+    assert conn.execute("SELECT count(*) FROM pages_fts WHERE pages_fts MATCH 'old'").fetchone()[0] == 1
+    conn.close()
+
+
+@pytest.mark.asyncio
+async def test_sink_migrates_existing_database(tmp_path):
+    db_path = tmp_path / "pages.db"
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TABLE pages (url TEXT PRIMARY KEY, content TEXT, date TEXT, status TEXT)")
+    conn.execute("INSERT INTO pages VALUES ('https://ex.com/old', 'legacy text', '2025-01-01', 'success')")
+    conn.commit()
+    conn.close()
+
+    sink = stm.SQLiteSink(db_path, fts=True)
+    await sink.start()
+    await sink.close()
+
+    conn = sqlite3.connect(db_path)
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(pages)")]
+    assert columns[:4] == ["url", "content", "date", "status"]
+    assert "title" in columns and "fetch_ms" in columns
+    # existing rows are indexed when the FTS table is first created
+    assert conn.execute("SELECT url FROM pages_fts WHERE pages_fts MATCH 'legacy'").fetchall() == [("https://ex.com/old",)]
+    conn.close()
+
+
+@pytest.mark.asyncio
+async def test_failed_batch_is_retried_then_written_row_by_row(tmp_path, monkeypatch):
+    monkeypatch.setattr(stm, "exponential_backoff", lambda retry: 0)
+    db_path = tmp_path / "pages.db"
+    sink = stm.SQLiteSink(db_path, batch_rows=10, flush_interval=10)
+    await sink.start()
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TRIGGER reject BEFORE INSERT ON pages WHEN NEW.url = 'https://ex.com/bad' "
+                 "BEGIN SELECT RAISE(ABORT, 'rejected'); END")
+    conn.commit()
+
+    real_write = sink._write
+    calls = []
+
+    def flaky_write(rows):
+        calls.append(len(rows))
+        if len(calls) == 1:
+            raise sqlite3.OperationalError("database is locked")
+        real_write(rows)
+
+    monkeypatch.setattr(sink, "_write", flaky_write)
+    for name in ("a", "bad", "b"):
+        await sink.submit(f"https://ex.com/{name}", "success", f"page {name}")
+    await sink.close()
+
+    # a locked database, then the bad row failing every batch attempt, then one row at a time
+    assert calls == [3] * stm.MAX_RETRIES + [1, 1, 1]
+    assert sink.stats() == {"written": 2, "transactions": 2, "failed": 1}
+    assert [row[0] for row in conn.execute("SELECT url FROM pages ORDER BY url")] == ["https://ex.com/a", "https://ex.com/b"]
+    conn.close()
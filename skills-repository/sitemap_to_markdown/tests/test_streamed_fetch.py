@@ -0,0 +1,78 @@
+import sys
+from pathlib import Path
+
+import httpx
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+import sitemap_to_markdown as stm
+
+
+class TrackedStream(httpx.AsyncByteStream):
+    """A response body that records how much of it was consumed"""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.sent = 0
+
+    async def __aiter__(self):
+        for chunk in self.chunks:
+            self.sent += 1
+            yield chunk
+
+
+def _client(stream, content_type, **headers):
+    def handler(request):
+        return httpx.Response(200, headers={"Content-Type": content_type, **headers}, stream=stream)
+    return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+
+def test_page_content_types():
+    assert stm.page_content_type_allowed("text/html; charset=utf-8")
+    assert stm.page_content_type_allowed("application/atom+xml")
+    assert stm.page_content_type_allowed("")
+    assert not stm.page_content_type_allowed("application/octet-stream")
+    assert not stm.page_content_type_allowed("application/pdf")
+    assert stm.page_content_type_allowed("application/pdf", pdf=True)
+
+
+@pytest.mark.asyncio
+async def test_unwanted_content_type_is_rejected_before_the_body():
+    stream = TrackedStream([b"x" * 1024] * 100)
+    async with _client(stream, "application/zip") as client:
+        with pytest.raises(stm.FetchRejected):
+            await stm.fetch_with_retry(client, "https://ex.com/big.zip", 0, accept=stm.page_content_type_allowed)
+    assert stream.sent == 0
+
+
+@pytest.mark.asyncio
+async def test_body_over_the_limit_stops_the_download():
+    stream = TrackedStream([b"<p>" + b"x" * 1000] * 100)  # no Content-Length
+    async with _client(stream, "text/html") as client:
+        with pytest.raises(stm.FetchRejected):
+            await stm.fetch_with_retry(client, "https://ex.com/huge", 0, max_bytes=5000)
+    assert stream.sent == 5  # 5 x 1003 bytes crosses the limit
+
+    async with _client(TrackedStream([b"x"]), "text/html", **{"Content-Length": "999999"}) as client:
+        with pytest.raises(stm.FetchRejected, match="Content-Length"):
+            await stm.fetch_with_retry(client, "https://ex.com/huge", 0, max_bytes=5000)
+
+
+@pytest.mark.asyncio
+async def test_streamed_body_is_decoded_with_its_charset():
+    text = "<p>café</p>" * 50
+    stream = TrackedStream([text.encode("latin-1")[:100], text.encode("latin-1")[100:]])
+    async with _client(stream, "text/html; charset=latin-1") as client:
+        page = await stm.fetch_with_retry(client, "https://ex.com/a", 0, max_bytes=10_000)
+
+    assert isinstance(page, stm.FetchedPage) and page.status_code == 200
+    assert page.size == len(text) and page.text == text
+
+
+@pytest.mark.asyncio
+async def test_process_url_skips_binaries(tmp_path):
+    stream = TrackedStream([b"\x00" * 1024] * 10)
+    async with _client(stream, "application/octet-stream") as client:
+        status = await stm.process_url(client, "https://ex.com/file", tmp_path, stm.InputModel(url="https://ex.com"))
+    assert status == "skipped"
+    assert stream.sent == 0 and not list(tmp_path.iterdir())
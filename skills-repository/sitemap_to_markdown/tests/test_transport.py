@@ -0,0 +1,120 @@
+import asyncio
+import sys
+from pathlib import Path
+
+import httpcore
+import httpx
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+import sitemap_to_markdown as stm
+
+
+def test_accept_encoding_only_offers_decodable_codecs(monkeypatch):
+    monkeypatch.setattr(stm, "zstandard", None)
+    monkeypatch.setattr(stm, "brotli", None)
+    assert stm.accept_encoding() == "gzip, deflate"
+    monkeypatch.setattr(stm, "zstandard", object())
+    monkeypatch.setattr(stm, "brotli", object())
+    assert stm.accept_encoding() == "zstd, br, gzip, deflate"
+
+
+@pytest.mark.asyncio
+async def test_per_host_cap_and_request_stats():
+    in_flight = {"a.com": 0, "b.com": 0}
+    peak = {"a.com": 0, "b.com": 0}
+
+    async def handler(request):
+        host = request.url.host
+        in_flight[host] += 1
+        peak[host] = max(peak[host], in_flight[host])
+        await asyncio.sleep(0.01)
+        in_flight[host] -= 1
+        return httpx.Response(200, text="ok")
+
+    transport = stm.CrawlTransport(per_host=2)
+    transport.inner = httpx.MockTransport(handler)
+    async with httpx.AsyncClient(transport=transport) as client:
+        urls = [f"https://{host}/{i}" for host in ("a.com", "b.com") for i in range(6)]
+        responses = await asyncio.gather(*(client.get(url) for url in urls))
+
+    assert all(response.text == "ok" for response in responses)
+    assert peak == {"a.com": 2, "b.com": 2}
+    summary = transport.stats.summary()
+    assert summary["requests"] == 12 and summary["hosts"]["a.com"]["requests"] == 6
+
+
+class FakeBackend(httpcore.AsyncNetworkBackend):
+    def __init__(self, unreachable=()):
+        self.connected = []
+        self.unreachable = set(unreachable)
+
+    async def connect_tcp(self, host, port, timeout=None, local_address=None, socket_options=None):
+        self.connected.append(host)
+        if host in self.unreachable:
+            raise httpcore.ConnectError(f"{host} unreachable")
+        return object()
+
+
+@pytest.mark.asyncio
+async def test_dns_cache_resolves_each_host_once():
+    stats = stm.TransportStats()
+    inner = FakeBackend()
+    backend = stm.CachingNetworkBackend(inner, stats)
+
+    await asyncio.gather(*(backend.connect_tcp("localhost", 443) for _ in range(5)))
+    await backend.connect_tcp("127.0.0.2", 443)  # IP literals are not looked up
+
+    assert stats.dns_lookups == 1 and stats.dns_hits == 4
+    assert inner.connected[-1] == "127.0.0.2" and "localhost" not in inner.connected
+    summary = stats.summary()
+    assert summary["connections"] == 6 and summary["hosts"]["localhost"]["connections"] == 5
+
+
+@pytest.mark.asyncio
+async def test_dns_cache_falls_through_unreachable_addresses(monkeypatch):
+    async def getaddrinfo(host, port, **kwargs):
+        return [(None, None, None, "", (address, port)) for address in ("::1", "::1", "127.0.0.1", "127.0.0.2")]
+
+    monkeypatch.setattr(asyncio.get_running_loop(), "getaddrinfo", getaddrinfo)
+    inner = FakeBackend(unreachable={"::1"})
+    backend = stm.CachingNetworkBackend(inner, stm.TransportStats())
+
+    await backend.connect_tcp("dual.example", 443)
+    await backend.connect_tcp("dual.example", 443)
+    assert inner.connected == ["::1", "127.0.0.1", "127.0.0.1"]  # the working address is tried first next time
+
+    inner.unreachable = {"::1", "127.0.0.1", "127.0.0.2"}
+    with pytest.raises(httpcore.ConnectError):
+        await backend.connect_tcp("dual.example", 443)
+    assert ("dual.example", 443) not in backend._cache
+
+
+def test_environment_proxies_are_honoured(monkeypatch):
+    monkeypatch.setenv("HTTP_PROXY", "http://proxy.local:3128")
+    monkeypatch.setenv("NO_PROXY", "internal.ex.com, 10.0.0.0/8")
+    transport = stm.CrawlTransport()
+
+    proxied = transport.transport_for(httpx.URL("http://ex.com/a"))
+    assert proxied is not transport.inner
+    assert transport.transport_for(httpx.URL("http://internal.ex.com/a")) is transport.inner
+    assert transport.transport_for(httpx.URL("http://docs.internal.ex.com/a")) is transport.inner
+    assert transport.transport_for(httpx.URL("http://notinternal.ex.com/a")) is proxied
+    assert transport.transport_for(httpx.URL("http://10.1.2.3/a")) is transport.inner
+    assert transport.transport_for(httpx.URL("https://ex.com/a")) is transport.inner  # no HTTPS_PROXY
+
+    monkeypatch.setenv("NO_PROXY", "*")
+    assert not stm.CrawlTransport().mounts
+
+    # an explicit --proxy (or trust_env=False) replaces the environment's settings
+    assert not stm.CrawlTransport(proxy="http://other:8080").mounts
+    assert not stm.CrawlTransport(trust_env=False).mounts
+
+
+@pytest.mark.asyncio
+async def test_pool_errors_surface_as_httpx_errors():
+    backend = stm.CachingNetworkBackend(FakeBackend(unreachable={"127.0.0.1"}), stm.TransportStats())
+    transport = stm.PoolTransport(httpcore.AsyncConnectionPool(network_backend=backend))
+    async with httpx.AsyncClient(transport=transport) as client:
+        with pytest.raises(httpx.ConnectError):
+            await client.get("http://127.0.0.1/a")
@@ -0,0 +1,54 @@
+import sys
+from pathlib import Path
+
+import httpx
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+import sitemap_to_markdown as stm
+
+FIXTURES = Path(__file__).parent / "fixtures"
+
+
+def test_path_prefix_trie():
+    trie = stm.PathPrefixTrie(["/blog", "/api/v1", "/api"])
+    assert trie.matches("/blog-post") and trie.matches("/api/v2") and trie.matches("/blog")
+    assert not trie.matches("/bl") and not trie.matches("/about")
+    assert not stm.PathPrefixTrie([])
+    assert stm.PathPrefixTrie(["/"]).matches("/anything")
+
+
+def test_matcher_names_the_rejecting_rule():
+    matcher = stm.UrlMatcher(include_pattern=r"ex\.com", exclude_paths="/admin, /private",
+                             priority_min=0.5, changefreq="daily,Weekly")
+
+    assert matcher.check("https://ex.com/a", {"priority": "0.9", "changefreq": "weekly"}) is None
+    assert matcher.check("https://other.org/a", {}) == "include_pattern"
+    assert matcher.check("https://ex.com/private/x", {}) == "exclude_paths"
+    assert matcher.check("https://ex.com/a", {"priority": "0.2"}) == "priority_min"
+    assert matcher.check("https://ex.com/a", {"priority": "high", "changefreq": "daily"}) is None
+    assert matcher.check("https://ex.com/a", {"changefreq": "yearly"}) == "changefreq"
+    assert not stm.UrlMatcher().active and stm.UrlMatcher()("anything", {})
+
+
+def test_matcher_is_compiled_once_per_filter_set():
+    inputs = stm.InputModel(url="x", include_paths="/blog")
+    assert stm.UrlMatcher.from_inputs(inputs) is stm.UrlMatcher.from_inputs(stm.InputModel(url="y", include_paths="/blog"))
+
+
+@pytest.mark.asyncio
+async def test_filter_dry_run_counts_without_fetching_pages():
+    requested = []
+
+    def handler(request):
+        requested.append(request.url.path)
+        return httpx.Response(200, content=(FIXTURES / "sample_sitemap.xml").read_bytes())
+
+    inputs = stm.InputModel(url="https://example.com", include_paths="/products,/blog,/services", max_pages=4)
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        report = await stm.filter_dry_run(client, "https://example.com/sitemap.xml", stm.UrlMatcher.from_inputs(inputs), inputs)
+
+    assert requested == ["/sitemap.xml"]
+    assert (report["total_urls"], report["matched"], report["would_process"]) == (10, 6, 4)
+    assert report["rejected"] == {"include_paths": 4}
+    assert report["sample"][0] == "https://example.com/products/widget-a"